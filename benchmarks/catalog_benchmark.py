@@ -0,0 +1,88 @@
+"""Template catalog lookup latency: per-request nested queries vs. the in-memory TemplateCatalog index.
+
+Usage: python benchmarks/catalog_benchmark.py [--patterns 10000] [--lookups 2000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime
+from statistics import median
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['DB_URI'] = f"sqlite:///{tempfile.mkdtemp()}/catalog_benchmark.db"
+
+from sqlalchemy import insert  # noqa: E402
+
+from catalog_manager import TemplateCatalog  # noqa: E402
+from db_manager import (DatabaseManager, IngestionPattern, IngestionPatternJobTemplateRelationship,  # noqa: E402
+                        JobTemplate)
+
+
+def seed(db_manager, pattern_count):
+    now = datetime.now()
+    with db_manager.app.app_context():
+        session = db_manager.db.session
+        session.execute(insert(IngestionPattern), [
+            {'pattern_name': f"P{i}", 'source': f"SRC{i % 100}", 'destination': f"DST{i // 100}",
+             'create_timestamp': now} for i in range(pattern_count)])
+        session.execute(insert(JobTemplate), [
+            {'sch_job_template_id': f"template-{i}", 'delete_after_completion': False,
+             'source_runtime_parameters': {'Dir': f"/data/{i}"}, 'destination_runtime_parameters': {'Table': f"t{i}"},
+             'source_connection_info': {}, 'destination_connection_info': {}, 'create_timestamp': now}
+            for i in range(pattern_count)])
+        session.execute(insert(IngestionPatternJobTemplateRelationship), [
+            {'ingestion_pattern_id': i + 1, 'job_template_id': i + 1} for i in range(pattern_count)])
+        session.commit()
+
+
+def nested_lookup(db, source, destination):
+    # The original JobTemplateManager.get_job_template: one query per pattern and per relationship
+    for pattern in db.session.query(IngestionPattern).filter(IngestionPattern.source == source,
+                                                             IngestionPattern.destination == destination).all():
+        for relationship in db.session.query(IngestionPatternJobTemplateRelationship).filter(
+                IngestionPatternJobTemplateRelationship.ingestion_pattern_id == pattern.ingestion_pattern_id).all():
+            for job_template in db.session.query(JobTemplate).filter(
+                    JobTemplate.job_template_id == relationship.job_template_id).all():
+                return job_template
+
+
+def measure(lookup, pairs):
+    latencies = []
+    for source, destination in pairs:
+        started = perf_counter()
+        assert lookup(source, destination) is not None
+        latencies.append((perf_counter() - started) * 1e6)
+    latencies.sort()
+    return {'p50_us': round(median(latencies), 2), 'p99_us': round(latencies[int(len(latencies) * 0.99)], 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--patterns', type=int, default=10000)
+    parser.add_argument('--lookups', type=int, default=2000)
+    args = parser.parse_args()
+
+    db_manager = DatabaseManager()
+    db_manager.create_tables()
+    seed(db_manager, args.patterns)
+    pairs = [(f"SRC{i % 100}", f"DST{i // 100}") for i in random.choices(range(args.patterns), k=args.lookups)]
+
+    with db_manager.app.app_context():
+        nested = measure(lambda source, destination: nested_lookup(db_manager.db, source, destination), pairs)
+
+    catalog = TemplateCatalog(db_manager)
+    started = perf_counter()
+    catalog.entries()
+    load_ms = round((perf_counter() - started) * 1000, 2)
+    indexed = measure(catalog.get, pairs)
+
+    print(f"patterns={args.patterns} lookups={args.lookups}")
+    print(f"nested queries : {nested}")
+    print(f"catalog index  : {indexed} (initial load {load_ms} ms)")
+
+
+if __name__ == "__main__":
+    main()
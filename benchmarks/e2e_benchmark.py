@@ -0,0 +1,424 @@
+"""End-to-end latency and throughput of the web app against an in-process fake ControlHub, no network needed.
+
+Drives the app through Flask test clients (--clients concurrent users) on a throwaway database, with ControlHub
+replaced by benchmarks/fake_controlhub.py (--sch-latency-ms per call, --failure-rate of calls failing, started jobs
+running for --job-duration seconds). Scenarios:
+  wizard      the job submission wizard, from picking the pattern to starting the job
+  bulk        bulk submissions of --bulk-rows runtime parameter sets
+  monitor     --monitor-jobs jobs in flight at once: CPU time, ControlHub calls and status check lag of the job monitor
+  pagination  walking the /jobs pages of --jobs-rows job runs
+  sse         --sse-clients progress feed viewers receiving --sse-events progress snapshots
+
+Usage: python benchmarks/e2e_benchmark.py [--scenarios wizard bulk monitor pagination sse] [--clients 4]
+                                          [--output e2e.json] [--compare previous.json]
+  --output saves the results as JSON, --compare prints the change of every latency and throughput from a saved run
+"""
+import argparse
+import html
+import io
+import json
+import logging
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from itertools import count
+from statistics import median
+from time import perf_counter, process_time, sleep, time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# --output and --compare paths are relative to where the benchmark was started
+STARTED_IN = os.getcwd()
+WORK_DIR = tempfile.mkdtemp(prefix='ingesthub-e2e-')
+sys.path.insert(0, REPO_DIR)
+os.environ.update(DB_URI=f"sqlite:///{WORK_DIR}/e2e_benchmark.db", MONITOR_IN_PROCESS='true',
+                  CATALOG_SEED_FILE=os.path.join(REPO_DIR, 'sql', 'catalog.json'))
+os.environ.setdefault('FLASK_KEY', 'benchmark')
+# the app's log file lands in WORK_DIR
+os.chdir(WORK_DIR)
+
+from sqlalchemy import insert, select, func  # noqa: E402
+
+from db_manager import JobInstance, JobTemplate  # noqa: E402
+from fake_controlhub import FakeControlHub, install  # noqa: E402
+from ingest_hub import create_app, start_background_services, stop_background_services  # noqa: E402
+from ingesthub_logger import Logger  # noqa: E402
+from progress_manager import JobProgress  # noqa: E402
+
+SCENARIOS = ['wizard', 'bulk', 'monitor', 'pagination', 'sse']
+NEXT_PAGE = re.compile(r'href="([^"]*after=[^"]*)"')
+PREVIOUS_PAGE = re.compile(r'href="([^"]*before=[^"]*)"')
+# job runs inserted per statement when seeding the job history
+SEED_CHUNK_SIZE = 50000
+_users = count(1)
+
+
+def percentiles(latencies_ms):
+    if not latencies_ms:
+        return {'p50_ms': None, 'p99_ms': None}
+    latencies_ms = sorted(latencies_ms)
+    return {'p50_ms': round(median(latencies_ms), 2),
+            'p99_ms': round(latencies_ms[min(int(len(latencies_ms) * 0.99), len(latencies_ms) - 1)], 2)}
+
+
+def logged_in_client(app):
+    # registering logs the new user in
+    client = app.test_client()
+    user = next(_users)
+    client.post('/register', data={'name': f"bench{user}", 'email': f"bench{user}@example.com", 'password': 'bench'})
+    return client
+
+
+def timed(latencies, name, fn):
+    started = perf_counter()
+    result = fn()
+    latencies.setdefault(name, []).append((perf_counter() - started) * 1000)
+    return result
+
+
+def run_clients(app, clients, operation):
+    # Runs operation(client, latencies) on every client in its own thread; returns the latencies per step, the
+    # number of failed operations and the wall time
+    test_clients = [logged_in_client(app) for _ in range(clients)]
+    results = [({}, []) for _ in range(clients)]
+
+    def run(client, latencies, errors):
+        try:
+            operation(client, latencies)
+        except Exception as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=run, args=(client, *result)) for client, result in zip(test_clients, results)]
+    started = perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = perf_counter() - started
+    latencies = {}
+    for client_latencies, _ in results:
+        for name, values in client_latencies.items():
+            latencies.setdefault(name, []).extend(values)
+    return latencies, [error for _, errors in results for error in errors], wall
+
+
+def redirect_target(response, expected):
+    location = response.headers.get('Location', '')
+    if response.status_code != 302 or expected not in location:
+        raise RuntimeError(f"expected a redirect to {expected}, got {response.status_code} {location}")
+    return location
+
+
+def pick_template(app):
+    components = app.extensions['ingest_hub']
+    with app.app_context():
+        job_template_manager = components.job_template_manager
+        source = job_template_manager.get_sources()[0]
+        destination = job_template_manager.get_destinations(source)[0]
+        return source, destination, job_template_manager.get_job_template(source, destination)
+
+
+def calls_since(sch, before):
+    return {operation: calls - before.get(operation, 0) for operation, calls in sch.calls.items()
+            if calls - before.get(operation, 0)}
+
+
+def wait_for_monitor(monitor, timeout):
+    deadline = time() + timeout
+    while monitor.in_flight() and time() < deadline:
+        sleep(0.2)
+    return monitor.in_flight() == 0
+
+
+def job_run_count(app):
+    with app.app_context():
+        return app.extensions['ingest_hub'].db_manager.db.session.execute(
+            select(func.count()).select_from(JobInstance)).scalar()
+
+
+def wizard_scenario(app, sch, args):
+    source, destination, job_template = pick_template(app)
+    source_parameters = dict(job_template.source_runtime_parameters)
+    target_parameters = dict(job_template.destination_runtime_parameters)
+    suffix_parameter = next(iter(source_parameters))
+
+    def operation(client, latencies):
+        for _ in range(args.iterations):
+            started = perf_counter()
+            timed(latencies, 'templates_page', lambda: client.get('/templates'))
+            location = redirect_target(timed(latencies, 'templates_submit', lambda: client.post(
+                '/templates', data={'source': source, 'destination': destination})), '/source')
+            wizard = location.split('wizard=')[1].split('&')[0]
+            timed(latencies, 'source_page', lambda: client.get(f"/source?wizard={wizard}"))
+            redirect_target(timed(latencies, 'source_submit', lambda: client.post(
+                f"/source?wizard={wizard}", data=source_parameters)), '/target')
+            timed(latencies, 'target_page', lambda: client.get(f"/target?wizard={wizard}"))
+            redirect_target(timed(latencies, 'target_submit', lambda: client.post(
+                f"/target?wizard={wizard}", data=target_parameters)), '/job-suffix')
+            timed(latencies, 'job_suffix_page', lambda: client.get(f"/job-suffix?wizard={wizard}"))
+            redirect_target(timed(latencies, 'job_suffix_submit', lambda: client.post(
+                f"/job-suffix?wizard={wizard}",
+                data={'instance_name_suffix': 'Counter', 'suffix_parameter_name': suffix_parameter})), '/submit-job')
+            redirect_target(timed(latencies, 'submit_job', lambda: client.get(f"/submit-job?wizard={wizard}")), '/jobs')
+            latencies.setdefault('wizard', []).append((perf_counter() - started) * 1000)
+
+    calls_before = dict(sch.calls)
+    latencies, errors, wall = run_clients(app, args.clients, operation)
+    wizards = len(latencies.get('wizard', []))
+    return {'wizards': wizards, 'errors': len(errors), 'wizards_per_sec': round(wizards / wall, 2),
+            **percentiles(latencies.get('wizard')),
+            'steps': {name: percentiles(values) for name, values in latencies.items() if name != 'wizard'},
+            'controlhub_calls': calls_since(sch, calls_before)}
+
+
+def bulk_scenario(app, sch, args):
+    _, _, job_template = pick_template(app)
+    parameter_name = next(iter(job_template.source_runtime_parameters))
+    rows = '\n'.join(json.dumps({parameter_name: f"bench-{row}"}) for row in range(args.bulk_rows)).encode()
+
+    def operation(client, latencies):
+        for _ in range(args.bulk_submissions):
+            response = timed(latencies, 'bulk_submit', lambda: client.post('/jobs/bulk-submit', data={
+                'job_template_id': job_template.sch_job_template_id,
+                'file': (io.BytesIO(rows), 'parameters.jsonl')}))
+            result = response.get_json()
+            latencies.setdefault('started', []).append(len(result.get('started', [])))
+
+    calls_before = dict(sch.calls)
+    latencies, errors, wall = run_clients(app, args.clients, operation)
+    started = sum(latencies.get('started', []))
+    return {'submissions': len(latencies.get('bulk_submit', [])), 'errors': len(errors),
+            'instances_started': started, 'instances_per_sec': round(started / wall, 2),
+            **percentiles(latencies.get('bulk_submit')), 'controlhub_calls': calls_since(sch, calls_before)}
+
+
+def monitor_scenario(app, sch, args):
+    components = app.extensions['ingest_hub']
+    streamsets_manager = components.streamsets_manager
+    monitor = streamsets_manager.monitor
+    # jobs started by the previous scenarios would skew the measurement
+    wait_for_monitor(monitor, args.job_duration[1] * 2 + 60)
+    _, _, job_template = pick_template(app)
+    sch_job_template = streamsets_manager.get_job_template(job_template.sch_job_template_id)
+    runtime_parameters = job_template.source_runtime_parameters | job_template.destination_runtime_parameters
+    jobs = streamsets_manager.start_job_instances(sch_job_template, [runtime_parameters] * args.monitor_jobs,
+                                                  'Counter', None, wait=False)
+    job_runs_before = job_run_count(app)
+    calls_before = dict(sch.calls)
+    cpu_before = process_time()
+    started = perf_counter()
+
+    for job in jobs:
+        monitor.watch('bench', sch_job_template, job)
+    watch_secs = perf_counter() - started
+
+    lags, threads = [], []
+    finished = wait_started = perf_counter()
+    while monitor.in_flight():
+        if perf_counter() - wait_started > args.job_duration[1] * 4 + 120:
+            break
+        lags.append(monitor.overdue() * 1000)
+        threads.append(monitor.thread_count())
+        sleep(0.1)
+        finished = perf_counter()
+    # the metrics writer batches the finished jobs' metrics, wait for the last batch
+    deadline = time() + 30
+    while job_run_count(app) - job_runs_before < len(jobs) and time() < deadline:
+        sleep(0.2)
+    wall = finished - started
+    cpu = process_time() - cpu_before
+    calls = calls_since(sch, calls_before)
+    return {'jobs': len(jobs), 'jobs_recorded': job_run_count(app) - job_runs_before,
+            'watch_ms_per_job': round(watch_secs * 1000 / len(jobs), 3), 'wall_secs': round(wall, 2),
+            'cpu_secs': round(cpu, 2), 'cpu_percent': round(cpu / wall * 100, 1) if wall else None,
+            'controlhub_calls': calls, 'controlhub_calls_per_job': round(sum(calls.values()) / len(jobs), 2),
+            'status_check_lag': percentiles(lags), 'max_monitor_threads': max(threads, default=0)}
+
+
+def seed_job_runs(app, rows):
+    # Job history spread over the last rows * 30 seconds, inserted SEED_CHUNK_SIZE rows per statement
+    db_manager = app.extensions['ingest_hub'].db_manager
+    now = datetime.now()
+    with app.app_context():
+        session = db_manager.db.session
+        job_template_id = session.execute(select(JobTemplate.job_template_id)).scalars().first()
+        for first in range(0, rows, SEED_CHUNK_SIZE):
+            session.execute(insert(JobInstance), [
+                {'job_id': f"seed-{i}", 'job_run_count': 1, 'job_template_id': job_template_id,
+                 'user_id': f"user{i % 50}", 'engine_id': f"engine{i % 8}", 'pipeline_id': f"pipeline{i % 100}",
+                 'successful_run': i % 20 != 0, 'input_record_count': 1000, 'output_record_count': 990,
+                 'error_record_count': 10, 'error_message': '', 'start_time': now - timedelta(seconds=i * 30),
+                 'finish_time': now - timedelta(seconds=i * 30 - 20)}
+                for i in range(first, min(first + SEED_CHUNK_SIZE, rows))])
+            # short transactions, so the job monitor can still renew its leases meanwhile
+            session.commit()
+
+
+def pagination_scenario(app, sch, args):
+    started = perf_counter()
+    if job_run_count(app) < args.jobs_rows:
+        seed_job_runs(app, args.jobs_rows - job_run_count(app))
+    seed_secs = perf_counter() - started
+
+    def operation(client, latencies):
+        response = timed(latencies, 'first_page', lambda: client.get(f"/jobs?per_page={args.per_page}"))
+        for _ in range(args.pages):
+            link = NEXT_PAGE.search(response.get_data(as_text=True))
+            if link is None:
+                break
+            response = timed(latencies, 'next_page', lambda: client.get(html.unescape(link.group(1))))
+        for _ in range(args.pages):
+            link = PREVIOUS_PAGE.search(response.get_data(as_text=True))
+            if link is None:
+                break
+            response = timed(latencies, 'previous_page', lambda: client.get(html.unescape(link.group(1))))
+
+    latencies, errors, wall = run_clients(app, args.clients, operation)
+    pages = sum(len(values) for values in latencies.values())
+    return {'job_runs': job_run_count(app), 'seed_secs': round(seed_secs, 2), 'pages': pages, 'errors': len(errors),
+            'pages_per_sec': round(pages / wall, 2),
+            **{name: percentiles(values) for name, values in latencies.items()}}
+
+
+def sse_scenario(app, sch, args):
+    progress_hub = app.extensions['ingest_hub'].streamsets_manager.progress_hub
+    progress_hub.max_subscribers = max(progress_hub.max_subscribers, args.sse_clients)
+    # the published jobs have no pending job rows, keep the hub's database sync (which would finish them) out of it
+    progress_hub.sync_secs = 3600
+    job_ids = [f"sse-{job}" for job in range(args.sse_jobs)]
+    clients = [logged_in_client(app) for _ in range(args.sse_clients)]
+    calls_before = dict(sch.calls)
+    received = [[] for _ in clients]
+
+    def view(client, latencies):
+        response = client.get('/jobs/progress_feed', buffered=False)
+        finished = 0
+        try:
+            for chunk in response.response:
+                chunk = chunk.decode() if isinstance(chunk, bytes) else chunk
+                for event in chunk.split('\n\n'):
+                    if event.startswith('event: progress'):
+                        progress = json.loads(event.split('data: ', 1)[1])
+                        delay = datetime.now() - datetime.fromisoformat(progress['progress_time'])
+                        latencies.append(delay.total_seconds() * 1000)
+                    elif event.startswith('event: finished'):
+                        finished += 1
+                if finished >= len(job_ids):
+                    return
+        finally:
+            response.close()
+
+    viewers = [threading.Thread(target=view, args=(client, latencies), daemon=True)
+               for client, latencies in zip(clients, received)]
+    for viewer in viewers:
+        viewer.start()
+    deadline = time() + 30
+    while progress_hub.subscriber_count() < len(clients) and time() < deadline:
+        sleep(0.05)
+    sleep(0.5)
+
+    started = perf_counter()
+    submit_time = datetime.now()
+    for event in range(args.sse_events):
+        job_id = job_ids[event % len(job_ids)]
+        progress_hub.publish(JobProgress(job_id, job_id, 'bench', event, event, 0, None, submit_time, datetime.now()))
+        if args.sse_rate:
+            sleep(1 / args.sse_rate)
+    for job_id in job_ids:
+        progress_hub.finish(job_id)
+    for viewer in viewers:
+        viewer.join(timeout=30)
+    wall = perf_counter() - started
+    delivered = sum(len(latencies) for latencies in received)
+    return {'viewers': len(clients), 'published': args.sse_events,
+            'delivered': delivered, 'delivered_per_viewer': round(delivered / len(clients), 1),
+            'events_per_sec': round(delivered / wall, 2),
+            'delivery': percentiles([latency for latencies in received for latency in latencies]),
+            'controlhub_calls': calls_since(sch, calls_before)}
+
+
+def revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, previous):
+    # change of every latency and throughput figure found in both runs
+    def figures(value, path=''):
+        if isinstance(value, dict):
+            for key, item in value.items():
+                yield from figures(item, f"{path}.{key}" if path else key)
+        elif isinstance(value, (int, float)) and (path.endswith('_ms') or path.endswith('_per_sec')):
+            yield path, value
+
+    before = dict(figures(previous['scenarios']))
+    print(f"\nChange from {previous.get('revision') or 'the previous run'} ({previous.get('timestamp')}):")
+    for path, value in figures(results['scenarios']):
+        if before.get(path):
+            print(f"  {path:<55} {before[path]:>10} -> {value:<10} {(value - before[path]) / before[path] * 100:+.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--iterations', type=int, default=10, help='wizard submissions per client')
+    parser.add_argument('--sch-latency-ms', type=float, default=50)
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='fraction of ControlHub calls failing')
+    parser.add_argument('--job-failure-rate', type=float, default=0.05, help='fraction of jobs finishing in error')
+    parser.add_argument('--job-duration', type=float, nargs=2, default=[5, 30], metavar=('MIN', 'MAX'))
+    parser.add_argument('--bulk-rows', type=int, default=500)
+    parser.add_argument('--bulk-submissions', type=int, default=2, help='bulk submissions per client')
+    parser.add_argument('--monitor-jobs', type=int, default=1000)
+    parser.add_argument('--jobs-rows', type=int, default=1000000)
+    parser.add_argument('--pages', type=int, default=50, help='pages walked forward, then back, per client')
+    parser.add_argument('--per-page', type=int, default=20)
+    parser.add_argument('--sse-clients', type=int, default=50)
+    parser.add_argument('--sse-jobs', type=int, default=20)
+    parser.add_argument('--sse-events', type=int, default=2000)
+    parser.add_argument('--sse-rate', type=float, default=500, help='progress snapshots published per second')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='save the results to this JSON file')
+    parser.add_argument('--compare', help='JSON file saved by an earlier run')
+    args = parser.parse_args()
+
+    sch = install(FakeControlHub(args.sch_latency_ms, tuple(args.job_duration), args.failure_rate,
+                                 args.job_failure_rate, seed=args.seed))
+    app = create_app()
+    app.config['WTF_CSRF_ENABLED'] = False
+    # only errors on the console, everything is still in the log file under WORK_DIR
+    for handler in Logger.writer.handlers:
+        if type(handler) is logging.StreamHandler:
+            handler.setLevel(logging.ERROR)
+    app.test_client().get('/login')
+    start_background_services(app)
+
+    results = {'timestamp': datetime.now().isoformat(timespec='seconds'), 'revision': revision(),
+               'python': sys.version.split()[0], 'args': vars(args), 'scenarios': {}}
+    scenarios = {'wizard': wizard_scenario, 'bulk': bulk_scenario, 'monitor': monitor_scenario,
+                 'pagination': pagination_scenario, 'sse': sse_scenario}
+    try:
+        for name in [scenario for scenario in SCENARIOS if scenario in args.scenarios]:
+            print(f"Running {name}...", flush=True)
+            results['scenarios'][name] = scenarios[name](app, sch, args)
+            print(json.dumps(results['scenarios'][name], indent=2), flush=True)
+    finally:
+        stop_background_services(app)
+    print(f"Work directory (database, log file): {WORK_DIR}")
+
+    if args.output:
+        with open(os.path.join(STARTED_IN, args.output), 'w') as file:
+            json.dump(results, file, indent=2)
+    if args.compare:
+        with open(os.path.join(STARTED_IN, args.compare)) as file:
+            compare(results, json.load(file))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""In-process stand-in for the parts of streamsets.sdk.ControlHub that StreamSetsManager uses.
+
+Covers sch.jobs.get(), sch.start_job_template(), sch.api_client.get_jobs_status() and, on the returned jobs,
+job.refresh(), job.status, job.metrics and job.history. Every call sleeps for the configured latency (so concurrent
+callers overlap like real HTTP requests) and fails with the configured probability. Started jobs run for a random
+duration from the configured range and report record counts growing with their run time.
+
+Install it in place of the real session with install(FakeControlHub(...)), before the app talks to ControlHub.
+"""
+import random
+from collections import Counter
+from threading import Lock
+from time import sleep, time
+from types import SimpleNamespace
+from uuid import uuid4
+
+import streamsets_manager
+
+# records a fake job reads per second of run time, 1% of them end up as error records
+FAKE_RECORDS_PER_SEC = 1000
+
+
+class FakeControlHubError(Exception):
+    pass
+
+
+class FakeControlHub:
+    def __init__(self, latency_ms=0, job_duration_secs=(5, 30), failure_rate=0.0, job_failure_rate=0.0,
+                 static_parameters=(), seed=None):
+        self.latency_secs = latency_ms / 1000
+        self.job_duration_secs = job_duration_secs
+        # probability of a call raising, and of a started job finishing in error
+        self.failure_rate = failure_rate
+        self.job_failure_rate = job_failure_rate
+        self.static_parameters = list(static_parameters)
+        self.random = random.Random(seed)
+        self.calls = Counter()
+        self.failures = Counter()
+        self.jobs = FakeJobs(self)
+        self.api_client = FakeApiClient(self)
+        self._instances = {}
+        self._counter = 0
+        self._lock = Lock()
+
+    def request(self, operation):
+        # every SDK call goes through here: counted, delayed, and failed now and then
+        with self._lock:
+            self.calls[operation] += 1
+            failed = self.random.random() < self.failure_rate
+            if failed:
+                self.failures[operation] += 1
+        if self.latency_secs:
+            sleep(self.latency_secs)
+        if failed:
+            raise FakeControlHubError(f"Simulated ControlHub failure of {operation}")
+
+    def start_job_template(self, job_template, runtime_parameters=None, instance_name_suffix='COUNTER',
+                           delete_after_completion=False, parameter_name=None, wait=True):
+        self.request('start_job_template')
+        parameter_sets = runtime_parameters if isinstance(runtime_parameters, list) else [runtime_parameters or {}]
+        started = []
+        with self._lock:
+            for parameters in parameter_sets:
+                self._counter += 1
+                if instance_name_suffix == 'PARAM_VALUE' and parameter_name in parameters:
+                    suffix = parameters[parameter_name]
+                elif instance_name_suffix == 'TIMESTAMP':
+                    suffix = int(time() * 1000)
+                else:
+                    suffix = self._counter
+                job = FakeJob(self, f"{uuid4()}:fake", f"{job_template.job_name} - {suffix}", runtime_parameters=parameters,
+                              duration=self.random.uniform(*self.job_duration_secs),
+                              failed=self.random.random() < self.job_failure_rate)
+                self._instances[job.job_id] = job
+                started.append(job)
+        return started
+
+    def job(self, job_id):
+        # a started instance, otherwise a job template (any other ID is taken for one)
+        with self._lock:
+            job = self._instances.get(job_id)
+        return job or FakeJob(self, job_id, f"Template {job_id[:8]}", static_parameters=list(self.static_parameters))
+
+
+class FakeJobs:
+    def __init__(self, sch):
+        self.sch = sch
+
+    def get(self, job_id):
+        self.sch.request('jobs.get')
+        return self.sch.job(job_id)
+
+
+class FakeApiClient:
+    def __init__(self, sch):
+        self.sch = sch
+
+    def get_jobs_status(self, job_ids):
+        self.sch.request('jobs.status')
+        statuses = {job_id: {'status': self.sch.job(job_id).current_status()} for job_id in job_ids}
+        return SimpleNamespace(response=SimpleNamespace(json=lambda: statuses))
+
+
+class FakeJob:
+    def __init__(self, sch, job_id, job_name, runtime_parameters=None, static_parameters=(), duration=0,
+                 failed=False):
+        self._control_hub = sch
+        self._sch = sch
+        self.job_id = job_id
+        self.job_name = job_name
+        self.pipeline_id = f"{job_id}:pipeline"
+        self.runtime_parameters = runtime_parameters or {}
+        self.static_parameters = list(static_parameters)
+        self.delete_after_completion = False
+        self.started_at = time()
+        self.duration = duration
+        self.failed = failed
+
+    def finished(self):
+        return time() - self.started_at >= self.duration
+
+    def current_status(self):
+        if not self.finished():
+            return 'ACTIVE'
+        return 'INACTIVE_ERROR' if self.failed else 'INACTIVE'
+
+    @property
+    def status(self):
+        return SimpleNamespace(status=self.current_status())
+
+    def refresh(self):
+        self._sch.request('job.refresh')
+
+    @property
+    def metrics(self):
+        self._sch.request('job.metrics')
+        input_count = int(min(time() - self.started_at, self.duration) * FAKE_RECORDS_PER_SEC)
+        error_count = input_count // 100
+        return [SimpleNamespace(run_count=1, sdc_id='fake-engine', input_count=input_count,
+                                output_count=input_count - error_count, total_error_count=error_count)]
+
+    @property
+    def history(self):
+        self._sch.request('job.history')
+        finish_time = self.started_at + min(time() - self.started_at, self.duration)
+        return [SimpleNamespace(color='RED' if self.failed else 'GRAY',
+                                error_message='Simulated job failure' if self.failed else None,
+                                start_time=self.started_at * 1000, finish_time=finish_time * 1000)]
+
+
+def install(sch, client=None):
+    # the shared ControlHub client returns the fake instead of authenticating against a real ControlHub
+    client = client or streamsets_manager.controlhub_client
+    client._sch = sch
+    return sch
@@ -0,0 +1,73 @@
+"""Runtime configuration form generation: cold (class built, template looked up) vs. warm (cached class).
+
+Usage: python benchmarks/form_benchmark.py [--parameters 20] [--iterations 2000] [--sch-latency-ms 0]
+"""
+import argparse
+import os
+import sys
+from statistics import median
+from time import perf_counter, sleep
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from forms import FormGenerator  # noqa: E402
+
+
+# Stands in for StreamSetsManager, optionally simulating the ControlHub round trip of an uncached template
+class StaticParamsStub:
+    def __init__(self, static_parameters, latency_secs):
+        self.static_parameters = static_parameters
+        self.latency_secs = latency_secs
+        self.cached = False
+        self.listeners = []
+
+    def on_template_invalidated(self, listener):
+        self.listeners.append(listener)
+
+    def invalidate_job_template(self, job_template_id=None):
+        self.cached = False
+        for listener in self.listeners:
+            listener(job_template_id)
+
+    def get_job_template_static_params(self, job_template_id):
+        if self.latency_secs and not self.cached:
+            sleep(self.latency_secs)
+        self.cached = True
+        return self.static_parameters
+
+
+def measure(generate, iterations):
+    latencies = []
+    for _ in range(iterations):
+        started = perf_counter()
+        generate()
+        latencies.append((perf_counter() - started) * 1e6)
+    latencies.sort()
+    return {'p50_us': round(median(latencies), 2), 'p99_us': round(latencies[int(len(latencies) * 0.99)], 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--parameters', type=int, default=20)
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--sch-latency-ms', type=float, default=0)
+    args = parser.parse_args()
+
+    runtime_parameters = {f"PARAM_{i}": f"value-{i}" for i in range(args.parameters)}
+    stub = StaticParamsStub(['PARAM_0', 'PARAM_1'], args.sch_latency_ms / 1000)
+    form_generator = FormGenerator(stub)
+
+    def cold():
+        stub.invalidate_job_template()
+        form_generator.generate_form(runtime_parameters, 'template-1', submit_text="Next")
+
+    def warm():
+        form_generator.generate_form(runtime_parameters, 'template-1', submit_text="Next")
+
+    print(f"parameters={args.parameters} iterations={args.iterations} sch_latency_ms={args.sch_latency_ms}")
+    print(f"cold: {measure(cold, args.iterations)}")
+    print(f"warm: {measure(warm, args.iterations)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""Page throughput while log feeds are open: the development server vs. gunicorn (gunicorn.conf.py).
+
+Starts each server in turn on a throwaway database, logs in, keeps --log-feeds /stream_logs_feed connections open
+and measures how many /jobs pages --clients concurrent users get through in --duration seconds.
+
+Usage: python benchmarks/serving_benchmark.py [--servers dev gunicorn] [--log-feeds 12] [--clients 16] [--duration 10]
+"""
+import argparse
+import os
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+from statistics import median
+from time import perf_counter, sleep
+
+import requests
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PORT = 5003
+BASE_URL = f"http://127.0.0.1:{PORT}"
+CSRF_TOKEN = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+SERVERS = {
+    # what `python ingest_hub.py` runs
+    'dev': [sys.executable, os.path.join(REPO_DIR, 'ingest_hub.py')],
+    'gunicorn': [sys.executable, '-m', 'gunicorn', '-c', os.path.join(REPO_DIR, 'gunicorn.conf.py')],
+}
+
+
+def start_server(name, work_dir):
+    env = dict(os.environ, FLASK_KEY='benchmark', PYTHONPATH=REPO_DIR, MONITOR_IN_PROCESS='false',
+               DB_URI=f"sqlite:///{work_dir}/{name}.db")
+    server = subprocess.Popen(SERVERS[name], cwd=work_dir, env=env, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL, start_new_session=True)
+    for _ in range(120):
+        try:
+            requests.get(f"{BASE_URL}/login", timeout=1)
+            return server
+        except requests.ConnectionError:
+            sleep(0.5)
+    stop_server(server)
+    raise RuntimeError(f"{name} server did not start")
+
+
+def stop_server(server):
+    # the dev server's reloader runs the app in a child process, stop the whole group
+    os.killpg(server.pid, signal.SIGTERM)
+    server.wait(timeout=90)
+
+
+def logged_in_session():
+    session = requests.Session()
+    token = CSRF_TOKEN.search(session.get(f"{BASE_URL}/register").text).group(1)
+    session.post(f"{BASE_URL}/register", data={'csrf_token': token, 'name': 'bench', 'email': 'bench@example.com',
+                                               'password': 'bench'})
+    token = CSRF_TOKEN.search(session.get(f"{BASE_URL}/login").text).group(1)
+    session.post(f"{BASE_URL}/login", data={'csrf_token': token, 'email': 'bench@example.com', 'password': 'bench'})
+    return session
+
+
+def follow_log_feed(cookies, stop):
+    try:
+        with requests.get(f"{BASE_URL}/stream_logs_feed", cookies=cookies, stream=True, timeout=60) as response:
+            for _ in response.iter_lines():
+                if stop.is_set():
+                    return
+    except requests.RequestException:
+        pass
+
+
+def load_pages(cookies, deadline, latencies, errors):
+    session = requests.Session()
+    session.cookies.update(cookies)
+    while perf_counter() < deadline:
+        started = perf_counter()
+        try:
+            response = session.get(f"{BASE_URL}/jobs", timeout=30, allow_redirects=False)
+            if response.status_code == 200:
+                latencies.append(perf_counter() - started)
+                continue
+        except requests.RequestException:
+            pass
+        errors.append(1)
+
+
+def run(name, log_feeds, clients, duration):
+    with tempfile.TemporaryDirectory() as work_dir:
+        server = start_server(name, work_dir)
+        stop = threading.Event()
+        try:
+            cookies = logged_in_session().cookies
+            feeds = [threading.Thread(target=follow_log_feed, args=(cookies, stop), daemon=True)
+                     for _ in range(log_feeds)]
+            for feed in feeds:
+                feed.start()
+            sleep(1)
+            latencies, errors = [], []
+            deadline = perf_counter() + duration
+            loaders = [threading.Thread(target=load_pages, args=(cookies, deadline, latencies, errors))
+                       for _ in range(clients)]
+            for loader in loaders:
+                loader.start()
+            for loader in loaders:
+                loader.join()
+        finally:
+            stop.set()
+            stop_server(server)
+    latencies.sort()
+    return {
+        'pages_per_sec': round(len(latencies) / duration, 1),
+        'p50_ms': round(median(latencies) * 1000, 1) if latencies else None,
+        'p99_ms': round(latencies[int(len(latencies) * 0.99)] * 1000, 1) if latencies else None,
+        'errors': len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--servers', nargs='+', choices=list(SERVERS), default=list(SERVERS))
+    parser.add_argument('--log-feeds', type=int, default=12)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--duration', type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"log_feeds={args.log_feeds} clients={args.clients} duration={args.duration}s")
+    for name in args.servers:
+        print(f"{name:9}: {run(name, args.log_feeds, args.clients, args.duration)}")
+
+
+if __name__ == "__main__":
+    main()
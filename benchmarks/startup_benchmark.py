@@ -0,0 +1,85 @@
+"""Cold start time of the web app: importing ingest_hub, create_app() and the first request.
+
+Every run is a fresh Python process on a throwaway database: the first run bootstraps an empty database (schema and
+example templates), the following ones start against the existing database. Also reports whether modules that should
+only load on demand (the StreamSets SDK, pyfiglet) were imported during start up.
+
+Usage: python benchmarks/startup_benchmark.py [--runs 10] [--output startup.jsonl]
+  --output appends the results as a JSON line, to track start up time across changes
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+from statistics import median
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# modules start up must not import
+LAZY_MODULES = ['streamsets.sdk', 'pyfiglet']
+
+# runs in the child process, prints the phase timings in milliseconds as JSON
+PROBE = f"""
+import json, sys
+from time import perf_counter
+started = perf_counter()
+import ingest_hub
+imported = perf_counter()
+app = ingest_hub.create_app()
+created = perf_counter()
+response = app.test_client().get('/login')
+requested = perf_counter()
+print(json.dumps({{
+    'import_ms': (imported - started) * 1000,
+    'create_app_ms': (created - imported) * 1000,
+    'first_request_ms': (requested - created) * 1000,
+    'status': response.status_code,
+    'lazy_modules_imported': [name for name in {LAZY_MODULES!r} if name in sys.modules],
+}}))
+"""
+
+
+def run_once(work_dir):
+    # the log file lands in work_dir
+    env = dict(os.environ, FLASK_KEY='benchmark', PYTHONPATH=REPO_DIR, MONITOR_IN_PROCESS='false',
+               DB_URI=f"sqlite:///{work_dir}/startup.db",
+               CATALOG_SEED_FILE=os.path.join(REPO_DIR, 'sql', 'catalog.json'))
+    completed = subprocess.run([sys.executable, '-c', PROBE], cwd=work_dir, env=env, capture_output=True, text=True,
+                               check=True)
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    if result['status'] != 200:
+        raise RuntimeError(f"first request returned {result['status']}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--output', help='append the results to this JSON lines file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        runs = [run_once(work_dir) for _ in range(args.runs + 1)]
+    bootstrap, warm = runs[0], runs[1:]
+    summary = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'runs': args.runs,
+        'empty_db_first_request_ms': round(bootstrap['first_request_ms'], 1),
+    }
+    for phase in ('import_ms', 'create_app_ms', 'first_request_ms'):
+        summary[f"{phase[:-3]}_p50_ms"] = round(median(run[phase] for run in warm), 1)
+    summary['total_p50_ms'] = round(median(run['import_ms'] + run['create_app_ms'] + run['first_request_ms']
+                                           for run in warm), 1)
+    summary['lazy_modules_imported'] = sorted({name for run in runs for name in run['lazy_modules_imported']})
+
+    for name, value in summary.items():
+        print(f"{name:28}: {value}")
+    if args.output:
+        with open(args.output, 'a') as output:
+            output.write(json.dumps(summary) + '\n')
+
+
+if __name__ == "__main__":
+    main()
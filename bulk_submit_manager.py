@@ -0,0 +1,134 @@
+import csv
+import io
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from db_manager import JobTemplate
+from ingesthub_logger import Logger
+
+# number of job instances started with a single ControlHub request
+BULK_SUBMIT_CHUNK_SIZE = int(os.environ.get('BULK_SUBMIT_CHUNK_SIZE', 50))
+# max number of ControlHub start requests in flight for one bulk submission
+BULK_SUBMIT_MAX_WORKERS = int(os.environ.get('BULK_SUBMIT_MAX_WORKERS', 4))
+# max number of runtime parameter sets accepted in one bulk submission
+BULK_SUBMIT_MAX_ROWS = int(os.environ.get('BULK_SUBMIT_MAX_ROWS', 10000))
+# file formats accepted for runtime parameter sets, by file extension
+BULK_SUBMIT_FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl', '.json': 'jsonl'}
+
+
+# Starts many instances of one job template from a file of runtime parameter sets (CSV or JSON lines).
+# Every set is validated before anything is started; instances are started in chunks with bounded concurrency
+# and handed to the job monitor like the ones started through the wizard.
+class BulkSubmitter:
+    def __init__(self, db_manager, streamsets_manager, chunk_size=BULK_SUBMIT_CHUNK_SIZE,
+                 max_workers=BULK_SUBMIT_MAX_WORKERS, max_rows=BULK_SUBMIT_MAX_ROWS):
+        self.logger = Logger()
+        self.db_manager = db_manager
+        self.streamsets_manager = streamsets_manager
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self.max_rows = max_rows
+
+    def parse(self, content, file_format):
+        # CSV: header row of parameter names, empty cells keep the template default; JSON lines: one object per line
+        if isinstance(content, bytes):
+            content = content.decode('utf-8-sig')
+        if file_format == 'csv':
+            parameter_sets = [{name: value for name, value in row.items() if value not in (None, '')}
+                              for row in csv.DictReader(io.StringIO(content))]
+        elif file_format == 'jsonl':
+            parameter_sets = []
+            for line_number, line in enumerate(content.splitlines(), start=1):
+                if not line.strip():
+                    continue
+                try:
+                    parameter_set = json.loads(line)
+                except ValueError as e:
+                    raise ValueError(f"Line {line_number} is not valid JSON: {e}")
+                if not isinstance(parameter_set, dict):
+                    raise ValueError(f"Line {line_number} is not a JSON object")
+                parameter_sets.append(parameter_set)
+        else:
+            raise ValueError(f"Unsupported file format '{file_format}', expected one of: csv, jsonl")
+        if not parameter_sets:
+            raise ValueError("No runtime parameter sets found")
+        if len(parameter_sets) > self.max_rows:
+            raise ValueError(f"{len(parameter_sets)} runtime parameter sets exceed the limit of {self.max_rows}")
+        return parameter_sets
+
+    @staticmethod
+    def file_format(filename):
+        return BULK_SUBMIT_FORMATS.get(os.path.splitext(filename or '')[1].lower())
+
+    def validate(self, sch_job_template_id, parameter_sets, instance_name_suffix, suffix_parameter_name):
+        # Complete every set with the template defaults; returns (runtime parameter sets, errors)
+        with self.db_manager.app.app_context():
+            job_template = self.db_manager.query_table(JobTemplate, sch_job_template_id=sch_job_template_id).first()
+        if job_template is None:
+            return [], [f"Unknown job template '{sch_job_template_id}'"]
+        defaults = (job_template.source_runtime_parameters or {}) | (job_template.destination_runtime_parameters or {})
+        static_params = self.streamsets_manager.get_job_template_static_params(sch_job_template_id)
+        if static_params is None:
+            return [], [f"Job template '{sch_job_template_id}' could not be loaded from ControlHub"]
+
+        errors = []
+        if instance_name_suffix not in ('Counter', 'Timestamp') and suffix_parameter_name not in defaults:
+            errors.append(f"Unknown suffix parameter '{suffix_parameter_name}'")
+        runtime_parameter_sets = []
+        for row, parameter_set in enumerate(parameter_sets, start=1):
+            unknown = sorted(set(parameter_set) - set(defaults))
+            if unknown:
+                errors.append(f"Row {row}: unknown runtime parameter(s): {', '.join(unknown)}")
+            changed_static = sorted(name for name in set(parameter_set) & set(static_params)
+                                    if parameter_set[name] != defaults[name])
+            if changed_static:
+                errors.append(f"Row {row}: static runtime parameter(s) can't be changed: {', '.join(changed_static)}")
+            runtime_parameters = defaults | parameter_set
+            missing = sorted(name for name, value in runtime_parameters.items() if value in (None, ''))
+            if missing:
+                errors.append(f"Row {row}: missing value(s) for: {', '.join(missing)}")
+            runtime_parameter_sets.append(runtime_parameters)
+        return runtime_parameter_sets, errors
+
+    def submit(self, user, sch_job_template_id, parameter_sets, instance_name_suffix='Counter',
+               suffix_parameter_name=None):
+        runtime_parameter_sets, errors = self.validate(sch_job_template_id, parameter_sets, instance_name_suffix,
+                                                       suffix_parameter_name)
+        result = {'job_template_id': sch_job_template_id, 'requested': len(parameter_sets), 'started': [],
+                  'failed': [], 'errors': errors}
+        if errors:
+            return result
+        job_template = self.streamsets_manager.get_job_template(sch_job_template_id)
+        if job_template is None:
+            result['errors'].append(f"Job template '{sch_job_template_id}' could not be loaded from ControlHub")
+            return result
+
+        chunks = [(first, runtime_parameter_sets[first:first + self.chunk_size])
+                  for first in range(0, len(runtime_parameter_sets), self.chunk_size)]
+        self.logger.log_msg('info', f"Bulk submitting {len(runtime_parameter_sets)} instance(s) of job template "
+                                    f"'{job_template.job_name}' in {len(chunks)} chunk(s) by [{user}]")
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='bulk-submit') as pool:
+            futures = {pool.submit(self._start_chunk, user, job_template, chunk, instance_name_suffix,
+                                   suffix_parameter_name): (first, len(chunk)) for first, chunk in chunks}
+            for future in as_completed(futures):
+                first, size = futures[future]
+                try:
+                    result['started'].extend(future.result())
+                except Exception as e:
+                    # not retried: ControlHub may have started part of the chunk before failing
+                    self.logger.log_msg('error', f"Failed to start rows {first + 1}-{first + size} of the bulk "
+                                                 f"submission for job template '{job_template.job_name}': {e}")
+                    result['failed'].append({'rows': f"{first + 1}-{first + size}", 'error': str(e)})
+        self.logger.log_msg('info', f"Bulk submission by [{user}] started {len(result['started'])} of "
+                                    f"{len(runtime_parameter_sets)} instance(s)")
+        return result
+
+    def _start_chunk(self, user, job_template, runtime_parameter_sets, instance_name_suffix, suffix_parameter_name):
+        jobs = self.streamsets_manager.start_job_instances(job_template, runtime_parameter_sets,
+                                                           instance_name_suffix, suffix_parameter_name, wait=False)
+        started = []
+        for job in jobs:
+            self.streamsets_manager.monitor.watch(user, job_template, job)
+            started.append({'job_id': job.job_id, 'job_name': job.job_name})
+        return started
@@ -0,0 +1,490 @@
+import csv
+import hashlib
+import io
+import json
+import os
+import weakref
+from collections import namedtuple
+from datetime import datetime
+from itertools import chain
+from threading import RLock
+from time import monotonic
+
+from sqlalchemy import event, select, or_, and_, insert, update, delete, bindparam
+from sqlalchemy.orm import Session
+
+from db_manager import IngestionPattern, IngestionPatternJobTemplateRelationship, JobTemplate, CatalogRevision
+from ingesthub_logger import Logger
+
+# how often the whole catalog is reloaded to pick up changes made outside this process
+CATALOG_REFRESH_SECS = int(os.environ.get('CATALOG_REFRESH_SECS', 5 * 60))
+# how often the catalog revision is checked, so catalog imports show up in every process within this time
+CATALOG_REVISION_CHECK_SECS = int(os.environ.get('CATALOG_REVISION_CHECK_SECS', 5))
+# catalog file formats accepted by the importer, by file extension
+CATALOG_IMPORT_FORMATS = {'.json': 'json', '.yaml': 'yaml', '.yml': 'yaml', '.csv': 'csv'}
+# JSON columns of a job template, compared along with delete_after_completion to detect changed templates
+CATALOG_TEMPLATE_JSON_FIELDS = ('source_runtime_parameters', 'destination_runtime_parameters', 'source_connection_info',
+                                'destination_connection_info')
+
+# Detached, read-only copy of a JobTemplate row, safe to share between requests and threads
+CatalogEntry = namedtuple('CatalogEntry', [
+    'ingestion_pattern_id', 'pattern_name', 'source', 'destination', 'job_template_id', 'sch_job_template_id',
+    'delete_after_completion', 'source_runtime_parameters', 'destination_runtime_parameters',
+    'source_connection_info', 'destination_connection_info',
+])
+
+
+# In-memory index of the ingestion catalog keyed by (source, destination), loaded with a single joined query.
+# Catalog rows changed through the ORM mark the affected pairs stale once committed, and only those pairs are reloaded.
+class TemplateCatalog:
+    def __init__(self, db_manager, refresh_secs=CATALOG_REFRESH_SECS, revision_check_secs=CATALOG_REVISION_CHECK_SECS):
+        self.logger = Logger()
+        self.db_manager = db_manager
+        self.refresh_secs = refresh_secs
+        self.revision_check_secs = revision_check_secs
+        self._lock = RLock()
+        self._entries = None
+        self._loaded_at = 0
+        # revision of the catalog (bumped by catalog imports) the entries were loaded at
+        self._revision = None
+        self._revision_checked_at = 0
+        # source/destination picker choices derived from the entries, rebuilt whenever the entries change
+        self._choices = None
+        self._choices_etag = None
+        # reverse maps used to find the pairs affected by a changed row
+        self._pattern_pairs = {}
+        self._template_pairs = {}
+        self._stale_pairs = set()
+        self._stale_pattern_ids = set()
+        _catalogs.add(self)
+
+    def get(self, source, destination):
+        return self._current_entries().get((source, destination))
+
+    def entries(self):
+        return list(self._current_entries().values())
+
+    def sources(self):
+        return list(self._current_choices())
+
+    def destinations(self, source=None):
+        choices = self._current_choices()
+        if source is not None:
+            return list(choices.get(source, ()))
+        return sorted({destination for destinations in choices.values() for destination in destinations})
+
+    def choices_etag(self, source=None):
+        # Content hash of the picker choices, identical across processes and restarts for the same catalog
+        with self._lock:
+            self._current_choices()
+            return hashlib.sha1(f"{self._choices_etag}|{source or ''}".encode()).hexdigest()
+
+    def _current_choices(self):
+        with self._lock:
+            self._current_entries()
+            if self._choices is None:
+                choices = {}
+                for source, destination in self._entries:
+                    choices.setdefault(source, []).append(destination)
+                self._choices = {source: sorted(choices[source]) for source in sorted(choices)}
+                self._choices_etag = hashlib.sha1(json.dumps(self._choices).encode()).hexdigest()
+            return self._choices
+
+    def invalidate(self):
+        # Force a full reload on the next lookup, e.g. after bulk SQL that bypasses the ORM
+        with self._lock:
+            self._entries = None
+
+    def _current_entries(self):
+        with self._lock:
+            if self._entries is None or monotonic() - self._loaded_at > self.refresh_secs or self._revision_changed():
+                self._reload()
+            elif self._stale_pairs or self._stale_pattern_ids:
+                self._refresh_stale()
+            return self._entries
+
+    def _query(self, *criteria):
+        with self.db_manager.app.app_context():
+            rows = self.db_manager.db.session.execute(
+                select(IngestionPattern.ingestion_pattern_id, IngestionPattern.pattern_name, IngestionPattern.source,
+                       IngestionPattern.destination, JobTemplate.job_template_id, JobTemplate.sch_job_template_id,
+                       JobTemplate.delete_after_completion, JobTemplate.source_runtime_parameters,
+                       JobTemplate.destination_runtime_parameters, JobTemplate.source_connection_info,
+                       JobTemplate.destination_connection_info)
+                .join(IngestionPatternJobTemplateRelationship,
+                      IngestionPatternJobTemplateRelationship.ingestion_pattern_id ==
+                      IngestionPattern.ingestion_pattern_id)
+                .join(JobTemplate, JobTemplate.job_template_id == IngestionPatternJobTemplateRelationship.job_template_id)
+                .where(*criteria)
+                .order_by(IngestionPattern.ingestion_pattern_id, IngestionPatternJobTemplateRelationship.rel_id)
+            ).all()
+        return [CatalogEntry(*row) for row in rows]
+
+    def _index(self, catalog_entries):
+        # The first job template of the first matching pattern wins, as with the original nested lookups
+        for catalog_entry in catalog_entries:
+            pair = (catalog_entry.source, catalog_entry.destination)
+            if pair not in self._entries:
+                self._entries[pair] = catalog_entry
+            self._pattern_pairs[catalog_entry.ingestion_pattern_id] = pair
+            self._template_pairs.setdefault(catalog_entry.job_template_id, set()).add(pair)
+
+    def _revision_changed(self):
+        if monotonic() - self._revision_checked_at < self.revision_check_secs:
+            return False
+        self._revision_checked_at = monotonic()
+        return self._load_revision() != self._revision
+
+    def _load_revision(self):
+        with self.db_manager.app.app_context():
+            return self.db_manager.db.session.execute(select(CatalogRevision.revision)).scalar() or 0
+
+    def _reload(self):
+        # read the revision first, an import committed while loading is picked up by the next check
+        self._revision = self._load_revision()
+        self._revision_checked_at = monotonic()
+        self._entries, self._pattern_pairs, self._template_pairs = {}, {}, {}
+        self._stale_pairs.clear()
+        self._stale_pattern_ids.clear()
+        self._index(self._query())
+        self._loaded_at = monotonic()
+        self._changed()
+        self.logger.log_msg('info', f"Loaded {len(self._entries)} ingestion pattern(s) into the template catalog")
+
+    def _refresh_stale(self):
+        stale_pattern_ids, self._stale_pattern_ids = self._stale_pattern_ids, set()
+        if stale_pattern_ids:
+            # relationships of patterns that are not indexed yet, look their pairs up
+            with self.db_manager.app.app_context():
+                self._stale_pairs.update(self.db_manager.db.session.execute(
+                    select(IngestionPattern.source, IngestionPattern.destination)
+                    .where(IngestionPattern.ingestion_pattern_id.in_(stale_pattern_ids))).all())
+        stale_pairs, self._stale_pairs = self._stale_pairs, set()
+        for pair in stale_pairs:
+            self._entries.pop(pair, None)
+        if stale_pairs:
+            self._index(self._query(or_(*(and_(IngestionPattern.source == source,
+                                               IngestionPattern.destination == destination)
+                                          for source, destination in stale_pairs))))
+            self._changed()
+
+    def _changed(self):
+        self._choices = None
+
+    def _mark_stale(self, changes):
+        # Catalog rows changed by a committed transaction, as recorded by _record_catalog_changes
+        with self._lock:
+            for kind, row_id, pair in changes:
+                if kind == 'pattern':
+                    self._stale_pairs.add(pair)
+                    previous_pair = self._pattern_pairs.get(row_id)
+                    if previous_pair:
+                        self._stale_pairs.add(previous_pair)
+                elif kind == 'relationship':
+                    pair = self._pattern_pairs.get(row_id)
+                    if pair:
+                        self._stale_pairs.add(pair)
+                    else:
+                        self._stale_pattern_ids.add(row_id)
+                else:
+                    self._stale_pairs.update(self._template_pairs.get(row_id, ()))
+
+
+# Template catalogs of this process, told about the catalog rows changed through the ORM. Held weakly, so a discarded
+# catalog (e.g. of an earlier create_app()) stops receiving changes.
+_catalogs = weakref.WeakSet()
+# session.info key of the catalog rows flushed by the session's current transaction
+_CATALOG_CHANGES = 'catalog_changes'
+
+
+@event.listens_for(Session, 'after_flush')
+def _record_catalog_changes(session, flush_context):
+    # Only recorded at flush: the catalogs are told once the transaction commits, so a lookup in between can't
+    # reload the old rows and lose the change
+    for row in chain(session.new, session.dirty, session.deleted):
+        if isinstance(row, IngestionPattern):
+            change = ('pattern', row.ingestion_pattern_id, (row.source, row.destination))
+        elif isinstance(row, IngestionPatternJobTemplateRelationship):
+            change = ('relationship', row.ingestion_pattern_id, None)
+        elif isinstance(row, JobTemplate):
+            change = ('template', row.job_template_id, None)
+        else:
+            continue
+        session.info.setdefault(_CATALOG_CHANGES, set()).add(change)
+
+
+@event.listens_for(Session, 'after_commit')
+def _publish_catalog_changes(session):
+    changes = session.info.pop(_CATALOG_CHANGES, None)
+    if changes:
+        for catalog in list(_catalogs):
+            catalog._mark_stale(changes)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_catalog_changes(session):
+    session.info.pop(_CATALOG_CHANGES, None)
+
+
+# Imports a catalog file of ingestion patterns, job templates and their relationships. Patterns are keyed by
+# (source, destination, pattern_name) and templates by sch_job_template_id; only new rows and templates whose content
+# hash differs from the database are written, in bulk and in one transaction. A pattern's relationships are replaced
+# when its list of templates changed. Every import that writes bumps the catalog revision, which makes every
+# TemplateCatalog reload within CATALOG_REVISION_CHECK_SECS.
+class CatalogImporter:
+    def __init__(self, db_manager, catalog=None):
+        self.logger = Logger()
+        self.db_manager = db_manager
+        # the template catalog of this process, if any, reloaded right after an import
+        self.catalog = catalog
+
+    @staticmethod
+    def file_format(filename):
+        return CATALOG_IMPORT_FORMATS.get(os.path.splitext(filename or '')[1].lower())
+
+    def parse(self, content, file_format):
+        # JSON/YAML: an object with 'patterns', 'templates' and 'relationships' lists. CSV: one row per relationship
+        # with the pattern and template columns, the JSON columns as JSON text (rows without a template add a pattern)
+        if isinstance(content, bytes):
+            content = content.decode('utf-8-sig')
+        if file_format == 'json':
+            try:
+                catalog = json.loads(content)
+            except ValueError as e:
+                raise ValueError(f"Invalid JSON: {e}")
+        elif file_format == 'yaml':
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError("YAML catalogs need PyYAML (pip install pyyaml)")
+            try:
+                catalog = yaml.safe_load(content)
+            except yaml.YAMLError as e:
+                raise ValueError(f"Invalid YAML: {e}")
+        elif file_format == 'csv':
+            catalog = self._from_rows(csv.DictReader(io.StringIO(content)))
+        else:
+            raise ValueError(f"Unsupported file format '{file_format}', expected one of: json, yaml, csv")
+        if not isinstance(catalog, dict) or set(catalog) - {'patterns', 'templates', 'relationships'} or \
+                not all(isinstance(section, list) for section in catalog.values()):
+            raise ValueError("Expected an object with the lists 'patterns', 'templates' and 'relationships'")
+        return catalog
+
+    @staticmethod
+    def _from_rows(rows):
+        catalog = {'patterns': [], 'templates': [], 'relationships': []}
+        patterns = set()
+        for row_number, row in enumerate(rows, start=2):
+            pattern = {name: row.get(name) for name in ('pattern_name', 'source', 'destination')}
+            if tuple(pattern.values()) not in patterns:
+                patterns.add(tuple(pattern.values()))
+                catalog['patterns'].append(pattern)
+            if not row.get('sch_job_template_id'):
+                continue
+            template = {'sch_job_template_id': row['sch_job_template_id'],
+                        'delete_after_completion': (row.get('delete_after_completion') or '').lower() in ('true', '1')}
+            for field in CATALOG_TEMPLATE_JSON_FIELDS:
+                try:
+                    template[field] = json.loads(row.get(field) or '{}')
+                except ValueError as e:
+                    raise ValueError(f"Line {row_number}: {field} is not valid JSON: {e}")
+            catalog['templates'].append(template)
+            catalog['relationships'].append(pattern | {'sch_job_template_id': row['sch_job_template_id']})
+        return catalog
+
+    def validate(self, catalog):
+        # Returns ({pattern key: [sch_job_template_id, ...]}, {sch_job_template_id: content}, errors); the list is None
+        # for a pattern without relationships in the catalog, whose existing relationships are left alone
+        patterns, templates, errors = {}, {}, []
+        for position, pattern in enumerate(catalog.get('patterns', []), start=1):
+            key = self._pattern_key(pattern)
+            if key is None:
+                errors.append(f"Pattern {position}: pattern_name, source and destination are required")
+            elif key in patterns:
+                errors.append(f"Pattern {position}: duplicate pattern {self._describe(key)}")
+            else:
+                patterns[key] = None
+        for position, template in enumerate(catalog.get('templates', []), start=1):
+            sch_job_template_id = template.get('sch_job_template_id') if isinstance(template, dict) else None
+            if not sch_job_template_id or not isinstance(sch_job_template_id, str):
+                errors.append(f"Template {position}: sch_job_template_id is required")
+                continue
+            content, error = self._template_content(template)
+            if error:
+                errors.append(f"Template {position} ({sch_job_template_id}): {error}")
+            elif templates.setdefault(sch_job_template_id, content) != content:
+                errors.append(f"Template {position}: conflicting definitions of {sch_job_template_id}")
+        for position, relationship in enumerate(catalog.get('relationships', []), start=1):
+            key = self._pattern_key(relationship)
+            sch_job_template_id = relationship.get('sch_job_template_id') if key else None
+            if key not in patterns:
+                errors.append(f"Relationship {position}: pattern {self._describe(key)} is not in the catalog")
+            elif not sch_job_template_id or not isinstance(sch_job_template_id, str):
+                errors.append(f"Relationship {position}: sch_job_template_id is required")
+            else:
+                linked = patterns[key] = patterns[key] or []
+                if sch_job_template_id not in linked:
+                    linked.append(sch_job_template_id)
+        return patterns, templates, errors
+
+    @staticmethod
+    def _pattern_key(row):
+        if not isinstance(row, dict):
+            return None
+        key = tuple(row.get(name) for name in ('source', 'destination', 'pattern_name'))
+        return key if all(value and isinstance(value, str) for value in key) else None
+
+    @staticmethod
+    def _describe(key):
+        return f"'{key[2]}' ({key[0]} -> {key[1]})" if key else "without pattern_name, source and destination"
+
+    @staticmethod
+    def _template_content(template):
+        unknown = set(template) - {'sch_job_template_id', 'delete_after_completion', *CATALOG_TEMPLATE_JSON_FIELDS}
+        if unknown:
+            return None, f"unknown field(s): {', '.join(sorted(unknown))}"
+        content = {'delete_after_completion': template.get('delete_after_completion', False)}
+        if not isinstance(content['delete_after_completion'], bool):
+            return None, "delete_after_completion must be true or false"
+        for field in CATALOG_TEMPLATE_JSON_FIELDS:
+            content[field] = template.get(field) or {}
+            if not isinstance(content[field], dict):
+                return None, f"{field} must be an object"
+        return content, None
+
+    @staticmethod
+    def _content_hash(content):
+        return hashlib.sha1(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+    def import_catalog(self, catalog, dry_run=False):
+        patterns, templates, errors = self.validate(catalog)
+        result = {
+            'patterns': {'inserted': 0, 'relinked': 0, 'unchanged': 0},
+            'templates': {'inserted': 0, 'updated': 0, 'unchanged': 0},
+            'relationships': {'inserted': 0, 'deleted': 0},
+            'revision': None,
+            'dry_run': dry_run,
+            'errors': errors,
+        }
+        if errors:
+            return result
+        with self.db_manager.app.app_context():
+            engine = self.db_manager.db.engine
+        with engine.connect() as connection:
+            transaction = connection.begin()
+            try:
+                changed = self._import(connection, patterns, templates, result)
+                if result['errors'] or dry_run:
+                    transaction.rollback()
+                else:
+                    transaction.commit()
+            except Exception:
+                transaction.rollback()
+                raise
+        if changed and not result['errors'] and not dry_run:
+            self.logger.log_msg('info', f"Imported the catalog at revision {result['revision']}: "
+                                        f"{json.dumps({name: result[name] for name in ('patterns', 'templates')})}")
+            if self.catalog is not None:
+                self.catalog.invalidate()
+        return result
+
+    def _import(self, connection, patterns, templates, result):
+        now = datetime.now()
+        pattern_table = IngestionPattern.__table__
+        template_table = JobTemplate.__table__
+        relationship_table = IngestionPatternJobTemplateRelationship.__table__
+
+        # job templates: insert new ones, update the ones whose content hash changed
+        existing_templates = {}
+        for row in connection.execute(select(template_table.c.job_template_id, template_table.c.sch_job_template_id,
+                                             template_table.c.delete_after_completion,
+                                             *(template_table.c[field] for field in CATALOG_TEMPLATE_JSON_FIELDS))
+                                      .order_by(template_table.c.job_template_id)).mappings():
+            content = {'delete_after_completion': bool(row['delete_after_completion'])}
+            content.update({field: row[field] or {} for field in CATALOG_TEMPLATE_JSON_FIELDS})
+            # several rows may share a ControlHub template, the oldest one is kept up to date
+            existing_templates.setdefault(row['sch_job_template_id'],
+                                          (row['job_template_id'], self._content_hash(content)))
+        referenced = {sch_job_template_id for template_ids in patterns.values() if template_ids
+                      for sch_job_template_id in template_ids}
+        unknown = sorted(referenced - templates.keys() - existing_templates.keys())
+        if unknown:
+            result['errors'].append(f"Unknown job template(s): {', '.join(unknown)}")
+            return False
+        new_templates = [sch_job_template_id for sch_job_template_id in templates
+                         if sch_job_template_id not in existing_templates]
+        changed_templates = [sch_job_template_id for sch_job_template_id, content in templates.items()
+                             if sch_job_template_id in existing_templates and
+                             existing_templates[sch_job_template_id][1] != self._content_hash(content)]
+        if new_templates:
+            connection.execute(insert(template_table), [
+                {'sch_job_template_id': sch_job_template_id, 'create_timestamp': now} | templates[sch_job_template_id]
+                for sch_job_template_id in new_templates])
+        if changed_templates:
+            connection.execute(
+                update(template_table).where(template_table.c.job_template_id == bindparam('b_job_template_id')),
+                [{'b_job_template_id': existing_templates[sch_job_template_id][0]} | templates[sch_job_template_id]
+                 for sch_job_template_id in changed_templates])
+        result['templates'] = {'inserted': len(new_templates), 'updated': len(changed_templates),
+                               'unchanged': len(templates) - len(new_templates) - len(changed_templates)}
+        template_ids = {sch_job_template_id: job_template_id for sch_job_template_id, (job_template_id, _)
+                        in existing_templates.items()}
+        if new_templates:
+            for job_template_id, sch_job_template_id in connection.execute(
+                    select(template_table.c.job_template_id, template_table.c.sch_job_template_id)
+                    .order_by(template_table.c.job_template_id)):
+                template_ids.setdefault(sch_job_template_id, job_template_id)
+
+        # ingestion patterns: insert the new ones
+        pattern_columns = (pattern_table.c.source, pattern_table.c.destination, pattern_table.c.pattern_name)
+        pattern_ids = {tuple(row[1:]): row[0] for row in connection.execute(
+            select(pattern_table.c.ingestion_pattern_id, *pattern_columns))}
+        new_patterns = [key for key in patterns if key not in pattern_ids]
+        if new_patterns:
+            connection.execute(insert(pattern_table), [
+                {'source': source, 'destination': destination, 'pattern_name': pattern_name, 'create_timestamp': now}
+                for source, destination, pattern_name in new_patterns])
+            pattern_ids = {tuple(row[1:]): row[0] for row in connection.execute(
+                select(pattern_table.c.ingestion_pattern_id, *pattern_columns))}
+
+        # relationships: a pattern whose ordered list of templates changed gets its relationships replaced, a pattern
+        # without relationships in the catalog keeps its own
+        existing_relationships = {}
+        for ingestion_pattern_id, job_template_id in connection.execute(
+                select(relationship_table.c.ingestion_pattern_id, relationship_table.c.job_template_id)
+                .order_by(relationship_table.c.ingestion_pattern_id, relationship_table.c.rel_id)):
+            existing_relationships.setdefault(ingestion_pattern_id, []).append(job_template_id)
+        relinked = {}
+        for key, sch_job_template_ids in patterns.items():
+            if sch_job_template_ids is None:
+                continue
+            job_template_ids = [template_ids[sch_job_template_id] for sch_job_template_id in sch_job_template_ids]
+            if existing_relationships.get(pattern_ids[key], []) != job_template_ids:
+                relinked[pattern_ids[key]] = job_template_ids
+        if relinked:
+            result['relationships']['deleted'] = sum(len(existing_relationships.get(ingestion_pattern_id, []))
+                                                     for ingestion_pattern_id in relinked)
+            connection.execute(
+                delete(relationship_table)
+                .where(relationship_table.c.ingestion_pattern_id == bindparam('b_ingestion_pattern_id')),
+                [{'b_ingestion_pattern_id': ingestion_pattern_id} for ingestion_pattern_id in relinked])
+            rows = [{'ingestion_pattern_id': ingestion_pattern_id, 'job_template_id': job_template_id}
+                    for ingestion_pattern_id, job_template_ids in relinked.items()
+                    for job_template_id in job_template_ids]
+            if rows:
+                connection.execute(insert(relationship_table), rows)
+            result['relationships']['inserted'] = len(rows)
+        result['patterns'] = {'inserted': len(new_patterns),
+                              'relinked': len([key for key in patterns if key not in new_patterns and
+                                               pattern_ids[key] in relinked]),
+                              'unchanged': len([key for key in patterns if pattern_ids[key] not in relinked and
+                                                key not in new_patterns])}
+
+        changed = bool(new_templates or changed_templates or new_patterns or relinked)
+        revision_table = CatalogRevision.__table__
+        if changed and not connection.execute(
+                update(revision_table).where(revision_table.c.catalog_revision_id == 1)
+                .values(revision=revision_table.c.revision + 1, update_timestamp=now)).rowcount:
+            connection.execute(insert(revision_table).values(catalog_revision_id=1, revision=1, update_timestamp=now))
+        result['revision'] = connection.execute(select(revision_table.c.revision)).scalar() or 0
+        return changed
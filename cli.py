@@ -0,0 +1,144 @@
+import argparse
+import getpass
+import json
+
+from bulk_submit_manager import BulkSubmitter
+from catalog_manager import CatalogImporter
+from db_manager import DatabaseManager, MIGRATIONS
+from log_manager import LogIndex, LOG_SEARCH_MAX_LINES
+from stats_manager import JobStats
+
+
+# Command line entry point for maintenance tasks that run outside the web app
+class IngestHubCli:
+    def __init__(self):
+        self.parser = argparse.ArgumentParser(prog='python cli.py', description='IngestHub maintenance commands')
+        self.subparsers = self.parser.add_subparsers(dest='command', required=True)
+        self.add_db_commands()
+        self.add_catalog_commands()
+        self.add_stats_commands()
+        self.add_logs_commands()
+        self.add_jobs_commands()
+
+    def add_db_commands(self):
+        db_parser = self.subparsers.add_parser('db', help='database schema management')
+        db_commands = db_parser.add_subparsers(dest='db_command', required=True)
+        db_commands.add_parser('init', help='create or upgrade the schema and load the example job templates into '
+                                            'an empty database')
+        db_commands.add_parser('upgrade', help='create missing tables and apply pending schema migrations')
+        db_commands.add_parser('status', help='show the schema version and pending migrations')
+        db_parser.set_defaults(handler=self.db)
+
+    def db(self, args):
+        db_manager = DatabaseManager()
+        if args.db_command == 'init':
+            db_manager.bootstrap()
+        elif args.db_command == 'upgrade':
+            db_manager.upgrade_schema()
+        print(f"Schema version: {db_manager.schema_version()} (latest: {MIGRATIONS[-1][0]})")
+        for version, description, _ in db_manager.pending_migrations():
+            print(f"  pending {version}: {description}")
+
+    def add_catalog_commands(self):
+        catalog_parser = self.subparsers.add_parser('catalog', help='ingestion patterns and job templates')
+        catalog_commands = catalog_parser.add_subparsers(dest='catalog_command', required=True)
+        import_parser = catalog_commands.add_parser(
+            'import', help='add new and update changed patterns, templates and relationships from a catalog file')
+        import_parser.add_argument('file', help="JSON/YAML with 'patterns', 'templates' and 'relationships' lists, or "
+                                                "a CSV with one row per relationship")
+        import_parser.add_argument('--format', choices=['json', 'yaml', 'csv'], help='default: from the file extension')
+        import_parser.add_argument('--dry-run', action='store_true', help='report the changes without writing them')
+        catalog_parser.set_defaults(handler=self.catalog)
+
+    def catalog(self, args):
+        db_manager = DatabaseManager()
+        db_manager.create_tables()
+        importer = CatalogImporter(db_manager)
+        try:
+            with open(args.file, 'rb') as catalog_file:
+                catalog = importer.parse(catalog_file.read(), args.format or importer.file_format(args.file))
+        except (OSError, ValueError) as e:
+            self.parser.error(str(e))
+        result = importer.import_catalog(catalog, dry_run=args.dry_run)
+        print(json.dumps(result, indent=2))
+        if result['errors']:
+            raise SystemExit(1)
+
+    def add_stats_commands(self):
+        stats_parser = self.subparsers.add_parser('stats', help='job run statistics')
+        stats_commands = stats_parser.add_subparsers(dest='stats_command', required=True)
+        stats_commands.add_parser('rebuild', help='recompute the hourly and daily rollups from the job history')
+        stats_parser.set_defaults(handler=self.stats)
+
+    def stats(self, args):
+        db_manager = DatabaseManager()
+        db_manager.create_tables()
+        print(f"Rolled up {JobStats(db_manager).rebuild()} job run(s)")
+
+    def add_logs_commands(self):
+        logs_parser = self.subparsers.add_parser('logs', help='search ingest_hub.log and its rotated files')
+        logs_commands = logs_parser.add_subparsers(dest='logs_command', required=True)
+        logs_commands.add_parser('index', help='bring the log search index up to date and show its size')
+        search_parser = logs_commands.add_parser('search', help='print the log lines of a job and/or time range')
+        search_parser.add_argument('--job', help='job name, as shown between [] in the log')
+        search_parser.add_argument('--since', help='ISO timestamp, e.g. 2024-05-01T10:00:00')
+        search_parser.add_argument('--until', help='ISO timestamp (inclusive)')
+        search_parser.add_argument('--limit', type=int, default=LOG_SEARCH_MAX_LINES, help='max number of lines')
+        logs_parser.set_defaults(handler=self.logs)
+
+    def logs(self, args):
+        log_index = LogIndex()
+        if args.logs_command == 'index':
+            for name, value in log_index.stats().items():
+                print(f"{name}: {value}")
+        else:
+            try:
+                lines = log_index.search(args.job, args.since, args.until, args.limit)
+            except ValueError as e:
+                self.parser.error(f"invalid timestamp: {e}")
+            for line in lines:
+                print(line)
+
+    def add_jobs_commands(self):
+        jobs_parser = self.subparsers.add_parser('jobs', help='start ControlHub jobs')
+        jobs_commands = jobs_parser.add_subparsers(dest='jobs_command', required=True)
+        submit_parser = jobs_commands.add_parser(
+            'bulk-submit', help='start one job instance per runtime parameter set in a CSV or JSON lines file')
+        submit_parser.add_argument('file', help='CSV with a header row of parameter names, or one JSON object per line')
+        submit_parser.add_argument('--job-template-id', required=True, help='ControlHub job template ID')
+        submit_parser.add_argument('--format', choices=['csv', 'jsonl'], help='default: from the file extension')
+        submit_parser.add_argument('--instance-name-suffix', default='Counter',
+                                   choices=['Counter', 'Timestamp', 'Parameter Value'])
+        submit_parser.add_argument('--suffix-parameter-name', help='parameter used with --instance-name-suffix '
+                                                                   '"Parameter Value"')
+        submit_parser.add_argument('--user', default=getpass.getuser(), help='user recorded for the started jobs')
+        jobs_parser.set_defaults(handler=self.jobs)
+
+    def jobs(self, args):
+        # imported here, so the other commands don't need the StreamSets SDK
+        from streamsets_manager import StreamSetsManager
+
+        db_manager = DatabaseManager()
+        streamsets_manager = StreamSetsManager(db_manager)
+        # started jobs are left to the web app or `python monitor.py`, this process exits right away
+        streamsets_manager.monitor.in_process = False
+        bulk_submitter = BulkSubmitter(db_manager, streamsets_manager)
+        try:
+            with open(args.file, 'rb') as parameter_file:
+                parameter_sets = bulk_submitter.parse(parameter_file.read(),
+                                                      args.format or bulk_submitter.file_format(args.file))
+        except (OSError, ValueError) as e:
+            self.parser.error(str(e))
+        result = bulk_submitter.submit(args.user, args.job_template_id, parameter_sets, args.instance_name_suffix,
+                                       args.suffix_parameter_name)
+        print(json.dumps(result, indent=2))
+        if result['errors'] or result['failed']:
+            raise SystemExit(1)
+
+    def run(self, argv=None):
+        args = self.parser.parse_args(argv)
+        args.handler(args)
+
+
+if __name__ == "__main__":
+    IngestHubCli().run()
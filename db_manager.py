@@ -1,59 +1,197 @@
 import os
+import weakref
+from datetime import datetime
+from time import perf_counter
+
 from flask import Flask
 from flask_login import UserMixin
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
-from sqlalchemy import Integer, String, TIMESTAMP, Boolean, ForeignKey, JSON, text
+from sqlalchemy import Integer, BigInteger, Float, String, TIMESTAMP, Boolean, ForeignKey, JSON, Index, tuple_, inspect, select, \
+    func, event, make_url, or_
 
+from cache_manager import TTLCache
 from ingesthub_logger import Logger
+from profiling_manager import current_profile
+from telemetry_manager import telemetry
+
+# how long approximate table row counts (e.g. for "page X of Y") are reused before counting again
+ROW_COUNT_CACHE_TTL_SECS = int(os.environ.get('ROW_COUNT_CACHE_TTL_SECS', 60))
+# whether pending schema migrations are applied when the app or a monitor starts (otherwise run `python cli.py db upgrade`)
+DB_AUTO_MIGRATE = os.environ.get('DB_AUTO_MIGRATE', 'true').lower() == 'true'
+# catalog of ingestion patterns and job templates loaded into an empty database (see `python cli.py catalog import`)
+CATALOG_SEED_FILE = os.environ.get('CATALOG_SEED_FILE', 'sql/catalog.json')
+
+
+# connection pool of the database engine: kept open connections, extra connections under load, seconds to wait for
+# a free connection, seconds after which connections are replaced, and whether connections are tested before use
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT_SECS = int(os.environ.get('DB_POOL_TIMEOUT_SECS', 30))
+DB_POOL_RECYCLE_SECS = int(os.environ.get('DB_POOL_RECYCLE_SECS', 30 * 60))
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true'
+# SQLite only: write-ahead logging (readers don't wait for writers), how long a writer waits for the write lock,
+# and how much of the database file is read through memory-mapped I/O
+DB_SQLITE_WAL = os.environ.get('DB_SQLITE_WAL', 'true').lower() == 'true'
+DB_SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('DB_SQLITE_BUSY_TIMEOUT_MS', 5000))
+DB_SQLITE_MMAP_BYTES = int(os.environ.get('DB_SQLITE_MMAP_BYTES', 256 * 1024 * 1024))
+# statement kinds timed separately, any other statement is timed as 'OTHER'
+DB_STATEMENT_KINDS = {'SELECT', 'INSERT', 'UPDATE', 'DELETE'}
+
+DB_QUERY_SECONDS = telemetry.histogram('ingesthub_db_query_duration_seconds', 'Database statement latency',
+                                       ['statement'])
+
+
+def engine_options(database_uri):
+    url = make_url(database_uri)
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        # in-memory SQLite lives in a single shared connection
+        return {}
+    return {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT_SECS,
+        'pool_recycle': DB_POOL_RECYCLE_SECS,
+        'pool_pre_ping': DB_POOL_PRE_PING,
+    }
 
 
 # Database and Flask Configuration as a separate class
 class Config:
     SECRET_KEY = os.environ.get('FLASK_KEY')
     SQLALCHEMY_DATABASE_URI = os.environ.get('DB_URI','sqlite:///streamsets.db')
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI)
 
 
 # Flask App Class
 class DatabaseManager:
-    def __init__(self):
+    # The web app passes its Flask app, so pages, monitors and the CLI share one engine (and connection pool)
+    def __init__(self, app=None):
         self.logger = Logger()
-        self.app = Flask(__name__)
+        self.app = app or Flask(__name__)
         self.app.config.from_object(Config)
         self.db = self.init_db()
+        self.row_counts = TTLCache(maxsize=64, ttl=ROW_COUNT_CACHE_TTL_SECS)
 
     def init_db(self):
         db = SQLAlchemy(model_class=Base)
         db.init_app(self.app)
+        with self.app.app_context():
+            engine = db.engine
+        if engine.dialect.name == 'sqlite':
+            event.listen(engine, 'connect', self._configure_sqlite)
+        event.listen(engine, 'before_cursor_execute', self._query_started)
+        event.listen(engine, 'after_cursor_execute', self._query_finished)
+        _engines.add(engine)
         return db
 
-    def create_tables(self):
+    @staticmethod
+    def _configure_sqlite(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute(f"PRAGMA busy_timeout = {DB_SQLITE_BUSY_TIMEOUT_MS}")
+            if DB_SQLITE_WAL:
+                # persistent and cheap to repeat; NORMAL only risks the last commits on power loss in WAL mode
+                cursor.execute("PRAGMA journal_mode = WAL")
+                cursor.execute("PRAGMA synchronous = NORMAL")
+            cursor.execute(f"PRAGMA mmap_size = {DB_SQLITE_MMAP_BYTES}")
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def _query_started(connection, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context.query_started = perf_counter()
+
+    @staticmethod
+    def _query_finished(connection, cursor, statement, parameters, context, executemany):
+        started = getattr(context, 'query_started', None)
+        if started is not None:
+            elapsed = perf_counter() - started
+            kind = statement.lstrip()[:6].upper()
+            DB_QUERY_SECONDS.observe(elapsed, kind if kind in DB_STATEMENT_KINDS else 'OTHER')
+            profile = current_profile.get()
+            if profile is not None:
+                profile.record_query(statement, elapsed)
+
+    def create_tables(self, migrate=DB_AUTO_MIGRATE):
+        if migrate:
+            self.upgrade_schema()
+            return
         with self.app.app_context():
             self.db.create_all()
+        pending_migrations = self.pending_migrations()
+        if pending_migrations:
+            self.logger.log_msg('warning', f"{len(pending_migrations)} schema migration(s) pending, "
+                                           f"run 'python cli.py db upgrade'")
 
-    def load_templates(self):
+    def schema_version(self):
         with self.app.app_context():
-            try:
-                with open('sql/initial.sql', 'r') as file:
-                    template_sql = file.read().split(';')
+            if not inspect(self.db.engine).has_table(SchemaVersion.__tablename__):
+                return 0
+            return self.db.session.execute(select(func.max(SchemaVersion.version))).scalar() or 0
 
-                for statement in template_sql:
-                    if statement.strip():  # Avoid empty statements
-                        self.db.session.execute(text(statement.strip()))
+    def pending_migrations(self):
+        current_version = self.schema_version()
+        return [migration for migration in MIGRATIONS if migration[0] > current_version]
 
-                self.db.session.commit()
-                self.logger.log_msg('info', f"DB initialized with example job templates")
-
-            except Exception as e:
-                self.db.session.rollback()
-                self.logger.log_msg('error', f"Failed to initialize the DB with example job templates: {e}")
+    def upgrade_schema(self):
+        with self.app.app_context():
+            engine = self.db.engine
+            # A database without the original tables is created from the current models and needs no migrations
+            fresh = not inspect(engine).has_table(JobInstance.__tablename__)
+            self.db.create_all()
+            if fresh:
+                with engine.begin() as connection:
+                    self._record_migration(connection, *MIGRATIONS[-1][:2])
+                self.logger.log_msg('info', f"Created database schema at version {MIGRATIONS[-1][0]}")
+                return
+        for version, description, migrate in self.pending_migrations():
+            with self.app.app_context():
+                try:
+                    # each migration runs in its own transaction, recorded along with its changes
+                    with self.db.engine.begin() as connection:
+                        migrate(connection)
+                        self._record_migration(connection, version, description)
+                except Exception as e:
+                    self.logger.log_msg('error', f"Schema migration {version} ({description}) failed: {e}")
+                    raise
+            self.logger.log_msg('info', f"Applied schema migration {version}: {description}")
+
+    @staticmethod
+    def _record_migration(connection, version, description):
+        connection.execute(SchemaVersion.__table__.insert().values(
+            version=version, description=description, applied_time=datetime.now()))
+
+    def load_templates(self, catalog_file=CATALOG_SEED_FILE):
+        # imported here, the catalog importer builds on the models of this module
+        from catalog_manager import CatalogImporter
+
+        try:
+            importer = CatalogImporter(self)
+            with open(catalog_file, 'rb') as file:
+                catalog = importer.parse(file.read(), importer.file_format(catalog_file))
+            result = importer.import_catalog(catalog)
+            if result['errors']:
+                raise ValueError('; '.join(result['errors']))
+            self.logger.log_msg('info', f"DB initialized with example job templates")
+        except Exception as e:
+            self.logger.log_msg('error', f"Failed to initialize the DB with example job templates: {e}")
 
     def check_tables_empty(self, tables):
-        for table in tables:
-            count = self.row_count(table)
-            if count > 0:
-                return False
-        return True
+        # a single round trip that stops at the first row found, instead of counting every table
+        with self.app.app_context():
+            return not self.db.session.execute(select(or_(*(select(table).exists() for table in tables)))).scalar()
+
+    def bootstrap(self):
+        # Create (or upgrade) the schema and load the example job templates into an empty database
+        self.create_tables()
+        if self.check_tables_empty([User, IngestionPattern, JobTemplate, IngestionPatternJobTemplateRelationship,
+                                    JobInstance]):
+            self.logger.log_msg('info', "Initializing the database with example job templates...")
+            self.load_templates()
+        else:
+            self.logger.log_msg('info', "Example template data already loaded, skipping loading of templates data")
 
     def write_to_table(self, record):
         with self.app.app_context():
@@ -73,6 +211,39 @@ class DatabaseManager:
         with self.app.app_context():
             return self.db.session.query(table).count()
 
+    def approximate_row_count(self, table):
+        # Row count that may lag behind by up to ROW_COUNT_CACHE_TTL_SECS, for display purposes
+        return self.row_counts.get_or_load(table.__tablename__, lambda: self.row_count(table))
+
+    def keyset_page(self, table, key_columns, limit, after=None, before=None):
+        # A page of rows ordered by key_columns descending, starting right after (or ending right before)
+        # the given key values. Returns the rows and whether more rows exist beyond the page.
+        with self.app.app_context():
+            key = tuple_(*key_columns)
+            query = self.db.session.query(table)
+            if before is not None:
+                rows = (query.filter(key > tuple_(*before))
+                        .order_by(*[column.asc() for column in key_columns]).limit(limit + 1).all())
+                return list(reversed(rows[:limit])), len(rows) > limit
+            if after is not None:
+                query = query.filter(key < tuple_(*after))
+            rows = query.order_by(*[column.desc() for column in key_columns]).limit(limit + 1).all()
+            return rows[:limit], len(rows) > limit
+
+
+# Engines of this process. Held weakly, so the engine of a discarded DatabaseManager (e.g. of an earlier
+# create_app()) is collected.
+_engines = weakref.WeakSet()
+
+
+def _after_fork_in_child():
+    # pooled connections must not be shared with forked processes (e.g. gunicorn workers of a preloaded app)
+    for engine in list(_engines):
+        engine.dispose(close=False)
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
+
 
 # Base class for models
 class Base(DeclarativeBase):
@@ -81,6 +252,14 @@ class Base(DeclarativeBase):
 
 # Define table schema classes
 
+class SchemaVersion(Base):
+    __tablename__ = 'schema_version'
+
+    version: Mapped[int] = mapped_column(Integer, primary_key=True)
+    description: Mapped[str] = mapped_column(String, nullable=False)
+    applied_time: Mapped[str] = mapped_column(TIMESTAMP, nullable=False)
+
+
 class User(UserMixin, Base):
     __tablename__ = "users"
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
@@ -91,6 +270,10 @@ class User(UserMixin, Base):
 
 class IngestionPattern(Base):
     __tablename__ = 'ingestion_pattern'
+    __table_args__ = (
+        # also serves source/destination lookups
+        Index('uq_ingestion_pattern_source_destination_name', 'source', 'destination', 'pattern_name', unique=True),
+    )
 
     ingestion_pattern_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     pattern_name: Mapped[str] = mapped_column(String, nullable=False)
@@ -103,7 +286,7 @@ class JobTemplate(Base):
     __tablename__ = 'job_template'
 
     job_template_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    sch_job_template_id: Mapped[str] = mapped_column(String, nullable=False)
+    sch_job_template_id: Mapped[str] = mapped_column(String, nullable=False, index=True)
     delete_after_completion: Mapped[bool] = mapped_column(Boolean, nullable=False)
     source_runtime_parameters: Mapped[dict] = mapped_column(JSON)
     destination_runtime_parameters: Mapped[dict] = mapped_column(JSON)
@@ -117,16 +300,43 @@ class IngestionPatternJobTemplateRelationship(Base):
 
     rel_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     ingestion_pattern_id: Mapped[int] = mapped_column(Integer, ForeignKey('ingestion_pattern.ingestion_pattern_id'),
-                                                      nullable=False)
-    job_template_id: Mapped[int] = mapped_column(Integer, ForeignKey('job_template.job_template_id'), nullable=False)
+                                                      nullable=False, index=True)
+    job_template_id: Mapped[int] = mapped_column(Integer, ForeignKey('job_template.job_template_id'), nullable=False,
+                                                 index=True)
+
+
+# Bumped by every catalog import, so every process reloads its in-memory template catalog
+class CatalogRevision(Base):
+    __tablename__ = 'catalog_revision'
+
+    catalog_revision_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    revision: Mapped[int] = mapped_column(Integer, nullable=False)
+    update_timestamp: Mapped[str] = mapped_column(TIMESTAMP, nullable=False)
+
+
+# Unfinished job submissions of the wizard, when kept in the database (see wizard_manager.WIZARD_STATE_STORE)
+class WizardSession(Base):
+    __tablename__ = 'wizard_session'
+
+    token: Mapped[str] = mapped_column(String, primary_key=True)
+    user_id: Mapped[str] = mapped_column(String, nullable=False)
+    state: Mapped[dict] = mapped_column(JSON, nullable=False)
+    expires_at: Mapped[str] = mapped_column(TIMESTAMP, nullable=False, index=True)
 
 
 class JobInstance(Base):
     __tablename__ = 'job_instance'
+    __table_args__ = (
+        # keyset pagination of the job history, overall and filtered by user, template or outcome
+        Index('ix_job_instance_start_time_id', 'start_time', 'job_instance_id'),
+        Index('ix_job_instance_user_start_time', 'user_id', 'start_time'),
+        Index('ix_job_instance_template_start_time', 'job_template_id', 'start_time'),
+        Index('ix_job_instance_success_start_time', 'successful_run', 'start_time'),
+    )
 
     job_instance_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     job_id: Mapped[str] = mapped_column(String, nullable=False)
-    job_run_count: Mapped[int] = mapped_column(String, nullable=False)
+    job_run_count: Mapped[int] = mapped_column(Integer, nullable=False)
     job_template_id: Mapped[int] = mapped_column(Integer, ForeignKey('job_template.job_template_id'), nullable=False)
     user_id: Mapped[str] = mapped_column(String, nullable=False)
     engine_id: Mapped[str] = mapped_column(String, nullable=False)
@@ -138,3 +348,137 @@ class JobInstance(Base):
     error_message: Mapped[str] = mapped_column(String)
     start_time: Mapped[str] = mapped_column(TIMESTAMP)
     finish_time: Mapped[str] = mapped_column(TIMESTAMP)
+
+
+# Hourly and daily totals of the job runs per job template, user and engine, updated along with every metrics write
+class JobStatsRollup(Base):
+    __tablename__ = 'job_stats_rollup'
+    __table_args__ = (
+        Index('uq_job_stats_rollup_bucket', 'dimension', 'dimension_value', 'period', 'bucket_start', unique=True),
+        Index('ix_job_stats_rollup_dimension_period', 'dimension', 'period', 'bucket_start'),
+    )
+
+    rollup_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    # 'job_template' (job_template_id), 'user' (user_id) or 'engine' (engine_id)
+    dimension: Mapped[str] = mapped_column(String, nullable=False)
+    dimension_value: Mapped[str] = mapped_column(String, nullable=False)
+    # 'hour' or 'day', of the job runs' start time
+    period: Mapped[str] = mapped_column(String, nullable=False)
+    bucket_start: Mapped[str] = mapped_column(TIMESTAMP, nullable=False)
+    run_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    successful_run_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    input_record_count: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    output_record_count: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    error_record_count: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    duration_secs: Mapped[float] = mapped_column(Float, nullable=False, default=0)
+    # number of runs by duration, each bucket above the previous one's bound (see stats_manager.STATS_DURATION_BUCKETS)
+    runs_under_30s: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    runs_under_1m: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    runs_under_2m: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    runs_under_5m: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    runs_under_10m: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    runs_under_30m: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    runs_under_1h: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    runs_under_2h: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    runs_under_4h: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    runs_under_8h: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    runs_under_24h: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    runs_over_24h: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+
+class PendingJob(Base):
+    __tablename__ = 'pending_job'
+
+    pending_job_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    job_id: Mapped[str] = mapped_column(String, nullable=False, unique=True)
+    job_name: Mapped[str] = mapped_column(String, nullable=False)
+    sch_job_template_id: Mapped[str] = mapped_column(String, nullable=False)
+    user_id: Mapped[str] = mapped_column(String, nullable=False)
+    submit_time: Mapped[str] = mapped_column(TIMESTAMP, nullable=False)
+    lease_owner: Mapped[str] = mapped_column(String, nullable=True, index=True)
+    lease_expires_at: Mapped[str] = mapped_column(TIMESTAMP, nullable=True)
+    # progress of the running job, captured by its monitor on every status check
+    input_record_count: Mapped[int] = mapped_column(BigInteger, nullable=True)
+    output_record_count: Mapped[int] = mapped_column(BigInteger, nullable=True)
+    error_record_count: Mapped[int] = mapped_column(BigInteger, nullable=True)
+    records_per_sec: Mapped[float] = mapped_column(Float, nullable=True)
+    progress_time: Mapped[str] = mapped_column(TIMESTAMP, nullable=True)
+
+
+# Schema migrations for databases created by earlier versions, applied in order by DatabaseManager.upgrade_schema.
+# New databases are created from the models above and recorded at the latest version.
+# job_instance as of schema version 1; migrations must not depend on the models, which keep changing
+_JOB_INSTANCE_V1_COLUMNS = ['job_instance_id', 'job_id', 'job_run_count', 'job_template_id', 'user_id', 'engine_id',
+                            'pipeline_id', 'successful_run', 'input_record_count', 'output_record_count',
+                            'error_record_count', 'error_message', 'start_time', 'finish_time']
+_JOB_INSTANCE_V1_SQLITE = """CREATE TABLE job_instance (
+    job_instance_id INTEGER NOT NULL,
+    job_id VARCHAR NOT NULL,
+    job_run_count INTEGER NOT NULL,
+    job_template_id INTEGER NOT NULL,
+    user_id VARCHAR NOT NULL,
+    engine_id VARCHAR NOT NULL,
+    pipeline_id VARCHAR NOT NULL,
+    successful_run BOOLEAN NOT NULL,
+    input_record_count INTEGER NOT NULL,
+    output_record_count INTEGER NOT NULL,
+    error_record_count INTEGER NOT NULL,
+    error_message VARCHAR NOT NULL,
+    start_time TIMESTAMP NOT NULL,
+    finish_time TIMESTAMP NOT NULL,
+    PRIMARY KEY (job_instance_id),
+    FOREIGN KEY(job_template_id) REFERENCES job_template (job_template_id)
+)"""
+
+
+def _migrate_job_run_count_to_integer(connection):
+    if connection.dialect.name == 'sqlite':
+        # SQLite cannot change a column type in place, rebuild the table as of this version
+        for index in inspect(connection).get_indexes('job_instance'):
+            connection.exec_driver_sql(f"DROP INDEX {index['name']}")
+        connection.exec_driver_sql("ALTER TABLE job_instance RENAME TO job_instance_old")
+        connection.exec_driver_sql(_JOB_INSTANCE_V1_SQLITE)
+        columns = _JOB_INSTANCE_V1_COLUMNS
+        selected = ['CAST(job_run_count AS INTEGER)' if column == 'job_run_count' else column for column in columns]
+        connection.exec_driver_sql(f"INSERT INTO job_instance ({', '.join(columns)}) "
+                                   f"SELECT {', '.join(selected)} FROM job_instance_old")
+        connection.exec_driver_sql("DROP TABLE job_instance_old")
+    else:
+        connection.exec_driver_sql("ALTER TABLE job_instance ALTER COLUMN job_run_count TYPE INTEGER "
+                                   "USING job_run_count::integer")
+
+
+def _migrate_add_indexes(connection):
+    for table in (JobInstance, JobTemplate, IngestionPatternJobTemplateRelationship, PendingJob):
+        for index in table.__table__.indexes:
+            if not index.unique:
+                index.create(connection, checkfirst=True)
+
+
+def _migrate_unique_ingestion_pattern(connection):
+    duplicates = connection.exec_driver_sql(
+        "SELECT source, destination, pattern_name FROM ingestion_pattern "
+        "GROUP BY source, destination, pattern_name HAVING COUNT(*) > 1").all()
+    if duplicates:
+        raise ValueError(f"Duplicate ingestion patterns must be removed first: {[tuple(row) for row in duplicates]}")
+    for index in IngestionPattern.__table__.indexes:
+        index.create(connection, checkfirst=True)
+
+
+def _migrate_pending_job_progress(connection):
+    existing = {column['name'] for column in inspect(connection).get_columns(PendingJob.__tablename__)}
+    for name in ('input_record_count', 'output_record_count', 'error_record_count', 'records_per_sec',
+                 'progress_time'):
+        if name not in existing:
+            column = PendingJob.__table__.c[name]
+            connection.exec_driver_sql(
+                f"ALTER TABLE pending_job ADD COLUMN {name} {column.type.compile(connection.dialect)}")
+
+
+# (version, description, migration)
+MIGRATIONS = [
+    (1, "store job_instance.job_run_count as an integer", _migrate_job_run_count_to_integer),
+    (2, "index job history, job template and pending job lookups", _migrate_add_indexes),
+    (3, "unique ingestion patterns per source, destination and name", _migrate_unique_ingestion_pattern),
+    (4, "progress of running jobs on pending_job", _migrate_pending_job_progress),
+]
@@ -1,9 +1,17 @@
+import json
+import os
+
 from flask_wtf import FlaskForm
 from wtforms import StringField, SubmitField, PasswordField
 from wtforms.fields.choices import SelectField
 from wtforms.validators import DataRequired, Email
 
-from db_manager import DatabaseManager
+from cache_manager import TTLCache
+
+# max number of generated runtime configuration form classes kept in memory
+FORM_CACHE_MAX_SIZE = int(os.environ.get('FORM_CACHE_MAX_SIZE', 512))
+# how long generated runtime configuration form classes are cached
+FORM_CACHE_TTL_SECS = int(os.environ.get('FORM_CACHE_TTL_SECS', 15 * 60))
 
 
 # RegisterForm to register new users
@@ -30,15 +38,35 @@ class TemplateForm(FlaskForm):
 
 # RuntimeConfigurationsForm to configure source/target configurations
 class FormGenerator:
+    def __init__(self, streamsets_manager):
+        self.streamsets_manager = streamsets_manager
+        # generated form classes keyed by (job template ID, runtime parameters hash, static parameter names,
+        # submit text)
+        self.form_cache = TTLCache(maxsize=FORM_CACHE_MAX_SIZE, ttl=FORM_CACHE_TTL_SECS)
+        # forms of a template invalidated in the template cache are dropped along with it
+        streamsets_manager.on_template_invalidated(self.invalidate)
+
+    def generate_form(self, string_fields_dict, job_template_id, submit_text):
+        job_template_static_params = self.streamsets_manager.get_job_template_static_params(job_template_id)
+        if job_template_static_params is None:
+            # don't cache a form built without knowing which parameters are static
+            raise ValueError(f"Static parameters unavailable for job template ID '{job_template_id}'")
+        key = (job_template_id, json.dumps(string_fields_dict, sort_keys=True, default=str),
+               tuple(sorted(job_template_static_params)), submit_text)
+        return self.form_cache.get_or_load(
+            key, lambda: self._build_form(string_fields_dict, job_template_static_params, submit_text))
+
+    def invalidate(self, job_template_id=None):
+        if job_template_id is None:
+            self.form_cache.invalidate()
+        else:
+            self.form_cache.invalidate_where(lambda key: key[0] == job_template_id)
+
     @staticmethod
-    def generate_form(string_fields_dict, job_template_id, submit_text):
+    def _build_form(string_fields_dict, job_template_static_params, submit_text):
         class DynamicForm(FlaskForm):
             pass
 
-        # import statement here to resolve circular import error
-        from streamsets_manager import StreamSetsManager
-        streamsets_manager = StreamSetsManager(DatabaseManager())
-        job_template_static_params = streamsets_manager.get_job_template_static_params(job_template_id)
         # Dynamically add StringFields using dictionary keys as labels and values as default values
         for label, default_value in string_fields_dict.items():
             if label in job_template_static_params:
@@ -48,7 +76,7 @@ class FormGenerator:
                                     validators=[DataRequired()]))
             else:
                 setattr(DynamicForm, label, StringField(label, default=default_value, validators=[DataRequired()]))
-            setattr(DynamicForm, submit_text, SubmitField(submit_text))
+        setattr(DynamicForm, submit_text, SubmitField(submit_text))
         return DynamicForm
 
 
@@ -0,0 +1,69 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+# Production server settings, used by running `gunicorn` from this directory (see README "To run the app").
+
+# number of worker processes, and of request threads per worker process (gthread workers)
+WEB_WORKERS = int(os.environ.get('WEB_WORKERS', min(multiprocessing.cpu_count() * 2 + 1, 8)))
+WEB_THREADS = int(os.environ.get('WEB_THREADS', 16))
+# 'gthread' (threads), or 'gevent' for cooperative workers where log feeds don't hold an OS thread (pip install gevent)
+WEB_WORKER_CLASS = os.environ.get('WEB_WORKER_CLASS', 'gthread')
+# concurrent connections per gevent worker
+WEB_WORKER_CONNECTIONS = int(os.environ.get('WEB_WORKER_CONNECTIONS', 1000))
+WEB_BIND = os.environ.get('WEB_BIND', '0.0.0.0:5003')
+# seconds a worker may be silent before it is restarted, and seconds it gets to finish its requests on shutdown
+WEB_TIMEOUT_SECS = int(os.environ.get('WEB_TIMEOUT_SECS', 120))
+WEB_GRACEFUL_TIMEOUT_SECS = int(os.environ.get('WEB_GRACEFUL_TIMEOUT_SECS', 60))
+
+if WEB_WORKER_CLASS == 'gevent':
+    # patch before the app is preloaded, so its threads, locks and sockets are cooperative too
+    from gevent import monkey
+    monkey.patch_all()
+
+# a user's wizard steps may be served by different worker processes, keep its state in the database
+if WEB_WORKERS > 1:
+    os.environ.setdefault('WIZARD_STATE_STORE', 'database')
+# every worker saves its metrics there, so /metrics reports the whole server whichever worker serves the scrape
+if WEB_WORKERS > 1 and 'METRICS_DIR' not in os.environ:
+    os.environ['METRICS_DIR'] = tempfile.mkdtemp(prefix='ingesthub-metrics-')
+    METRICS_DIR_CREATED = os.environ['METRICS_DIR']
+else:
+    METRICS_DIR_CREATED = None
+
+wsgi_app = 'ingest_hub:create_app()'
+bind = WEB_BIND
+workers = WEB_WORKERS
+worker_class = WEB_WORKER_CLASS
+threads = WEB_THREADS
+worker_connections = WEB_WORKER_CONNECTIONS
+timeout = WEB_TIMEOUT_SECS
+graceful_timeout = WEB_GRACEFUL_TIMEOUT_SECS
+# create the app once in the master, workers share its memory copy-on-write
+preload_app = True
+
+
+def when_ready(server):
+    # bootstrap the database (schema migrations, example templates) once in the master, before the workers start
+    ingest_hub = server.app.wsgi().extensions['ingest_hub'].config
+    ingest_hub.banner()
+    ingest_hub.initialize_db()
+
+
+def post_fork(server, worker):
+    # start the job monitor in every worker, not in the master
+    from ingest_hub import start_background_services
+    start_background_services(server.app.wsgi())
+
+
+def worker_exit(server, worker):
+    # drain in-flight monitoring and buffered writes before the worker goes away
+    from ingest_hub import stop_background_services
+    stop_background_services(server.app.wsgi())
+
+
+def on_exit(server):
+    # the metrics of this server run are gone with it
+    if METRICS_DIR_CREATED:
+        shutil.rmtree(METRICS_DIR_CREATED, ignore_errors=True)
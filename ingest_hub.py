@@ -1,41 +1,62 @@
-import ast
+import hmac
 import math
 import os
-import time
-import re
-from collections import deque
+from collections import namedtuple
+from datetime import datetime, timedelta
+from threading import Lock
+from time import perf_counter
 
-import pyfiglet
-from flask import Flask, render_template, redirect, url_for, flash, request, Response
+from flask import Flask, render_template, redirect, url_for, flash, request, Response, jsonify, g
 from flask_bootstrap import Bootstrap5
 from flask_ckeditor import CKEditor
 from flask_gravatar import Gravatar
 from flask_login import login_user, LoginManager, current_user, logout_user, login_required
-from sqlalchemy import desc
 from werkzeug.security import generate_password_hash, check_password_hash
-from db_manager import User, IngestionPattern, IngestionPatternJobTemplateRelationship, JobTemplate, DatabaseManager, \
-    JobInstance
+from bulk_submit_manager import BulkSubmitter
+from catalog_manager import TemplateCatalog
+from db_manager import User, DatabaseManager, JobInstance
 from forms import RegisterForm, LoginForm, TemplateForm, FormGenerator, JobInstanceSuffixForm
 from ingesthub_logger import Logger
-
-JOBS_PER_PAGE = 6
+from job_monitor import MONITOR_IN_PROCESS
+from log_manager import LogTailer, LogIndex, LOG_SEARCH_MAX_LINES
+from profiling_manager import RequestProfiler, PROFILE_HEADER
+from stats_manager import STATS_DIMENSIONS, STATS_DEFAULT_DAYS
+from streamsets_manager import StreamSetsManager
+from telemetry_manager import telemetry
+from wizard_manager import WizardStore
+
+# default and max number of jobs shown per page of the job history
+JOBS_PER_PAGE = int(os.environ.get('JOBS_PER_PAGE', 6))
+MAX_JOBS_PER_PAGE = 100
+# shared secret of the admins, sent in ADMIN_TOKEN_HEADER to use the /admin endpoints; unset disables them
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+ADMIN_TOKEN_HEADER = 'X-IngestHub-Admin-Token'
+
+REQUEST_SECONDS = telemetry.histogram('ingesthub_request_duration_seconds',
+                                      'Request latency per route, until the response (or the first event) is returned',
+                                      ['route', 'method', 'status'])
+
+# The components wired by create_app(), kept in app.extensions['ingest_hub']
+IngestHubComponents = namedtuple('IngestHubComponents', [
+    'config', 'db_manager', 'streamsets_manager', 'form_generator', 'job_template_manager', 'log_tailer', 'log_index',
+    'bulk_submitter', 'wizard_store', 'job_stats'])
 
 
 class IngestHubConfig:
     def __init__(self):
         self.logger = Logger(self.__class__.__name__)
         self.app = Flask(__name__)
-        self.db_manager = db_manager
         self.configure_app()
+        # the database manager binds to this app, so the app, its monitors and the catalog share one engine
+        self.db_manager = DatabaseManager(self.app)
         self.init_extensions()
-        self.logger.log_msg("info", pyfiglet.Figlet(font='big', width=80).renderText('IngestHub'))
+        self._db_initialized = False
+        self._db_lock = Lock()
+        self._started = False
 
     def configure_app(self):
-        # Configure secret key and database URI
+        # Configure secret key; the database URI and engine options come from db_manager.Config
         self.app.config['SECRET_KEY'] = os.environ.get('FLASK_KEY')
-        self.app.config[
-            'SQLALCHEMY_DATABASE_URI'] = os.environ.get('DB_URI',
-                                                        'sqlite:///streamsets.db')  # Ensure this is set before initializing db
 
     def init_extensions(self):
         Bootstrap5(self.app)
@@ -48,31 +69,43 @@ class IngestHubConfig:
                  force_lower=False,
                  use_ssl=False,
                  base_url=None)
-        # Initialize DB after configuring the app
-        db_manager.db.init_app(self.app)
 
     def initialize_db(self):
-        try:
-            # self.db_manager.create_tables()
-            with self.app.app_context():
-                self.db_manager.db.create_all()
-            if self.db_manager.check_tables_empty([User, IngestionPattern, JobTemplate,
-                                                   IngestionPatternJobTemplateRelationship, JobInstance]):
-                self.logger.log_msg("info", f"Initializing the database with example job templates...")
-                self.db_manager.load_templates()
-            else:
-                self.logger.log_msg("info", "Example template data already loaded, skipping loading of templates data")
-        except Exception as e:
-            self.logger.log_msg("error", f"Error in database initialization: {e}")
-            self.db_manager.db.session.rollback()
+        with self._db_lock:
+            if self._db_initialized:
+                return
+            try:
+                # creates missing tables, applies pending schema migrations and seeds an empty database
+                self.db_manager.bootstrap()
+                self._db_initialized = True
+            except Exception as e:
+                self.logger.log_msg("error", f"Error in database initialization: {e}")
+                with self.app.app_context():
+                    self.db_manager.db.session.rollback()
+
+    def before_first_request(self):
+        # Servers bootstrap the database at start up, `flask run` and tests on the first request. The job monitor
+        # starts here (or right after the fork for gunicorn workers), never in a reloader or preloading parent process.
+        if not self._started:
+            self.initialize_db()
+            start_background_services(self.app)
+            self._started = True
+
+    def banner(self):
+        # only servers print the banner, so pyfiglet is imported here
+        import pyfiglet
+
+        self.logger.log_msg("info", pyfiglet.Figlet(font='big', width=80).renderText('IngestHub'))
 
     def run(self):
+        self.banner()
+        self.initialize_db()
         self.app.run(host='0.0.0.0', debug=True, port=5003)
 
 
 # Authenticator class to handle user authentication
 class IngestHubAuthenticator:
-    def __init__(self, app):
+    def __init__(self, app, db_manager):
         self.logger = Logger(self.__class__.__name__).get_logger()
         self.login_manager = LoginManager()
         try:
@@ -94,13 +127,74 @@ class IngestHubAuthenticator:
 
 # Routes class to handle all routing and app logic
 class IngestHubRoutes:
-    def __init__(self, app, db_manager, form_generator, job_template_manager):
+    def __init__(self, app, db_manager, streamsets_manager, form_generator, job_template_manager, log_tailer,
+                 log_index, bulk_submitter, wizard_store, job_stats):
         self.logger = Logger(self.__class__.__name__)
         self.app = app
         self.db_manager = db_manager
+        self.streamsets_manager = streamsets_manager
         self.form_generator = form_generator
         self.job_template_manager = job_template_manager
+        self.log_tailer = log_tailer
+        self.log_index = log_index
+        self.bulk_submitter = bulk_submitter
+        self.wizard_store = wizard_store
+        self.job_stats = job_stats
+        self.request_profiler = RequestProfiler()
+        self.setup_request_metrics()
+        self.setup_request_profiling()
         self.setup_routes()
+        self.setup_gauges()
+
+    def setup_request_metrics(self):
+        @self.app.before_request
+        def start_request_timer():
+            g.request_started = perf_counter()
+
+        @self.app.after_request
+        def observe_request(response):
+            started = g.pop('request_started', None)
+            if started is not None:
+                REQUEST_SECONDS.observe(perf_counter() - started, request.endpoint or 'unmatched', request.method,
+                                        response.status_code)
+            return response
+
+    def setup_request_profiling(self):
+        # opt-in, see RequestProfiler; requests that aren't profiled only pay for the checks below
+        profiler = self.request_profiler
+
+        @self.app.before_request
+        def start_request_profile():
+            if profiler.wants(request.headers.get(PROFILE_HEADER)):
+                g.request_profile = profiler.start(request.endpoint, request.method, request.path)
+
+        @self.app.after_request
+        def finish_request_profile(response):
+            profile = g.get('request_profile')
+            if profile is not None:
+                response.headers['Server-Timing'] = profiler.finish(profile)
+            return response
+
+        @self.app.teardown_request
+        def detach_request_profile(error=None):
+            profile = g.pop('request_profile', None)
+            if profile is not None:
+                profile.detach()
+
+    def setup_gauges(self):
+        monitor = self.streamsets_manager.monitor
+        telemetry.gauge('ingesthub_monitored_jobs', 'Jobs currently monitored by the web app', monitor.in_flight)
+        telemetry.gauge('ingesthub_monitor_threads', 'Job monitor scheduler and worker threads', monitor.thread_count)
+        telemetry.gauge('ingesthub_monitor_overdue_seconds', 'How late the most overdue job status check is',
+                        monitor.overdue)
+        telemetry.gauge('ingesthub_log_queue_depth', 'Log records waiting to be written',
+                        lambda: Logger.stats().get('depth', 0))
+        telemetry.gauge('ingesthub_log_records_dropped_total', 'Log records dropped because the log queue was full',
+                        lambda: Logger.stats().get('dropped', 0), metric_type='counter')
+        telemetry.gauge('ingesthub_sse_subscribers', 'Open server-sent event connections', lambda: {
+            ('logs',): self.log_tailer.subscriber_count(),
+            ('progress',): self.streamsets_manager.progress_hub.subscriber_count(),
+        }, labels=['feed'])
 
     def setup_routes(self):
         @self.app.route("/")
@@ -180,45 +274,62 @@ class IngestHubRoutes:
         def load_templates():
             try:
                 form = TemplateForm()
-                result = self.db_manager.db.session.execute(self.db_manager.db.select(IngestionPattern))
-                patterns = result.scalars().all()
-                sources, destinations = [], []
-                for pattern in patterns:
-                    if pattern.source not in sources:
-                        sources.append(pattern.source)
-                    if pattern.destination not in destinations:
-                        destinations.append(pattern.destination)
-
-                form.source.choices.extend([(source, source) for source in sources])
+                form.source.choices.extend(
+                    [(source, source) for source in self.job_template_manager.get_sources()])
+                # only offer the destinations available for the submitted source, so invalid pairs fail validation
+                destinations = self.job_template_manager.get_destinations(form.source.data or None)
                 form.destination.choices.extend([(destination, destination) for destination in destinations])
 
                 if form.validate_on_submit():
-                    selected_source = form.source.data
-                    selected_destination = form.destination.data
+                    # the wizard's choices stay on the server, the following steps only carry its token
+                    wizard = self.wizard_store.create(current_user.id, source=form.source.data,
+                                                      destination=form.destination.data)
                     return redirect(
-                        url_for('source_runtime_parameters', source=selected_source, destination=selected_destination,
-                                logged_in=current_user.is_authenticated))
+                        url_for('source_runtime_parameters', wizard=wizard, logged_in=current_user.is_authenticated))
                 return render_template('templates.html', form=form, logged_in=current_user.is_authenticated)
             except Exception as e:
                 self.logger.log_msg("error", f"Error in load_templates route: {e}")
                 flash(f"Error in load_templates route: {e}", "error")
                 return redirect(url_for('about'))
 
+        @self.app.route('/templates/choices', methods=['GET'])
+        @login_required
+        def template_choices():
+            try:
+                source = request.args.get('source')
+                etag = self.job_template_manager.catalog.choices_etag(source)
+                if etag in request.if_none_match:
+                    return Response(status=304, headers={'ETag': f'"{etag}"'})
+                if source:
+                    response = jsonify(source=source, destinations=self.job_template_manager.get_destinations(source))
+                else:
+                    response = jsonify(sources=self.job_template_manager.get_sources(),
+                                       destinations=self.job_template_manager.get_destinations())
+                response.set_etag(etag)
+                response.cache_control.private = True
+                response.cache_control.no_cache = True
+                return response
+            except Exception as e:
+                self.logger.log_msg("error", f"Error in template_choices route: {e}")
+                return jsonify(error=str(e)), 500
+
         @self.app.route('/source', methods=['GET', 'POST'])
         @login_required
         def source_runtime_parameters():
             try:
-                source = request.args.get('source')
-                destination = request.args.get('destination')
-                job_template = self.job_template_manager.get_job_template(source, destination)
+                wizard = request.args.get('wizard')
+                state = self._wizard_state(wizard)
+                if state is None:
+                    return redirect(url_for('load_templates'))
+                job_template = self.job_template_manager.get_job_template(state.source, state.destination)
                 source_configs = job_template.source_runtime_parameters
                 dynamic_form = self.form_generator.generate_form(source_configs, job_template.sch_job_template_id,
                                                                  submit_text="Next")
                 form = dynamic_form()
                 if form.validate_on_submit():
                     updated_source_configs = {key: getattr(form, key).data for key in source_configs}
-                    return redirect(url_for('target_runtime_parameters', source=source, destination=destination,
-                                            updated_source_configs=updated_source_configs,
+                    self.wizard_store.update(wizard, current_user.id, source_configs=updated_source_configs)
+                    return redirect(url_for('target_runtime_parameters', wizard=wizard,
                                             logged_in=current_user.is_authenticated))
                 return render_template('source.html', form=form, logged_in=current_user.is_authenticated)
             except Exception as e:
@@ -230,19 +341,20 @@ class IngestHubRoutes:
         @login_required
         def target_runtime_parameters():
             try:
-                source = request.args.get('source')
-                destination = request.args.get('destination')
-                source_configs = request.args.get('updated_source_configs')
-                job_template = self.job_template_manager.get_job_template(source, destination)
+                wizard = request.args.get('wizard')
+                state = self._wizard_state(wizard)
+                if state is None:
+                    return redirect(url_for('load_templates'))
+                job_template = self.job_template_manager.get_job_template(state.source, state.destination)
                 target_configs = job_template.destination_runtime_parameters
                 dynamic_form = self.form_generator.generate_form(target_configs, job_template.sch_job_template_id,
                                                                  submit_text="Next")
                 form = dynamic_form()
                 if form.validate_on_submit():
                     updated_target_configs = {key: getattr(form, key).data for key in target_configs}
-                    return redirect(url_for('job_suffix', job_template_id=job_template.sch_job_template_id,
-                                            source_configs=source_configs, target_configs=updated_target_configs,
-                                            logged_in=current_user.is_authenticated))
+                    self.wizard_store.update(wizard, current_user.id, target_configs=updated_target_configs,
+                                             sch_job_template_id=job_template.sch_job_template_id)
+                    return redirect(url_for('job_suffix', wizard=wizard, logged_in=current_user.is_authenticated))
                 return render_template('target.html', form=form, logged_in=current_user.is_authenticated)
             except Exception as e:
                 self.logger.log_msg("error", f"Error in target_runtime_parameters route: {e}")
@@ -253,10 +365,11 @@ class IngestHubRoutes:
         @login_required
         def job_suffix():
             try:
-                source_configs = ast.literal_eval(request.args.get('source_configs'))
-                target_configs = ast.literal_eval(request.args.get('target_configs'))
-                suffix_parameters = source_configs | target_configs
-                sch_job_template_id = request.args.get('job_template_id')
+                wizard = request.args.get('wizard')
+                state = self._wizard_state(wizard)
+                if state is None:
+                    return redirect(url_for('load_templates'))
+                suffix_parameters = (state.source_configs or {}) | (state.target_configs or {})
                 form = JobInstanceSuffixForm()
                 suffix_list = ['Counter', 'Timestamp', 'Parameter Value']
                 form.instance_name_suffix.choices.extend([(suffix, suffix) for suffix in suffix_list])
@@ -264,12 +377,10 @@ class IngestHubRoutes:
                     [(suffix_parameter, suffix_parameter) for suffix_parameter in suffix_parameters])
 
                 if form.validate_on_submit():
-                    instance_name_suffix = form.instance_name_suffix.data
-                    suffix_parameter_name = form.suffix_parameter_name.data
-                    return redirect(
-                        url_for('submit_job', job_template_id=sch_job_template_id, runtime_parameters=suffix_parameters,
-                                suffix_parameter_name=suffix_parameter_name, instance_name_suffix=instance_name_suffix,
-                                logged_in=current_user.is_authenticated))
+                    self.wizard_store.update(wizard, current_user.id,
+                                             instance_name_suffix=form.instance_name_suffix.data,
+                                             suffix_parameter_name=form.suffix_parameter_name.data)
+                    return redirect(url_for('submit_job', wizard=wizard, logged_in=current_user.is_authenticated))
                 return render_template('job-suffix.html', form=form, logged_in=current_user.is_authenticated)
             except Exception as e:
                 self.logger.log_msg("error", f"Error in job_suffix route: {e}")
@@ -280,15 +391,26 @@ class IngestHubRoutes:
         @login_required
         def submit_job():
             try:
-                runtime_parameters = ast.literal_eval(request.args.get('runtime_parameters'))
-                sch_job_template_id = request.args.get('job_template_id')
-                instance_name_suffix = request.args.get('instance_name_suffix')
-                suffix_parameter_name = request.args.get('suffix_parameter_name')
-                from streamsets_manager import StreamSetsManager
-                streamsets_manager = StreamSetsManager(self.db_manager)
+                wizard = request.args.get('wizard')
+                state = self._wizard_state(wizard)
+                if state is None:
+                    return redirect(url_for('load_templates'))
+                # one submission per wizard, reloading this page doesn't start the jobs again; the wizard is only
+                # deleted once its jobs started, so a failed start can be retried
+                if self.wizard_store.mark_submitted(wizard, current_user.id) is None:
+                    flash("This job submission is already being processed", "warning")
+                    return redirect(url_for('recent_jobs', logged_in=current_user.is_authenticated))
+                runtime_parameters = (state.source_configs or {}) | (state.target_configs or {})
+                sch_job_template_id = state.sch_job_template_id
+                streamsets_manager = self.streamsets_manager
                 jobs = streamsets_manager.start_job_template(sch_job_template_id, runtime_parameters,
-                                                             instance_name_suffix,
-                                                             suffix_parameter_name)
+                                                             state.instance_name_suffix,
+                                                             state.suffix_parameter_name)
+                if not jobs:
+                    self.wizard_store.update(wizard, current_user.id, submitted=False)
+                    flash("The job could not be started, see logs for error details", "error")
+                    return redirect(url_for('job_suffix', wizard=wizard, logged_in=current_user.is_authenticated))
+                self.wizard_store.delete(wizard)
                 job_template = streamsets_manager.get_job_template(sch_job_template_id)
                 user = current_user.name
                 with self.db_manager.app.app_context():
@@ -304,31 +426,62 @@ class IngestHubRoutes:
                 flash(f"Error while submitting the job, see logs for error details", "error")
                 return redirect(url_for('load_templates'))
 
+        @self.app.route('/jobs/bulk-submit', methods=['POST'])
+        @login_required
+        def bulk_submit_jobs():
+            try:
+                upload = request.files.get('file')
+                if upload is None:
+                    return jsonify(error="Missing 'file' with the runtime parameter sets"), 400
+                file_format = request.form.get('format') or self.bulk_submitter.file_format(upload.filename)
+                parameter_sets = self.bulk_submitter.parse(upload.read(), file_format)
+                result = self.bulk_submitter.submit(current_user.name, request.form.get('job_template_id'),
+                                                    parameter_sets,
+                                                    request.form.get('instance_name_suffix', 'Counter'),
+                                                    request.form.get('suffix_parameter_name'))
+                return jsonify(result), 400 if result['errors'] else 200
+            except ValueError as e:
+                return jsonify(error=str(e)), 400
+            except Exception as e:
+                self.logger.log_msg("error", f"Error in bulk_submit_jobs route: {e}")
+                return jsonify(error=str(e)), 500
+
         @self.app.route('/jobs', methods=['GET', 'POST'])
         @login_required
         def recent_jobs():
             try:
-                jobs_per_page = JOBS_PER_PAGE
-                page = request.args.get('page', 1, type=int)
-
-                total_rows = self.db_manager.row_count(table=JobInstance)
-                total_pages = math.ceil(total_rows / jobs_per_page)
-                jobs = (
-                    self.db_manager.db.session.query(JobInstance)
-                    .order_by(desc(JobInstance.start_time))
-                    .offset((page - 1) * jobs_per_page)
-                    .limit(jobs_per_page)
-                    .all()
-                )
+                jobs_per_page = min(max(request.args.get('per_page', JOBS_PER_PAGE, type=int), 1), MAX_JOBS_PER_PAGE)
+                after = self._parse_job_cursor(request.args.get('after'))
+                before = self._parse_job_cursor(request.args.get('before'))
+                # the page number only labels the page a cursor leads to; without a (valid) cursor it's the first page
+                page = max(request.args.get('page', 1, type=int), 1) if after or before else 1
+
+                # Seek from the (start_time, job_instance_id) of the adjacent page's edge row instead of OFFSET
+                jobs, has_more = self.db_manager.keyset_page(
+                    JobInstance, [JobInstance.start_time, JobInstance.job_instance_id], jobs_per_page,
+                    after=after, before=before)
+                if before is not None:
+                    has_prev, has_next = has_more, True
+                else:
+                    has_prev, has_next = after is not None, has_more
+                if not jobs:
+                    has_prev = has_next = False
+
+                # the total is only displayed, so an approximate count is good enough
+                total_rows = self.db_manager.approximate_row_count(JobInstance)
+                total_pages = max(math.ceil(total_rows / jobs_per_page), page if not has_next else page + 1)
 
                 # Create a pagination object
                 pagination = {
                     'page': page,
+                    'per_page': jobs_per_page,
                     'total_pages': total_pages,
-                    'has_prev': page > 1,
-                    'has_next': page < total_pages,
-                    'prev_num': page - 1 if page > 1 else None,
-                    'next_num': page + 1 if page < total_pages else None,
+                    'has_prev': has_prev,
+                    'has_next': has_next,
+                    'prev_num': page - 1 if has_prev else None,
+                    'next_num': page + 1 if has_next else None,
+                    'prev_cursor': self._job_cursor(jobs[0]) if has_prev else None,
+                    'next_cursor': self._job_cursor(jobs[-1]) if has_next else None,
                 }
                 return render_template('jobs.html', jobs=jobs, pagination=pagination, total_pages=total_pages,
                                        logged_in=current_user.is_authenticated)
@@ -337,6 +490,57 @@ class IngestHubRoutes:
                 flash(f"Error in recent_jobs route: {e}")
                 return redirect(url_for('about'))
 
+        @self.app.route('/jobs/progress_feed', methods=['GET'])
+        @login_required
+        def job_progress_feed():
+            # viewers share the snapshots captured by the job monitors, watching adds no ControlHub calls
+            progress_hub = self.streamsets_manager.progress_hub
+            subscription = progress_hub.subscribe()
+            events = progress_hub.stream(subscription) if subscription else progress_hub.retry_later()
+            return Response(events, mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+        @self.app.route('/stats', methods=['GET'])
+        @login_required
+        def job_stats():
+            try:
+                dimension = request.args.get('dimension', 'job_template')
+                days = max(request.args.get('days', STATS_DEFAULT_DAYS, type=int), 1)
+                rows, since, until, period = self.job_stats.summary(dimension,
+                                                                    since=datetime.now() - timedelta(days=days))
+                self._label_stats(dimension, rows)
+                return render_template('stats.html', rows=rows, dimension=dimension, dimensions=list(STATS_DIMENSIONS),
+                                       days=days, period=period, logged_in=current_user.is_authenticated)
+            except ValueError as e:
+                flash(str(e), "warning")
+                return redirect(url_for('job_stats'))
+            except Exception as e:
+                self.logger.log_msg("error", f"Error in job_stats route: {e}")
+                flash(f"Error in job_stats route: {e}", "error")
+                return redirect(url_for('about'))
+
+        @self.app.route('/api/stats', methods=['GET'])
+        @login_required
+        def job_stats_api():
+            try:
+                dimension = request.args.get('dimension', 'job_template')
+                value = request.args.get('value')
+                since, until = (datetime.fromisoformat(request.args[name]) if request.args.get(name) else None
+                                for name in ('since', 'until'))
+                rows, since, until, period = self.job_stats.summary(dimension, since, until,
+                                                                    request.args.get('period'), value)
+                self._label_stats(dimension, rows)
+                response = {'dimension': dimension, 'period': period, 'since': since.isoformat(),
+                            'until': until.isoformat(), 'rows': rows}
+                if value is not None:
+                    response['series'] = self.job_stats.series(dimension, value, since, until, period)[0]
+                return jsonify(response)
+            except ValueError as e:
+                return jsonify(error=str(e)), 400
+            except Exception as e:
+                self.logger.log_msg("error", f"Error in job_stats_api route: {e}")
+                return jsonify(error=str(e)), 500
+
         @self.app.route('/stream_logs', methods=['GET'])
         @login_required
         def stream_logs_page():
@@ -345,31 +549,51 @@ class IngestHubRoutes:
         @self.app.route('/stream_logs_feed', methods=['GET'])
         @login_required
         def stream_logs_feed():
-            # Regular expression to match ANSI escape sequences
-            ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
-
-            def generate():
-                with open('ingest_hub.log', 'r') as log_file:
-                    # Get the last N lines for initial output
-                    log_file.seek(0, os.SEEK_END)
-                    file_size = log_file.tell()
-                    log_file.seek(max(file_size - 10 * 1024, 0), os.SEEK_SET)  # Adjust buffer size as needed
-
-                    last_lines = deque(log_file, maxlen=50)  # Load the last 50 lines
-                    for line in last_lines:
-                        clean_line = ansi_escape.sub('', line)
-                        yield f"data: {clean_line}\n\n"
-
-                    # Continue streaming new lines
-                    while True:
-                        log_line = log_file.readline()
-                        log_line = ansi_escape.sub('', log_line)
-                        if log_line:
-                            yield f"data: {log_line}\n\n"
-                        else:
-                            time.sleep(1)
-
-            return Response(generate(), mimetype='text/event-stream')
+            # every viewer shares one tailer; reconnecting viewers resume after the last line they received
+            subscription = self.log_tailer.subscribe(request.headers.get('Last-Event-ID'))
+            events = self.log_tailer.stream(subscription) if subscription else self.log_tailer.retry_later()
+            return Response(events, mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+        @self.app.route('/logs/search', methods=['GET'])
+        @login_required
+        def search_logs():
+            # only bad since/until are the client's fault, any other error of the search is ours
+            try:
+                since, until = (datetime.fromisoformat(request.args[name]) if request.args.get(name) else None
+                                for name in ('since', 'until'))
+            except ValueError as e:
+                return jsonify(error=f"Invalid timestamp: {e}"), 400
+            try:
+                limit = min(request.args.get('limit', LOG_SEARCH_MAX_LINES, type=int), LOG_SEARCH_MAX_LINES)
+                lines = self.log_index.search(request.args.get('job'), since, until, limit)
+                return jsonify(lines=lines, count=len(lines))
+            except Exception as e:
+                self.logger.log_msg("error", f"Error in search_logs route: {e}")
+                return jsonify(error=str(e)), 500
+
+        @self.app.route('/admin/template-cache', methods=['GET', 'POST'])
+        def template_cache():
+            # registration is open, so a login isn't enough to flush caches shared by every user
+            if not self._is_admin(request.headers.get(ADMIN_TOKEN_HEADER)):
+                return jsonify(error="Admin token required"), 403
+            try:
+                if request.method == 'POST':
+                    job_template_id = request.values.get('job_template_id')
+                    # drops the template's forms too
+                    self.streamsets_manager.invalidate_job_template(job_template_id)
+                return jsonify(templates=self.streamsets_manager.template_cache.stats(),
+                               forms=self.form_generator.form_cache.stats())
+            except Exception as e:
+                self.logger.log_msg("error", f"Error in template_cache route: {e}")
+                return jsonify(error=str(e)), 500
+
+        @self.app.route('/metrics', methods=['GET'])
+        def prometheus_metrics():
+            # no login for Prometheus, only clients within METRICS_ALLOWED_NETWORKS
+            if not telemetry.allows(request.remote_addr):
+                return Response(status=403)
+            return Response(telemetry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
         @self.app.route('/logout')
         def logout():
@@ -381,58 +605,108 @@ class IngestHubRoutes:
                 flash(f"Error in logout route: {e}")
                 return redirect(url_for('login'))
 
+    def _label_stats(self, dimension, rows):
+        # job templates are shown by the name of (the first of) their ingestion patterns
+        labels = {}
+        if dimension == 'job_template':
+            for entry in self.job_template_manager.catalog.entries():
+                labels.setdefault(str(entry.job_template_id), entry.pattern_name)
+        for row in rows:
+            row['label'] = labels.get(row['value'], row['value'])
+
+    @staticmethod
+    def _is_admin(token):
+        return bool(ADMIN_TOKEN and token) and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+    def _wizard_state(self, wizard):
+        state = self.wizard_store.get(wizard, current_user.id)
+        if state is None:
+            flash("This job submission has expired, please start again.", "warning")
+        return state
+
+    @staticmethod
+    def _job_cursor(job):
+        return f"{job.start_time.isoformat()},{job.job_instance_id}"
+
+    @staticmethod
+    def _parse_job_cursor(cursor):
+        # None for a missing or malformed cursor (e.g. an edited URL), which shows the first page
+        if not cursor:
+            return None
+        try:
+            start_time, job_instance_id = cursor.rsplit(',', 1)
+            return datetime.fromisoformat(start_time), int(job_instance_id)
+        except ValueError:
+            return None
+
 
 # Job template manager to access job template information
 class JobTemplateManager:
-    def __init__(self):
+    def __init__(self, db_manager):
         self.logger = Logger(self.__class__.__name__).get_logger()
-        self.db = db_manager.db
+        self.catalog = TemplateCatalog(db_manager)
 
     def get_job_template(self, source, destination):
         try:
-            patterns = self.db.session.query(IngestionPattern).filter(
-                IngestionPattern.source == source,
-                IngestionPattern.destination == destination
-            ).all()
-
-            for pattern in patterns:
-                ingestion_pattern_id = pattern.ingestion_pattern_id
-
-                templates = self.db.session.query(IngestionPatternJobTemplateRelationship).filter(
-                    IngestionPatternJobTemplateRelationship.ingestion_pattern_id == ingestion_pattern_id
-                ).all()
-
-                for template in templates:
-                    job_template_id = template.job_template_id
-
-                    job_templates = self.db.session.query(JobTemplate).filter(
-                        JobTemplate.job_template_id == job_template_id
-                    ).all()
-
-                    for job_template in job_templates:
-                        return job_template  # Return the first job template found
-
-            # If no job templates were found, log that information
-            self.logger.warning(f"No job templates found for source '{source}' and destination '{destination}'.")
-            return None  # Return None if no job template is found
+            job_template = self.catalog.get(source, destination)
+            if job_template is None:
+                self.logger.warning(f"No job templates found for source '{source}' and destination '{destination}'.")
+            return job_template
 
         except Exception as e:
             self.logger.error(
                 f"Error retrieving job template for source '{source}' and destination '{destination}': {e}")
             return None
 
+    def get_sources(self):
+        return self.catalog.sources()
+
+    def get_destinations(self, source=None):
+        return self.catalog.destinations(source)
+
+
+def create_app():
+    # Builds the app and wires its components without touching the database or ControlHub; the database is
+    # bootstrapped by the server start up, `python cli.py db init` or the first request
+    ingest_hub = IngestHubConfig()
+    app = ingest_hub.app
+    db_manager = ingest_hub.db_manager
+
+    IngestHubAuthenticator(app, db_manager)
+    streamsets_manager = StreamSetsManager(db_manager)
+    form_generator = FormGenerator(streamsets_manager)
+    job_template_manager = JobTemplateManager(db_manager)
+    log_tailer = LogTailer()
+    log_index = LogIndex()
+    bulk_submitter = BulkSubmitter(db_manager, streamsets_manager)
+    wizard_store = WizardStore(db_manager)
+    job_stats = streamsets_manager.metrics_writer.job_stats
+    IngestHubRoutes(app, db_manager, streamsets_manager, form_generator, job_template_manager, log_tailer, log_index,
+                    bulk_submitter, wizard_store, job_stats)
+    app.before_request(ingest_hub.before_first_request)
+    app.extensions['ingest_hub'] = IngestHubComponents(ingest_hub, db_manager, streamsets_manager, form_generator,
+                                                       job_template_manager, log_tailer, log_index, bulk_submitter,
+                                                       wizard_store, job_stats)
+    return app
+
+
+def start_background_services(app):
+    telemetry.start()
+    if MONITOR_IN_PROCESS:
+        # resume monitoring of jobs left behind by stopped monitors
+        app.extensions['ingest_hub'].streamsets_manager.monitor.start()
+
+
+def stop_background_services(app):
+    # hand in-flight jobs over to the other monitors and write everything still queued
+    components = app.extensions['ingest_hub']
+    components.streamsets_manager.monitor.stop()
+    components.streamsets_manager.metrics_writer.stop()
+    components.log_tailer.stop()
+    telemetry.stop()
+    if Logger.writer:
+        Logger.writer.stop()
 
-# Define db_manager and create an instance of IngestHubConfig
-db_manager = DatabaseManager()
-ingest_hub = IngestHubConfig()
-ingest_hub.initialize_db()
-app = ingest_hub.app  # Make `app` available at the module level
-
-# Initialize other components
-authenticator = IngestHubAuthenticator(app)
-form_generator = FormGenerator()
-job_template_manager = JobTemplateManager()
-app_routes = IngestHubRoutes(app, db_manager, form_generator, job_template_manager)
 
 if __name__ == "__main__":
-    ingest_hub.run()
+    create_app().extensions['ingest_hub'].config.run()
@@ -1,11 +1,175 @@
+import atexit
 import logging
+import logging.handlers
 import os
+from collections import deque
+from threading import Thread, Event
+from time import monotonic
 
 from colorama import Fore, Style
 
 LOG_FILE = 'ingest_hub.log'
+# the log file is rotated to ingest_hub.log.1 .. ingest_hub.log.<LOG_BACKUP_COUNT> once it reaches this size, 0 disables rotation
+LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES', 100 * 1024 * 1024))
+# number of rotated log files kept
+LOG_BACKUP_COUNT = int(os.environ.get('LOG_BACKUP_COUNT', 5))
+# max number of log records waiting to be written; records beyond that are dropped (and counted)
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+# fsync the log file at most this often, 0 disables time based syncs
+LOG_FSYNC_INTERVAL_MS = int(os.environ.get('LOG_FSYNC_INTERVAL_MS', 1000))
+# fsync the log file once this many records were written since the last sync, 0 disables count based syncs
+LOG_FSYNC_EVERY_RECORDS = int(os.environ.get('LOG_FSYNC_EVERY_RECORDS', 0))
+# fsync right after writing an ERROR record
+LOG_FSYNC_ON_ERROR = os.environ.get('LOG_FSYNC_ON_ERROR', 'true').lower() == 'true'
+# how long the writer thread sleeps between batches when it isn't woken up by an error
+LOG_WRITER_POLL_SECS = 0.05
+
+
+# Single background thread writing queued log records to the console and log file in batches
+class AsyncLogWriter:
+    def __init__(self, handlers, queue_size=LOG_QUEUE_SIZE, fsync_interval_ms=LOG_FSYNC_INTERVAL_MS,
+                 fsync_every_records=LOG_FSYNC_EVERY_RECORDS, fsync_on_error=LOG_FSYNC_ON_ERROR):
+        self.handlers = handlers
+        self.queue_size = queue_size
+        self.fsync_interval_secs = fsync_interval_ms / 1000
+        self.fsync_every_records = fsync_every_records
+        self.fsync_on_error = fsync_on_error
+        # counters are updated without locking and may be slightly off under heavy contention
+        self.queued = 0
+        self.dropped = 0
+        self.written = 0
+        self.fsyncs = 0
+        self._records = deque()
+        self._wakeup = Event()
+        self._unsynced = 0
+        self._error_unsynced = False
+        self._last_fsync = monotonic()
+        self._running = True
+        self._start()
+        atexit.register(self.stop)
+        # threads don't survive fork(), e.g. when gunicorn forks workers from a preloaded app
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def enqueue(self, record):
+        # deque.append is atomic, producers never wait on the writer or on the disk
+        if len(self._records) >= self.queue_size:
+            self.dropped += 1
+            return
+        self._records.append(record)
+        self.queued += 1
+        if record.levelno >= logging.ERROR:
+            self._wakeup.set()
+
+    def stats(self):
+        return {
+            'queued': self.queued,
+            'dropped': self.dropped,
+            'written': self.written,
+            'fsyncs': self.fsyncs,
+            'depth': len(self._records),
+        }
+
+    def stop(self):
+        if self._running:
+            self._running = False
+            self._wakeup.set()
+            self._thread.join(timeout=5)
+            self._fsync()
+
+    def _start(self):
+        self._thread = Thread(target=self._run, name='log-writer', daemon=True)
+        self._thread.start()
+
+    def _after_fork(self):
+        # records queued before the fork are written by the parent
+        self._records.clear()
+        self._wakeup = Event()
+        if self._running:
+            self._start()
+
+    def _run(self):
+        while self._running:
+            self._wakeup.wait(LOG_WRITER_POLL_SECS)
+            self._wakeup.clear()
+            self._write_batch()
+        self._write_batch()
+
+    def _write_batch(self):
+        written = 0
+        while self._records:
+            record = self._records.popleft()
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+            written += 1
+            self._error_unsynced |= record.levelno >= logging.ERROR
+        if written:
+            for handler in self.handlers:
+                handler.flush()
+            self.written += written
+            self._unsynced += written
+        if self._should_fsync():
+            self._fsync()
+
+    def _should_fsync(self):
+        if not self._unsynced:
+            return False
+        return ((self.fsync_on_error and self._error_unsynced) or
+                (self.fsync_every_records and self._unsynced >= self.fsync_every_records) or
+                (self.fsync_interval_secs and monotonic() - self._last_fsync >= self.fsync_interval_secs))
+
+    def _fsync(self):
+        try:
+            for handler in self.handlers:
+                if isinstance(handler, logging.FileHandler) and handler.stream:
+                    os.fsync(handler.stream.fileno())
+        except (OSError, ValueError):
+            pass
+        self.fsyncs += 1
+        self._unsynced = 0
+        self._error_unsynced = False
+        self._last_fsync = monotonic()
+
+
+# Size-rotated log file that several processes (e.g. gunicorn workers) can share: a process that finds the file
+# already rotated by another one switches to the new file instead of rotating it again
+class SharedRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    def shouldRollover(self, record):
+        if self.stream is None:
+            self.stream = self._open()
+        try:
+            current_inode = os.stat(self.baseFilename).st_ino
+        except FileNotFoundError:
+            current_inode = None
+        stat = os.fstat(self.stream.fileno())
+        if stat.st_ino != current_inode:
+            self.stream.close()
+            self.stream = self._open()
+            stat = os.fstat(self.stream.fileno())
+        # the file size rather than our own position, other processes append to the same file
+        return 0 < self.maxBytes <= stat.st_size
+
+
+# Producer side of the logging pipeline: hands records to the AsyncLogWriter without formatting or I/O
+class LogQueueHandler(logging.Handler):
+    def __init__(self, writer):
+        super().__init__()
+        self.writer = writer
+
+    def handle(self, record):
+        # skip logging.Handler's per-handler lock, enqueueing is already thread-safe
+        if self.filter(record):
+            self.writer.enqueue(record)
+        return True
+
+    def emit(self, record):
+        self.writer.enqueue(record)
+
 
 class Logger:
+    # shared by every Logger in the process
+    writer = None
+
     def __init__(self, log_file: str = LOG_FILE, level=logging.DEBUG):
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel(level)
@@ -16,8 +180,9 @@ class Logger:
                 console_handler = logging.StreamHandler()
                 console_handler.setLevel(level)
 
-                # File handler
-                file_handler = logging.FileHandler(log_file)
+                # File handler, rotated by size (only ever driven by the writer thread)
+                file_handler = SharedRotatingFileHandler(log_file, maxBytes=LOG_MAX_BYTES,
+                                                         backupCount=LOG_BACKUP_COUNT)
                 file_handler.setLevel(level)
 
                 # Logging format
@@ -26,9 +191,9 @@ class Logger:
                 console_handler.setFormatter(formatter)
                 file_handler.setFormatter(formatter)
 
-                # Add both handlers to the logger
-                self.logger.addHandler(console_handler)
-                self.logger.addHandler(file_handler)
+                # Both handlers are driven by the writer thread, the logger only enqueues
+                Logger.writer = AsyncLogWriter([console_handler, file_handler])
+                self.logger.addHandler(LogQueueHandler(Logger.writer))
 
             except (OSError, Exception) as e:
                 self.logger.error(f"Error initializing logging handlers: {e}")
@@ -36,27 +201,22 @@ class Logger:
     def get_logger(self):
         return self.logger
 
+    @classmethod
+    def stats(cls):
+        return cls.writer.stats() if cls.writer else {}
+
     def log_msg(self, level, msg):
         try:
             match level:
                 case 'info':
-                    self.logger.setLevel(logging.INFO)
                     self.logger.info(f"{Fore.GREEN}{msg}{Style.RESET_ALL}")
                 case 'warning':
-                    self.logger.setLevel(logging.WARNING)
                     self.logger.warning(f"{Fore.YELLOW}{msg}{Style.RESET_ALL}")
                 case 'error':
-                    self.logger.setLevel(logging.ERROR)
                     self.logger.error(f"{Fore.RED}{msg}{Style.RESET_ALL}")
                 case _:
                     self.logger.warning("Invalid log level specified; defaulting to warning.")
                     self.logger.warning(msg)
 
-            # Flush and sync for each handler
-            for handler in self.logger.handlers:
-                handler.flush()
-                if isinstance(handler, logging.FileHandler):
-                    os.fsync(handler.stream.fileno())
-
         except Exception as e:
-            self.logger.error(f"Error logging message: {e}")
\ No newline at end of file
+            self.logger.error(f"Error logging message: {e}")
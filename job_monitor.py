@@ -0,0 +1,493 @@
+import heapq
+import os
+import random
+import socket
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from itertools import count
+from threading import Thread, Condition, enumerate as enumerate_threads
+from time import time
+from uuid import uuid4
+
+from sqlalchemy import select, update, delete, or_, bindparam
+
+from cache_manager import TTLCache
+from db_manager import PendingJob, JobInstance, JobTemplate
+from ingesthub_logger import Logger
+from progress_manager import measure_progress
+from telemetry_manager import telemetry
+
+# shortest and longest time between two status checks of the same job
+MONITOR_MIN_POLL_INTERVAL_SECS = float(os.environ.get('MONITOR_MIN_POLL_INTERVAL_SECS', 2))
+MONITOR_MAX_POLL_INTERVAL_SECS = float(os.environ.get('MONITOR_MAX_POLL_INTERVAL_SECS', 300))
+# without a usable duration estimate, the poll interval grows as this fraction of the job's elapsed time
+MONITOR_POLL_BACKOFF_FACTOR = float(os.environ.get('MONITOR_POLL_BACKOFF_FACTOR', 0.2))
+# random +/- fraction applied to every poll interval, so jobs started together do not stay in lockstep
+MONITOR_POLL_JITTER = float(os.environ.get('MONITOR_POLL_JITTER', 0.1))
+# number of recent runs per template used to estimate job durations, and how long an estimate is reused
+DURATION_ESTIMATE_SAMPLE_SIZE = int(os.environ.get('DURATION_ESTIMATE_SAMPLE_SIZE', 50))
+DURATION_ESTIMATE_TTL_SECS = int(os.environ.get('DURATION_ESTIMATE_TTL_SECS', 10 * 60))
+# max wait time for job completion
+MAX_WAIT_TIME_FOR_JOB_SECS = 4 * 60 * 60  # 4 hours
+# max number of jobs whose status is fetched with a single ControlHub request
+MONITOR_BATCH_SIZE = int(os.environ.get('MONITOR_BATCH_SIZE', 100))
+# number of worker threads collecting metrics for finished jobs
+MONITOR_MAX_WORKERS = int(os.environ.get('MONITOR_MAX_WORKERS', 4))
+# how long a monitor owns a pending job without renewing its lease; leases are renewed every third of that
+MONITOR_LEASE_SECS = int(os.environ.get('MONITOR_LEASE_SECS', 60))
+# whether the web app monitors the jobs it starts, or leaves them to separate `python monitor.py` workers
+MONITOR_IN_PROCESS = os.environ.get('MONITOR_IN_PROCESS', 'true').lower() == 'true'
+# whether the record counts of running jobs are captured on their status checks while progress viewers are connected
+# to this process, for their live progress
+MONITOR_PROGRESS = os.environ.get('MONITOR_PROGRESS', 'true').lower() == 'true'
+# while progress viewers are connected to this process, its running jobs are checked at least this often
+MONITOR_PROGRESS_POLL_SECS = float(os.environ.get('MONITOR_PROGRESS_POLL_SECS', 15))
+# captured progress is saved on the pending jobs (for viewers connected to other processes) at most this often
+MONITOR_PROGRESS_FLUSH_SECS = 1
+# attempts at collecting the metrics of a finished job (e.g. through ControlHub errors) before its pending job is
+# dropped without metrics; attempts are retried with exponential backoff from MONITOR_MIN_POLL_INTERVAL_SECS
+MONITOR_COLLECT_MAX_ATTEMPTS = int(os.environ.get('MONITOR_COLLECT_MAX_ATTEMPTS', 5))
+# ControlHub job statuses of jobs that are no longer running
+FINISHED_JOB_STATUSES = ('INACTIVE', 'INACTIVE_ERROR')
+
+MONITOR_POLL_LAG_SECONDS = telemetry.histogram('ingesthub_monitor_poll_lag_seconds',
+                                               'How late job status checks start after their scheduled time')
+
+
+# A job instance waiting for completion, along with what is needed to record its metrics
+class MonitoredJob:
+    def __init__(self, user, sch_job_template_id, job_id, job_name, submitted_at, job=None, job_template=None):
+        self.user = user
+        self.sch_job_template_id = sch_job_template_id
+        self.job_id = job_id
+        self.job_name = job_name
+        self.submitted_at = submitted_at
+        # SDK objects are only available in the process that started the job
+        self.job = job
+        self.job_template = job_template
+        # latest JobProgress, the input rate of the next one is measured from it
+        self.progress = None
+        # failed attempts at collecting the metrics of the finished job
+        self.collect_attempts = 0
+
+
+# Expected run time of a job template, from the durations of its recent runs
+class DurationEstimate:
+    def __init__(self, durations):
+        durations = sorted(durations)
+        self.samples = len(durations)
+        self.median = durations[len(durations) // 2] if durations else None
+
+
+# Per-template duration estimates computed from JobInstance history, cached to keep polling free of DB queries
+class DurationEstimator:
+    def __init__(self, db_manager, sample_size=DURATION_ESTIMATE_SAMPLE_SIZE, ttl=DURATION_ESTIMATE_TTL_SECS):
+        self.db_manager = db_manager
+        self.sample_size = sample_size
+        self.estimates = TTLCache(maxsize=1024, ttl=ttl)
+
+    def estimate(self, sch_job_template_id):
+        return self.estimates.get_or_load(sch_job_template_id, lambda: self._load(sch_job_template_id))
+
+    def _load(self, sch_job_template_id):
+        with self.db_manager.app.app_context():
+            runs = self.db_manager.db.session.execute(
+                select(JobInstance.start_time, JobInstance.finish_time)
+                .join(JobTemplate, JobTemplate.job_template_id == JobInstance.job_template_id)
+                .where(JobTemplate.sch_job_template_id == sch_job_template_id, JobInstance.successful_run.is_(True))
+                .order_by(JobInstance.start_time.desc())
+                .limit(self.sample_size)
+            ).all()
+        return DurationEstimate([(finish_time - start_time).total_seconds() for start_time, finish_time in runs
+                                 if start_time and finish_time])
+
+
+# Persisted in-flight jobs, leased to one monitor at a time so that any number of monitors can share them
+class PendingJobRegistry:
+    def __init__(self, db_manager, lease_secs=MONITOR_LEASE_SECS):
+        self.db_manager = db_manager
+        self.db = db_manager.db
+        self.lease_secs = lease_secs
+
+    def _lease_expiry(self):
+        return datetime.now() + timedelta(seconds=self.lease_secs)
+
+    def register(self, monitored_job, owner=None):
+        with self.db_manager.app.app_context():
+            self.db.session.add(PendingJob(
+                job_id=monitored_job.job_id,
+                job_name=monitored_job.job_name,
+                sch_job_template_id=monitored_job.sch_job_template_id,
+                user_id=monitored_job.user,
+                submit_time=datetime.fromtimestamp(monitored_job.submitted_at),
+                lease_owner=owner,
+                lease_expires_at=self._lease_expiry() if owner else None,
+            ))
+            self.db.session.commit()
+
+    def claim(self, owner, limit, exclude=()):
+        # Take over unowned jobs and jobs whose owner stopped renewing its lease
+        with self.db_manager.app.app_context():
+            claimable = or_(PendingJob.lease_owner.is_(None), PendingJob.lease_expires_at < datetime.now())
+            self.db.session.execute(
+                update(PendingJob)
+                .where(PendingJob.pending_job_id.in_(select(PendingJob.pending_job_id).where(claimable).limit(limit)))
+                .where(claimable)
+                .values(lease_owner=owner, lease_expires_at=self._lease_expiry())
+            )
+            self.db.session.commit()
+            pending_jobs = self.db.session.execute(
+                select(PendingJob).where(PendingJob.lease_owner == owner)).scalars().all()
+            return [MonitoredJob(pending_job.user_id, pending_job.sch_job_template_id, pending_job.job_id,
+                                 pending_job.job_name, pending_job.submit_time.timestamp())
+                    for pending_job in pending_jobs if pending_job.job_id not in exclude]
+
+    def renew(self, owner):
+        # Extend all leases held by the owner and return the IDs of the jobs it still owns
+        with self.db_manager.app.app_context():
+            self.db.session.execute(
+                update(PendingJob).where(PendingJob.lease_owner == owner).values(lease_expires_at=self._lease_expiry()))
+            self.db.session.commit()
+            return set(self.db.session.execute(
+                select(PendingJob.job_id).where(PendingJob.lease_owner == owner)).scalars().all())
+
+    def complete(self, job_id, owner):
+        with self.db_manager.app.app_context():
+            self.db.session.execute(
+                delete(PendingJob).where(PendingJob.job_id == job_id, PendingJob.lease_owner == owner))
+            self.db.session.commit()
+
+    def record_progress(self, owner, progress):
+        # One statement for the latest progress of many jobs, as long as they are still leased to owner
+        table = PendingJob.__table__
+        with self.db_manager.app.app_context():
+            self.db.session.execute(
+                update(table).where(table.c.job_id == bindparam('progress_job_id'), table.c.lease_owner == owner),
+                [{'progress_job_id': snapshot.job_id, 'input_record_count': snapshot.input_record_count,
+                  'output_record_count': snapshot.output_record_count,
+                  'error_record_count': snapshot.error_record_count, 'records_per_sec': snapshot.records_per_sec,
+                  'progress_time': snapshot.progress_time} for snapshot in progress])
+            self.db.session.commit()
+
+    def release(self, owner):
+        with self.db_manager.app.app_context():
+            self.db.session.execute(
+                update(PendingJob).where(PendingJob.lease_owner == owner).values(lease_owner=None,
+                                                                                  lease_expires_at=None))
+            self.db.session.commit()
+
+
+# Single scheduler thread polling all in-flight jobs in batches, ordered by their next check time.
+# Finished jobs are handed to a fixed pool of workers, so the thread count does not grow with the number of jobs.
+# In-flight jobs are persisted in the PendingJobRegistry and leased to monitors, so monitoring survives restarts
+# and can be spread over several processes or nodes.
+class JobMonitor:
+    def __init__(self, streamsets_manager, registry=None, estimator=None, batch_size=MONITOR_BATCH_SIZE,
+                 max_workers=MONITOR_MAX_WORKERS, min_interval=MONITOR_MIN_POLL_INTERVAL_SECS,
+                 max_interval=MONITOR_MAX_POLL_INTERVAL_SECS, in_process=MONITOR_IN_PROCESS,
+                 capture_progress=MONITOR_PROGRESS):
+        self.logger = Logger()
+        self.streamsets_manager = streamsets_manager
+        self.progress_hub = streamsets_manager.progress_hub
+        self.registry = registry or PendingJobRegistry(streamsets_manager.db_manager)
+        self.estimator = estimator or DurationEstimator(streamsets_manager.db_manager)
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.in_process = in_process
+        self.capture_progress = capture_progress
+        self.worker_id = self._new_worker_id()
+        self.lease_renew_interval = self.registry.lease_secs / 3
+        # heap of (next check time, sequence, MonitoredJob)
+        self._queue = []
+        self._sequence = count()
+        # IDs of all jobs owned by this monitor, queued or being polled/collected
+        self._tracked = set()
+        self._next_lease_renewal = 0
+        # latest progress per job, not saved on its pending job yet
+        self._progress_updates = {}
+        self._next_progress_flush = 0
+        self._condition = Condition()
+        self._running = False
+        self._scheduler = None
+        self._workers = None
+        _monitors.add(self)
+
+    @staticmethod
+    def _new_worker_id():
+        return f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+
+    def _after_fork(self):
+        self.worker_id = self._new_worker_id()
+        self._queue = []
+        self._tracked = set()
+        self._next_lease_renewal = 0
+        self._progress_updates = {}
+        self._next_progress_flush = 0
+        self._condition = Condition()
+        self._running = False
+        self._scheduler = None
+        self._workers = None
+
+    def watch(self, user, job_template, job):
+        monitored = MonitoredJob(user, job_template.job_id, job.job_id, job.job_name, time(), job, job_template)
+        owner = self.worker_id if self.in_process else None
+        self.registry.register(monitored, owner=owner)
+        if owner:
+            next_check = self._next_check_time(monitored, time())
+            with self._condition:
+                self._ensure_started()
+                self._track(monitored, next_check)
+
+    def in_flight(self):
+        with self._condition:
+            return len(self._tracked)
+
+    def overdue(self):
+        # How late the most overdue status check is, 0 when the monitor keeps up
+        with self._condition:
+            return max(time() - self._queue[0][0], 0) if self._queue else 0
+
+    @staticmethod
+    def thread_count():
+        # the scheduler and the worker threads of every monitor in this process
+        return sum(1 for thread in enumerate_threads() if thread.name.startswith('job-monitor'))
+
+    def start(self):
+        with self._condition:
+            self._ensure_started()
+
+    def run_forever(self):
+        self.start()
+        scheduler = self._scheduler
+        self.logger.log_msg('info', f"Job monitor [{self.worker_id}] started")
+        try:
+            while scheduler.is_alive():
+                scheduler.join(timeout=1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self, wait=True):
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._scheduler is not None:
+            self._scheduler.join()
+            self._workers.shutdown(wait=wait)
+            self._scheduler = None
+            # write the queued metrics while their pending jobs are still leased to this monitor
+            self.streamsets_manager.metrics_writer.flush()
+            # hand the jobs that are still running over to the other monitors
+            self.registry.release(self.worker_id)
+            self.logger.log_msg('info', f"Job monitor [{self.worker_id}] stopped")
+
+    def _ensure_started(self):
+        if self._scheduler is None:
+            self._running = True
+            self._workers = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='job-monitor-worker')
+            self._scheduler = Thread(target=self._run, name='job-monitor', daemon=True)
+            self._scheduler.start()
+
+    def _track(self, monitored_job, next_check):
+        # caller must hold self._condition
+        self._tracked.add(monitored_job.job_id)
+        self._schedule(monitored_job, next_check)
+
+    def _schedule(self, monitored_job, next_check):
+        # caller must hold self._condition
+        heapq.heappush(self._queue, (next_check, next(self._sequence), monitored_job))
+        self._condition.notify()
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            if time() >= self._next_lease_renewal:
+                self._maintain_leases()
+            if batch:
+                self._poll(batch)
+            if self._progress_updates and time() >= self._next_progress_flush:
+                self._flush_progress()
+
+    def _next_batch(self):
+        # Block until at least one job is due, leases need renewing or progress saving, then take up to batch_size
+        # due jobs
+        with self._condition:
+            while self._running:
+                now = time()
+                if self._queue and self._queue[0][0] <= now:
+                    MONITOR_POLL_LAG_SECONDS.observe(now - self._queue[0][0])
+                    batch = []
+                    while self._queue and self._queue[0][0] <= now and len(batch) < self.batch_size:
+                        batch.append(heapq.heappop(self._queue)[2])
+                    return batch
+                if now >= self._next_lease_renewal:
+                    return []
+                wake_at = min(self._queue[0][0], self._next_lease_renewal) if self._queue else self._next_lease_renewal
+                if self._progress_updates:
+                    if now >= self._next_progress_flush:
+                        return []
+                    wake_at = min(wake_at, self._next_progress_flush)
+                self._condition.wait(wake_at - now)
+            return None
+
+    def _maintain_leases(self):
+        self._next_lease_renewal = time() + self.lease_renew_interval
+        try:
+            owned = self.registry.renew(self.worker_id)
+            with self._condition:
+                lost = self._tracked - owned
+                if lost:
+                    # another monitor took these jobs over after our lease expired
+                    self.logger.log_msg('warning', f"Lost the lease on {len(lost)} job(s) to another monitor")
+                    self._queue = [entry for entry in self._queue if entry[2].job_id not in lost]
+                    heapq.heapify(self._queue)
+                    self._tracked -= lost
+                tracked = set(self._tracked)
+            claimed = self.registry.claim(self.worker_id, self.batch_size, exclude=tracked)
+            now = time()
+            next_checks = [self._next_check_time(monitored, now) for monitored in claimed]
+            with self._condition:
+                for monitored, next_check in zip(claimed, next_checks):
+                    self.logger.log_msg('info', f"Resuming monitoring of job: [{monitored.job_name}]")
+                    self._track(monitored, next_check)
+        except Exception as e:
+            self.logger.log_msg('error', f"Error while renewing job monitor leases: {e}")
+
+    def _poll(self, batch):
+        try:
+            statuses = self.streamsets_manager.get_jobs_status([monitored.job_id for monitored in batch])
+        except Exception as e:
+            self.logger.log_msg('error', f"Error while checking the status of {len(batch)} job(s): {e}")
+            statuses = {}
+
+        now = time()
+        still_running = []
+        # each capture is a ControlHub call, only worth it while someone watches the progress feed
+        capture_progress = self.capture_progress and self.progress_hub.subscriber_count()
+        for monitored in batch:
+            if statuses.get(monitored.job_id) in FINISHED_JOB_STATUSES:
+                self.logger.log_msg('info', f"Job: [{monitored.job_name}] finished running. Collecting metrics...")
+                self._workers.submit(self._collect_metrics, monitored)
+            elif now - monitored.submitted_at >= MAX_WAIT_TIME_FOR_JOB_SECS:
+                self.logger.log_msg('warning',
+                                    f"Gave up waiting for job: [{monitored.job_name}]. Collecting metrics...")
+                self._workers.submit(self._collect_metrics, monitored)
+            else:
+                self.logger.log_msg('info', f"Waiting for job: [{monitored.job_name}] to finish")
+                still_running.append((monitored, self._next_check_time(monitored, now)))
+                if capture_progress:
+                    self._workers.submit(self._capture_progress, monitored)
+
+        with self._condition:
+            for monitored, next_check in still_running:
+                self._schedule(monitored, next_check)
+
+    def _next_check_time(self, monitored, now):
+        # Poll often around the template's usual finish time and back off while a job runs long
+        elapsed = now - monitored.submitted_at
+        try:
+            expected = self.estimator.estimate(monitored.sch_job_template_id).median
+        except Exception as e:
+            self.logger.log_msg('warning', f"Could not estimate the duration of job: [{monitored.job_name}]: {e}")
+            expected = None
+        if expected is not None and elapsed < expected:
+            interval = (expected - elapsed) / 2
+        else:
+            interval = elapsed * MONITOR_POLL_BACKOFF_FACTOR
+        # jittered before the clamp, so the interval never leaves min_interval..max_interval
+        interval *= random.uniform(1 - MONITOR_POLL_JITTER, 1 + MONITOR_POLL_JITTER)
+        interval = min(max(interval, self.min_interval), self.max_interval)
+        if self.capture_progress and self.progress_hub.subscriber_count():
+            interval = min(interval, MONITOR_PROGRESS_POLL_SECS)
+        return now + interval
+
+    def _capture_progress(self, monitored):
+        try:
+            if monitored.job is None:
+                monitored.job = self.streamsets_manager.get_job(monitored.job_id)
+            counts = self.streamsets_manager.get_job_progress(monitored.job)
+        except Exception as e:
+            self.logger.log_msg('warning', f"Could not capture the progress of job: [{monitored.job_name}]: {e}")
+            return
+        progress = measure_progress(monitored.job_id, monitored.job_name, monitored.user,
+                                    datetime.fromtimestamp(monitored.submitted_at), counts, monitored.progress)
+        with self._condition:
+            # the job may have finished in the meantime
+            if monitored.job_id not in self._tracked:
+                return
+            monitored.progress = progress
+            self.progress_hub.publish(progress)
+            if not self._progress_updates:
+                self._condition.notify()
+            self._progress_updates[monitored.job_id] = progress
+
+    def _flush_progress(self):
+        self._next_progress_flush = time() + MONITOR_PROGRESS_FLUSH_SECS
+        with self._condition:
+            progress, self._progress_updates = list(self._progress_updates.values()), {}
+        try:
+            self.registry.record_progress(self.worker_id, progress)
+        except Exception as e:
+            self.logger.log_msg('warning', f"Could not save the progress of {len(progress)} job(s): {e}")
+
+    def _collect_metrics(self, monitored):
+        queued = False
+        try:
+            with self.streamsets_manager.db_manager.app.app_context():
+                job = monitored.job or self.streamsets_manager.get_job(monitored.job_id)
+                job_template = (monitored.job_template or
+                                self.streamsets_manager.get_job_template(monitored.sch_job_template_id))
+                # the metrics writer deletes the pending job along with writing its metrics; the job stays tracked
+                # until then, so it isn't claimed (and collected) again in the meantime
+                queued = self.streamsets_manager.write_metrics_for_job(
+                    monitored.user, job_template, job, owner=self.worker_id,
+                    on_written=lambda written: self._untrack(monitored.job_id))
+        except Exception as e:
+            self.logger.log_msg('error', f"Failed to collect metrics for job: [{monitored.job_name}]: {e}")
+        if not queued:
+            self._retry_collect(monitored)
+
+    def _retry_collect(self, monitored):
+        # Keep the pending job and check the job again later; only drop it once every attempt failed
+        monitored.collect_attempts += 1
+        if monitored.collect_attempts >= MONITOR_COLLECT_MAX_ATTEMPTS:
+            self.logger.log_msg('error', f"Gave up collecting metrics for job: [{monitored.job_name}] after "
+                                         f"{monitored.collect_attempts} attempts")
+            try:
+                self.registry.complete(monitored.job_id, self.worker_id)
+            except Exception as e:
+                self.logger.log_msg('error', f"Could not drop the pending job: [{monitored.job_name}]: {e}")
+            self._untrack(monitored.job_id)
+            return
+        retry_in = min(self.min_interval * 2 ** monitored.collect_attempts, self.max_interval)
+        self.logger.log_msg('warning', f"Collecting metrics for job: [{monitored.job_name}] again in "
+                                       f"{retry_in:.0f}s (attempt {monitored.collect_attempts + 1} of "
+                                       f"{MONITOR_COLLECT_MAX_ATTEMPTS})")
+        with self._condition:
+            if monitored.job_id in self._tracked:
+                self._schedule(monitored, time() + retry_in)
+
+    def _untrack(self, job_id):
+        with self._condition:
+            self._tracked.discard(job_id)
+            self._progress_updates.pop(job_id, None)
+            self.progress_hub.finish(job_id)
+
+
+# Job monitors of this process. Held weakly, so a discarded monitor (e.g. of an earlier create_app()) is collected.
+_monitors = weakref.WeakSet()
+
+
+def _after_fork_in_child():
+    # a forked process (e.g. a gunicorn worker of a preloaded app) is a new monitor with nothing leased yet
+    for monitor in list(_monitors):
+        monitor._after_fork()
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,441 @@
+import ctypes
+import ctypes.util
+import json
+import mmap
+import os
+import queue
+import re
+import select
+from collections import deque
+from datetime import datetime
+from threading import Thread, Lock, RLock, Event
+from time import monotonic
+
+from ingesthub_logger import Logger, LOG_FILE, LOG_BACKUP_COUNT
+
+# number of recent log lines kept in memory for new and reconnecting viewers
+LOG_TAIL_BUFFER_LINES = int(os.environ.get('LOG_TAIL_BUFFER_LINES', 1000))
+# number of lines sent to a new viewer
+LOG_TAIL_INITIAL_LINES = 50
+# lines a viewer may fall behind before it is disconnected (it resumes from the buffer when it reconnects)
+LOG_SUBSCRIBER_QUEUE_SIZE = int(os.environ.get('LOG_SUBSCRIBER_QUEUE_SIZE', 500))
+# max time between two checks of the log file, also the only check interval when inotify isn't available
+LOG_TAIL_POLL_SECS = 1
+# idle viewers get an SSE comment this often, so closed connections are noticed
+LOG_SSE_KEEPALIVE_SECS = 15
+# a log feed connection is ended after this long and the browser reconnects (resuming where it left off), so
+# forgotten log pages don't hold a server thread forever
+LOG_SSE_MAX_SECS = int(os.environ.get('LOG_SSE_MAX_SECS', 5 * 60))
+# max concurrent log feed connections per process, keep it below the number of server threads so pages stay responsive
+LOG_SSE_MAX_CONNECTIONS = int(os.environ.get('LOG_SSE_MAX_CONNECTIONS', 8))
+# how long a browser turned away by LOG_SSE_MAX_CONNECTIONS waits before it tries again
+LOG_SSE_RETRY_MS = 10000
+
+# inotify events of the log directory that may mean new log lines or a new log file
+IN_MODIFY, IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE = 0x2, 0x40, 0x80, 0x100, 0x200
+
+# Regular expression to match ANSI escape sequences
+ANSI_ESCAPE = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
+
+# on-disk search index over the log file and its rotated files
+LOG_INDEX_FILE = f"{LOG_FILE}.index"
+# bytes of log covered by one index entry; a search reads whole entries, so this bounds the read per match
+LOG_INDEX_BLOCK_BYTES = int(os.environ.get('LOG_INDEX_BLOCK_BYTES', 64 * 1024))
+# max number of lines returned by one log search
+LOG_SEARCH_MAX_LINES = 5000
+# bytes at the start of a log file used to tell a new file from an indexed one that reused its inode
+LOG_INDEX_HEAD_BYTES = 64
+
+# "[job_name]" style tokens written by the job monitor and StreamSetsManager
+LOG_TOKEN = re.compile(rb'\[([^\[\]\x1b\r\n]{1,200})\]')
+# timestamp at the start of a log line, lines without one continue the previous record
+LOG_TIMESTAMP = re.compile(rb'\d{4}-\d\d-\d\d \d\d:\d\d:\d\d')
+LOG_TIMESTAMPS = re.compile(rb'^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)', re.MULTILINE)
+
+
+# A viewer of the log feed with its own bounded queue of (event ID, line)
+class LogSubscription:
+    def __init__(self, backlog, queue_size=LOG_SUBSCRIBER_QUEUE_SIZE):
+        self.backlog = backlog
+        self.lines = queue.Queue(maxsize=queue_size)
+        self.closed = False
+
+
+# Single reader of the log file, fanning each new (ANSI-stripped) line out to every subscribed viewer.
+# Event IDs are "<inode>-<byte offset>", so they stay valid across reconnects, restarts and app workers.
+class LogTailer:
+    def __init__(self, log_file=LOG_FILE, buffer_lines=LOG_TAIL_BUFFER_LINES, max_subscribers=LOG_SSE_MAX_CONNECTIONS,
+                 max_stream_secs=LOG_SSE_MAX_SECS):
+        self.logger = Logger()
+        self.log_file = os.path.abspath(log_file)
+        self.buffer = deque(maxlen=buffer_lines)
+        self.max_subscribers = max_subscribers
+        self.max_stream_secs = max_stream_secs
+        self.subscriptions = set()
+        self.dropped_subscribers = 0
+        self._lock = RLock()
+        self._thread = None
+        self._stopped = Event()
+        self._file = None
+        self._inode = None
+        self._partial = b''
+
+    def subscribe(self, last_event_id=None):
+        # None once LOG_SSE_MAX_CONNECTIONS viewers are connected
+        with self._lock:
+            if len(self.subscriptions) >= self.max_subscribers:
+                return None
+            self._ensure_started()
+            backlog = self._backlog(last_event_id)
+            subscription = LogSubscription(backlog)
+            self.subscriptions.add(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self.subscriptions.discard(subscription)
+
+    def subscriber_count(self):
+        return len(self.subscriptions)
+
+    def stream(self, subscription):
+        # Server-sent events for one viewer, ends when the viewer falls too far behind or after max_stream_secs
+        ends_at = monotonic() + self.max_stream_secs
+        try:
+            for event_id, line in subscription.backlog:
+                yield f"id: {event_id}\ndata: {line}\n\n"
+            while not subscription.closed:
+                remaining = ends_at - monotonic()
+                if remaining <= 0:
+                    return
+                try:
+                    event_id, line = subscription.lines.get(timeout=min(LOG_SSE_KEEPALIVE_SECS, remaining))
+                    yield f"id: {event_id}\ndata: {line}\n\n"
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+        finally:
+            self.unsubscribe(subscription)
+
+    @staticmethod
+    def retry_later():
+        # tells the browser's EventSource to reconnect after LOG_SSE_RETRY_MS
+        yield f"retry: {LOG_SSE_RETRY_MS}\n\n"
+
+    def _backlog(self, last_event_id):
+        # caller must hold self._lock
+        if last_event_id:
+            inode, _, offset = last_event_id.partition('-')
+            if inode == str(self._inode) and offset.isdigit():
+                return [(event_id, line) for event_id, line in self.buffer if self._offset(event_id) > int(offset)]
+            return list(self.buffer)
+        return list(self.buffer)[-LOG_TAIL_INITIAL_LINES:]
+
+    @staticmethod
+    def _offset(event_id):
+        return int(event_id.rpartition('-')[2])
+
+    def stop(self):
+        # ends the viewers' feeds (their browsers reconnect to another worker) and closes the log file
+        with self._lock:
+            thread, self._thread = self._thread, None
+            stopped, self._stopped = self._stopped, Event()
+            for subscription in self.subscriptions:
+                subscription.closed = True
+            self.subscriptions.clear()
+        stopped.set()
+        if thread is not None:
+            thread.join(timeout=5)
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+    def _ensure_started(self):
+        # caller must hold self._lock
+        if self._thread is None:
+            self._open(start_at_end=True)
+            self._thread = Thread(target=self._run, args=(self._stopped,), name='log-tailer', daemon=True)
+            self._thread.start()
+
+    def _open(self, start_at_end=False):
+        if self._file:
+            self._file.close()
+            self._file = None
+        try:
+            self._file = open(self.log_file, 'rb')
+        except FileNotFoundError:
+            return
+        self._inode = os.fstat(self._file.fileno()).st_ino
+        self._partial = b''
+        if start_at_end:
+            # prime the buffer with the tail of the file, like the original feed did
+            size = os.fstat(self._file.fileno()).st_size
+            self._file.seek(max(size - 10 * 1024, 0))
+            if self._file.tell():
+                self._file.readline()
+            self._read_lines()
+
+    def _run(self, stopped):
+        inotify_fd = self._watch_directory()
+        try:
+            while not stopped.is_set():
+                if inotify_fd is not None:
+                    ready, _, _ = select.select([inotify_fd], [], [], LOG_TAIL_POLL_SECS)
+                    if ready:
+                        # the events only tell us to look at the file, their content doesn't matter
+                        os.read(inotify_fd, 64 * 1024)
+                else:
+                    stopped.wait(LOG_TAIL_POLL_SECS)
+                if stopped.is_set():
+                    return
+                try:
+                    self._check_file()
+                except Exception as e:
+                    self.logger.log_msg('error', f"Error while tailing {self.log_file}: {e}")
+        finally:
+            if inotify_fd is not None:
+                os.close(inotify_fd)
+
+    def _watch_directory(self):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK)
+            if fd < 0:
+                return None
+            mask = IN_MODIFY | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+            if libc.inotify_add_watch(fd, os.path.dirname(self.log_file).encode(), mask) < 0:
+                os.close(fd)
+                return None
+            return fd
+        except (OSError, AttributeError, TypeError):
+            # not Linux, fall back to polling
+            return None
+
+    def _check_file(self):
+        try:
+            stat = os.stat(self.log_file)
+        except FileNotFoundError:
+            return
+        if self._file is None or stat.st_ino != self._inode:
+            # the log file was rotated or recreated; finish the old file before switching
+            if self._file is not None:
+                self._read_lines()
+            self._open()
+        elif stat.st_size < self._file.tell():
+            # truncated in place
+            self._file.seek(0)
+            self._partial = b''
+        if self._file is not None:
+            self._read_lines()
+
+    def _read_lines(self):
+        data = self._file.read()
+        if not data:
+            return
+        offset = self._file.tell() - len(data) - len(self._partial)
+        data, self._partial = self._partial + data, b''
+        lines = data.split(b'\n')
+        self._partial = lines.pop()
+        events = []
+        for raw_line in lines:
+            offset += len(raw_line) + 1
+            line = ANSI_ESCAPE.sub('', raw_line.decode('utf-8', errors='replace')).rstrip('\r')
+            events.append((f"{self._inode}-{offset}", line))
+        self._publish(events)
+
+    def _publish(self, events):
+        with self._lock:
+            self.buffer.extend(events)
+            for subscription in list(self.subscriptions):
+                try:
+                    for event in events:
+                        subscription.lines.put_nowait(event)
+                except queue.Full:
+                    # slow viewer: disconnect it rather than buffering without bound
+                    subscription.closed = True
+                    self.subscriptions.discard(subscription)
+                    self.dropped_subscribers += 1
+
+
+# Sparse index of the log file and its rotated files, mapping timestamps and [job_name] tokens to byte ranges.
+# Each file is split into blocks of whole lines; per block the index keeps its byte range and first/last
+# timestamp, and per token the blocks it occurs in. A search only reads the matching blocks (via mmap).
+# Files are keyed by inode, so rotation (which renames files) doesn't invalidate their entries.
+class LogIndex:
+    def __init__(self, log_file=LOG_FILE, index_file=LOG_INDEX_FILE, block_bytes=LOG_INDEX_BLOCK_BYTES,
+                 backup_count=LOG_BACKUP_COUNT):
+        self.logger = Logger()
+        self.log_file = log_file
+        self.index_file = index_file
+        self.block_bytes = block_bytes
+        self.backup_count = backup_count
+        self._lock = Lock()
+        self._segments = None
+
+    def segment_paths(self):
+        # oldest rotated file first, the live log file last
+        return [f"{self.log_file}.{number}" for number in range(self.backup_count, 0, -1)] + [self.log_file]
+
+    def update(self):
+        # Index whatever was appended since the last update; returns (path, inode, segment) oldest first
+        with self._lock:
+            if self._segments is None:
+                self._segments = self._load()
+            segments, found, changed = {}, [], False
+            for path in self.segment_paths():
+                try:
+                    with open(path, 'rb') as log:
+                        stat = os.fstat(log.fileno())
+                        inode = str(stat.st_ino)
+                        segment = self._segments.get(inode)
+                        if segment is None or not self._same_file(log, stat, segment):
+                            segment = {'indexed': 0, 'head': '', 'blocks': [], 'tokens': {}}
+                            changed = True
+                        if stat.st_size > segment['indexed']:
+                            changed |= self._index_segment(log, segment)
+                except FileNotFoundError:
+                    continue
+                segments[inode] = segment
+                found.append((path, inode, segment))
+            # drop files that were rotated out
+            changed |= segments.keys() != self._segments.keys()
+            self._segments = segments
+            if changed:
+                self._save()
+            return found
+
+    def stats(self):
+        segments = self.update()
+        return {
+            'files': len(segments),
+            'indexed_bytes': sum(segment['indexed'] for _, _, segment in segments),
+            'blocks': sum(len(segment['blocks']) for _, _, segment in segments),
+            'tokens': len({token for _, _, segment in segments for token in segment['tokens']}),
+        }
+
+    def search(self, job=None, since=None, until=None, limit=LOG_SEARCH_MAX_LINES):
+        # Lines mentioning [job] logged between since and until (inclusive), oldest first
+        since, until = self._timestamp(since), self._timestamp(until)
+        token = f"[{job}]".encode() if job else None
+        lines = []
+        for path, inode, segment in self.update():
+            blocks = segment['blocks']
+            candidates = segment['tokens'].get(job, ()) if job else range(len(blocks))
+            candidates = [number for number in candidates
+                          if (since is None or blocks[number][3] >= since) and
+                          (until is None or blocks[number][2] <= until)]
+            if not candidates:
+                continue
+            try:
+                with open(path, 'rb') as log:
+                    if str(os.fstat(log.fileno()).st_ino) != inode:
+                        # rotated since the update, the next search will find it under its new name
+                        self.logger.log_msg('warning', f"Log file {path} was rotated during a search")
+                        continue
+                    with mmap.mmap(log.fileno(), 0, access=mmap.ACCESS_READ) as log_map:
+                        for number in candidates:
+                            start, end, first, last = blocks[number]
+                            # only blocks straddling since/until need their line timestamps checked
+                            check_time = (since and first < since) or (until and last > until)
+                            for raw_line in self._lines(log_map, start, end, token):
+                                if check_time:
+                                    match = LOG_TIMESTAMP.match(raw_line)
+                                    timestamp = match.group().decode() if match else first
+                                    if (since and timestamp < since) or (until and timestamp > until):
+                                        continue
+                                lines.append(ANSI_ESCAPE.sub('', raw_line.decode('utf-8', errors='replace')))
+                                if len(lines) >= limit:
+                                    return lines
+            except FileNotFoundError:
+                continue
+        return lines
+
+    @staticmethod
+    def _lines(log_map, start, end, token):
+        # lines of log_map[start:end], or only those containing token, found with a substring search
+        if token is None:
+            yield from log_map[start:end].splitlines()
+            return
+        position = log_map.find(token, start, end)
+        while position >= 0:
+            line_start = log_map.rfind(b'\n', start, position) + 1
+            line_end = log_map.find(b'\n', position, end)
+            line_end = end if line_end < 0 else line_end
+            yield log_map[line_start:line_end].rstrip(b'\r')
+            position = log_map.find(token, line_end, end)
+
+    @staticmethod
+    def _timestamp(value):
+        # ISO date/time (or datetime) to the sortable "YYYY-MM-DD HH:MM:SS" form used in the log
+        if value is None or value == '':
+            return None
+        if not isinstance(value, datetime):
+            value = datetime.fromisoformat(value)
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+
+    def _same_file(self, log, stat, segment):
+        if stat.st_size < segment['indexed']:
+            # truncated
+            return False
+        head = segment['head'].encode('latin-1')
+        return log.read(len(head)) == head
+
+    def _index_segment(self, log, segment):
+        blocks, tokens = segment['blocks'], segment['tokens']
+        start = segment['indexed']
+        if blocks and blocks[-1][1] - blocks[-1][0] < self.block_bytes:
+            # the last block isn't full yet, rebuild it with the new lines
+            start = blocks.pop()[0]
+            for token in list(tokens):
+                if tokens[token][-1] == len(blocks):
+                    tokens[token].pop()
+                    if not tokens[token]:
+                        del tokens[token]
+        indexed = segment['indexed']
+        with mmap.mmap(log.fileno(), 0, access=mmap.ACCESS_READ) as log_map:
+            size = len(log_map)
+            if not segment['head']:
+                segment['head'] = log_map[:LOG_INDEX_HEAD_BYTES].decode('latin-1')
+            while start < size:
+                limit = min(start + self.block_bytes, size)
+                end = log_map.rfind(b'\n', start, limit) + 1
+                if not end:
+                    # a single line longer than a block
+                    end = log_map.find(b'\n', limit, size) + 1
+                    if not end:
+                        # incomplete last line, picked up by the next update
+                        break
+                block = log_map[start:end]
+                timestamps = LOG_TIMESTAMPS.findall(block)
+                previous = blocks[-1][3] if blocks else None
+                first = previous if previous and not LOG_TIMESTAMP.match(block) else None
+                first = first or (timestamps[0].decode() if timestamps else '')
+                last = timestamps[-1].decode() if timestamps else first
+                for token in set(LOG_TOKEN.findall(block)):
+                    tokens.setdefault(token.decode('utf-8', errors='replace'), []).append(len(blocks))
+                blocks.append([start, end, first, last])
+                start = end
+        segment['indexed'] = start
+        return start != indexed
+
+    def _load(self):
+        try:
+            with open(self.index_file) as index:
+                index = json.load(index)
+            if index.get('block_bytes') == self.block_bytes:
+                return index['segments']
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError) as e:
+            self.logger.log_msg('warning', f"Rebuilding the log index, {self.index_file} is unreadable: {e}")
+        return {}
+
+    def _save(self):
+        # write to a temporary file first, so readers in other processes never see a partial index
+        try:
+            temp_file = f"{self.index_file}.{os.getpid()}.tmp"
+            with open(temp_file, 'w') as index:
+                json.dump({'block_bytes': self.block_bytes, 'segments': self._segments}, index)
+            os.replace(temp_file, self.index_file)
+        except OSError as e:
+            self.logger.log_msg('error', f"Failed to save the log index {self.index_file}: {e}")
@@ -0,0 +1,192 @@
+import atexit
+import os
+from collections import deque, namedtuple
+from threading import Thread, Event, Lock
+from time import sleep
+
+from sqlalchemy import insert, select, delete
+from sqlalchemy.exc import OperationalError
+
+from db_manager import JobInstance, JobTemplate, PendingJob
+from ingesthub_logger import Logger
+from stats_manager import JobStats
+
+# queued job metrics are written once this many are waiting ...
+METRICS_FLUSH_RECORDS = int(os.environ.get('METRICS_FLUSH_RECORDS', 100))
+# ... or at the latest this long after being queued
+METRICS_FLUSH_INTERVAL_MS = int(os.environ.get('METRICS_FLUSH_INTERVAL_MS', 500))
+# attempts to write a batch while the database is locked by another writer, with exponential backoff in between
+METRICS_FLUSH_RETRIES = int(os.environ.get('METRICS_FLUSH_RETRIES', 5))
+METRICS_FLUSH_RETRY_BACKOFF_MS = 50
+
+# A finished job's JobInstance column values waiting to be written, and the pending job it completes
+MetricsRecord = namedtuple('MetricsRecord', ['job_instance', 'sch_job_template_id', 'pending_job_id',
+                                             'pending_owner', 'on_written'])
+
+
+# Write-behind buffer for job metrics: finished jobs are queued by the monitor workers and written by a single
+# thread, many rows per transaction. The pending job rows are deleted in the same transaction as their metrics
+# are inserted, so a crash before a flush leaves the jobs to be collected again rather than losing them.
+class JobMetricsWriter:
+    def __init__(self, db_manager, flush_records=METRICS_FLUSH_RECORDS, flush_interval_ms=METRICS_FLUSH_INTERVAL_MS,
+                 retries=METRICS_FLUSH_RETRIES):
+        self.logger = Logger()
+        self.db_manager = db_manager
+        self.db = db_manager.db
+        # per template, user and engine rollups, updated in the same transaction as the metrics
+        self.job_stats = JobStats(db_manager)
+        self.flush_records = flush_records
+        self.flush_interval_secs = flush_interval_ms / 1000
+        self.retries = retries
+        self.written = 0
+        self.failed = 0
+        self.flushes = 0
+        self.retried = 0
+        # sch_job_template_id -> job_template_id, filled on demand by the flushes
+        self._template_ids = {}
+        self._records = deque()
+        self._wakeup = Event()
+        self._flush_lock = Lock()
+        self._start_lock = Lock()
+        self._running = False
+        self._thread = None
+
+    def add(self, job_instance, sch_job_template_id, pending_job_id=None, pending_owner=None, on_written=None):
+        # job_instance: JobInstance column values without job_template_id, which is looked up when written.
+        # on_written(written) is called from the writer thread once the record is committed or given up on.
+        self._ensure_started()
+        self._records.append(MetricsRecord(job_instance, sch_job_template_id, pending_job_id, pending_owner,
+                                           on_written))
+        if len(self._records) >= self.flush_records:
+            self._wakeup.set()
+
+    def flush(self):
+        # Write everything queued so far
+        with self._flush_lock:
+            while self._records:
+                batch = [self._records.popleft() for _ in range(min(self.flush_records, len(self._records)))]
+                self._write(batch)
+
+    def stop(self):
+        if self._running:
+            self._running = False
+            self._wakeup.set()
+            self._thread.join(timeout=30)
+        self.flush()
+
+    def stats(self):
+        return {
+            'queued': len(self._records),
+            'written': self.written,
+            'failed': self.failed,
+            'flushes': self.flushes,
+            'retried': self.retried,
+        }
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._running = True
+                    self._thread = Thread(target=self._run, name='job-metrics-writer', daemon=True)
+                    self._thread.start()
+                    atexit.register(self.stop)
+
+    def _run(self):
+        while self._running:
+            self._wakeup.wait(self.flush_interval_secs)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                self.logger.log_msg('error', f"Error while writing job metrics: {e}")
+
+    def _write(self, batch):
+        for attempt in range(self.retries):
+            try:
+                written, skipped = self._write_batch(batch)
+                break
+            except OperationalError as e:
+                # most likely another connection holds the SQLite write lock
+                self.retried += 1
+                if attempt + 1 == self.retries:
+                    self.logger.log_msg('error', f"Gave up writing metrics of {len(batch)} job(s): {e}")
+                    self.failed += len(batch)
+                    self._notify(batch, False)
+                    return
+                sleep(METRICS_FLUSH_RETRY_BACKOFF_MS / 1000 * 2 ** attempt)
+            except Exception as e:
+                # not retried, the jobs are collected again once their pending job is claimed again
+                self.logger.log_msg('error', f"Failed to write metrics of {len(batch)} job(s): {e}")
+                self.failed += len(batch)
+                self._notify(batch, False)
+                return
+        self.flushes += 1
+        self.written += len(written)
+        self.failed += len(skipped)
+        if written:
+            self.logger.log_msg('info', f"Wrote metrics of {len(written)} job(s) to the database")
+        self._notify(written, True)
+        self._notify(skipped, False)
+
+    def _write_batch(self, batch):
+        # One transaction: insert the metrics of the jobs still owned by their monitor and delete their pending jobs
+        with self.db_manager.app.app_context():
+            session = self.db.session
+            try:
+                self._load_template_ids({record.sch_job_template_id for record in batch})
+                pending_job_ids = [record.pending_job_id for record in batch if record.pending_job_id]
+                owners = dict(session.execute(
+                    select(PendingJob.job_id, PendingJob.lease_owner)
+                    .where(PendingJob.job_id.in_(pending_job_ids))).all()) if pending_job_ids else {}
+                written, skipped, completed = [], [], {}
+                for record in batch:
+                    if record.pending_job_id and owners.get(record.pending_job_id) != record.pending_owner:
+                        # another monitor took the job over (and may have completed it already), it writes the metrics
+                        skipped.append(record)
+                        continue
+                    if record.pending_job_id in owners:
+                        completed.setdefault(record.pending_owner, []).append(record.pending_job_id)
+                    if record.sch_job_template_id not in self._template_ids:
+                        self.logger.log_msg('error', f"No job template with ID '{record.sch_job_template_id}', "
+                                                     f"dropping the metrics of job [{record.job_instance['job_id']}]")
+                        skipped.append(record)
+                        continue
+                    written.append(record)
+                deleted = sum(session.execute(
+                    delete(PendingJob).where(PendingJob.job_id.in_(job_ids), PendingJob.lease_owner == owner)).rowcount
+                    for owner, job_ids in completed.items())
+                if deleted < sum(len(job_ids) for job_ids in completed.values()):
+                    # a job was taken over since its owner was read, check the owners again
+                    session.rollback()
+                    return self._write_batch(batch)
+                if written:
+                    job_instances = [
+                        record.job_instance | {'job_template_id': self._template_ids[record.sch_job_template_id]}
+                        for record in written]
+                    session.execute(insert(JobInstance), job_instances)
+                    self.job_stats.apply(session.connection(), job_instances)
+                session.commit()
+                return written, skipped
+            except Exception:
+                session.rollback()
+                raise
+
+    def _load_template_ids(self, sch_job_template_ids):
+        missing = sch_job_template_ids - self._template_ids.keys()
+        if missing:
+            rows = self.db.session.execute(
+                select(JobTemplate.sch_job_template_id, JobTemplate.job_template_id)
+                .where(JobTemplate.sch_job_template_id.in_(missing))
+                .order_by(JobTemplate.job_template_id)).all()
+            for sch_job_template_id, job_template_id in rows:
+                # several rows may share a ControlHub template, the oldest one wins
+                self._template_ids.setdefault(sch_job_template_id, job_template_id)
+
+    def _notify(self, records, written):
+        for record in records:
+            if record.on_written:
+                try:
+                    record.on_written(written)
+                except Exception as e:
+                    self.logger.log_msg('error', f"Error in job metrics callback: {e}")
@@ -0,0 +1,19 @@
+import signal
+
+from db_manager import DatabaseManager
+from streamsets_manager import StreamSetsManager
+
+
+# Standalone job monitor: claims pending jobs from the database and records their metrics once they finish.
+# Run any number of these (with MONITOR_IN_PROCESS=false on the web app) to scale monitoring independently.
+def main():
+    db_manager = DatabaseManager()
+    db_manager.create_tables()
+    streamsets_manager = StreamSetsManager(db_manager)
+    # stop gracefully on SIGTERM so the leases are handed over right away instead of expiring
+    signal.signal(signal.SIGTERM, lambda signum, frame: streamsets_manager.monitor.stop(wait=False))
+    streamsets_manager.monitor.run_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+import hmac
+import os
+import sys
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime
+from itertools import count
+from threading import Thread, Event, get_ident
+from time import perf_counter
+
+from ingesthub_logger import Logger
+
+# profile every request; otherwise only requests sending PROFILE_HEADER with the PROFILE_TOKEN secret are profiled
+PROFILE_REQUESTS = os.environ.get('PROFILE_REQUESTS', 'false').lower() == 'true'
+# shared secret of the admins allowed to profile single requests, unset disables PROFILE_HEADER
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+PROFILE_HEADER = 'X-IngestHub-Profile'
+# where the sampled stacks of profiled requests are written, one file per request
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+# how often the stack of a profiled request is sampled
+PROFILE_SAMPLE_INTERVAL_MS = float(os.environ.get('PROFILE_SAMPLE_INTERVAL_MS', 5))
+# a profiled request running more database statements than this logs a warning, e.g. for an N+1 query loop;
+# PROFILE_ROUTE_QUERY_BUDGETS overrides it per route, e.g. 'recent_jobs=4,job_stats=2'
+PROFILE_QUERY_BUDGET = int(os.environ.get('PROFILE_QUERY_BUDGET', 20))
+PROFILE_ROUTE_QUERY_BUDGETS = {route.strip(): int(budget) for route, _, budget in
+                               (entry.partition('=') for entry in
+                                os.environ.get('PROFILE_ROUTE_QUERY_BUDGETS', '').split(','))
+                               if route.strip()}
+# length of the statement quoted in a query budget warning
+PROFILE_STATEMENT_PREVIEW = 200
+
+# Profile of the request being served by the current thread, None when it isn't profiled. The database and ControlHub
+# hooks only look it up, so requests that aren't profiled pay a context variable lookup per statement or call.
+current_profile = ContextVar('current_profile', default=None)
+
+
+# Samples the stack of one thread until stopped; wall-clock samples, so waits on the database or ControlHub show up too
+class StackSampler:
+    def __init__(self, thread_id, interval_secs):
+        self.thread_id = thread_id
+        self.interval_secs = interval_secs
+        # sample count per stack, outermost frame first
+        self.stacks = Counter()
+        self._stopped = Event()
+        self._thread = Thread(target=self._run, name='request-profiler', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval_secs):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+
+# Database statements and ControlHub calls of one request, with their time
+class RequestProfile:
+    def __init__(self, endpoint, method, path, sample_interval_secs=None):
+        self.endpoint = endpoint
+        self.method = method
+        self.path = path
+        self.started = perf_counter()
+        self.duration = None
+        self.query_count = 0
+        self.query_secs = 0.0
+        # count and time per statement text, statements repeated with different parameters share their text
+        self.statements = {}
+        self.call_count = 0
+        self.call_secs = 0.0
+        self.calls = {}
+        self.sampler = StackSampler(get_ident(), sample_interval_secs) if sample_interval_secs else None
+        self._token = current_profile.set(self)
+
+    def record_query(self, statement, elapsed):
+        self.query_count += 1
+        self.query_secs += elapsed
+        totals = self.statements.setdefault(statement, [0, 0.0])
+        totals[0] += 1
+        totals[1] += elapsed
+
+    def record_call(self, operation, elapsed):
+        self.call_count += 1
+        self.call_secs += elapsed
+        totals = self.calls.setdefault(operation, [0, 0.0])
+        totals[0] += 1
+        totals[1] += elapsed
+
+    def stop(self):
+        if self.duration is None:
+            self.duration = perf_counter() - self.started
+            if self.sampler:
+                self.sampler.stop()
+
+    def detach(self):
+        # the statements of the request's teardown (e.g. closing the session) aren't profiled
+        self.stop()
+        if self._token is not None:
+            current_profile.reset(self._token)
+            self._token = None
+
+    def most_repeated(self):
+        # (statement, count) of the statement run most often, or None
+        if not self.statements:
+            return None
+        statement, (runs, _) = max(self.statements.items(), key=lambda item: item[1][0])
+        return statement, runs
+
+    def server_timing(self):
+        # Server-Timing header value, shown per request by the browser's developer tools
+        return ', '.join([
+            f'db;desc="{self.query_count} statement(s)";dur={self.query_secs * 1000:.2f}',
+            f'sch;desc="{self.call_count} ControlHub call(s)";dur={self.call_secs * 1000:.2f}',
+            f'total;dur={self.duration * 1000:.2f}',
+        ])
+
+
+# Opt-in per-request profiling: statement and ControlHub call counts and times, a Server-Timing header, query budget
+# warnings and a sampled stack profile written to PROFILE_DIR
+class RequestProfiler:
+    def __init__(self, enabled=PROFILE_REQUESTS, token=PROFILE_TOKEN, profile_dir=PROFILE_DIR,
+                 sample_interval_ms=PROFILE_SAMPLE_INTERVAL_MS, query_budget=PROFILE_QUERY_BUDGET,
+                 route_query_budgets=None):
+        self.logger = Logger()
+        self.enabled = enabled
+        self.token = token
+        self.profile_dir = profile_dir
+        self.sample_interval_secs = sample_interval_ms / 1000 if sample_interval_ms > 0 else None
+        self.query_budget = query_budget
+        self.route_query_budgets = PROFILE_ROUTE_QUERY_BUDGETS if route_query_budgets is None else route_query_budgets
+        self._sequence = count(1)
+
+    def wants(self, header_value):
+        if self.enabled:
+            return True
+        return bool(self.token and header_value) and hmac.compare_digest(header_value.encode(), self.token.encode())
+
+    def start(self, endpoint, method, path):
+        return RequestProfile(endpoint or 'unmatched', method, path, self.sample_interval_secs)
+
+    def query_budget_for(self, endpoint):
+        return self.route_query_budgets.get(endpoint, self.query_budget)
+
+    def finish(self, profile):
+        # Stops profiling the request; returns its Server-Timing header value
+        profile.stop()
+        budget = self.query_budget_for(profile.endpoint)
+        if profile.query_count > budget:
+            statement, repeated = profile.most_repeated()
+            self.logger.log_msg('warning', f"{profile.method} {profile.path} ({profile.endpoint}) ran "
+                                           f"{profile.query_count} database statements, over its budget of {budget}; "
+                                           f"most repeated ({repeated}x): "
+                                           f"{' '.join(statement.split())[:PROFILE_STATEMENT_PREVIEW]}")
+        if profile.sampler and profile.sampler.stacks:
+            self._save(profile)
+        return profile.server_timing()
+
+    def _save(self, profile):
+        # Folded stacks (one 'frame;frame;... count' line per stack), readable by flamegraph.pl and speedscope
+        file_name = (f"{datetime.now():%Y%m%dT%H%M%S}-{os.getpid()}-{next(self._sequence)}-"
+                     f"{profile.endpoint}.folded")
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            with open(os.path.join(self.profile_dir, file_name), 'w') as file:
+                for stack, samples in profile.sampler.stacks.most_common():
+                    file.write(f"{stack} {samples}\n")
+            self.logger.log_msg('info', f"Profiled {profile.method} {profile.path}: {profile.duration * 1000:.1f} ms, "
+                                        f"{profile.query_count} statement(s), {profile.call_count} ControlHub "
+                                        f"call(s), stack samples in {os.path.join(self.profile_dir, file_name)}")
+        except OSError as e:
+            self.logger.log_msg('warning', f"Could not save the profile of {profile.method} {profile.path}: {e}")
@@ -0,0 +1,190 @@
+import json
+import os
+import weakref
+from collections import namedtuple
+from datetime import datetime
+from threading import Thread, Condition
+from time import monotonic, sleep
+
+from sqlalchemy import select
+
+from db_manager import PendingJob
+from ingesthub_logger import Logger
+
+# how often a process with progress viewers reads the progress captured by the job monitors of every process
+PROGRESS_SYNC_SECS = float(os.environ.get('PROGRESS_SYNC_SECS', 2))
+# max concurrent progress feed connections per process, keep it below the number of server threads
+PROGRESS_SSE_MAX_CONNECTIONS = int(os.environ.get('PROGRESS_SSE_MAX_CONNECTIONS', 8))
+# a progress feed connection is ended after this long and the browser reconnects, so forgotten job pages don't hold
+# a server thread forever
+PROGRESS_SSE_MAX_SECS = int(os.environ.get('PROGRESS_SSE_MAX_SECS', 5 * 60))
+# idle viewers get an SSE comment this often, so closed connections are noticed
+PROGRESS_SSE_KEEPALIVE_SECS = 15
+# how long a browser turned away by PROGRESS_SSE_MAX_CONNECTIONS waits before it tries again
+PROGRESS_SSE_RETRY_MS = 10000
+
+# Record counts of a running job at one status check, and its input rate since the previous one
+JobProgress = namedtuple('JobProgress', [
+    'job_id', 'job_name', 'user_id', 'input_record_count', 'output_record_count', 'error_record_count',
+    'records_per_sec', 'submit_time', 'progress_time'])
+
+
+def measure_progress(job_id, job_name, user_id, submit_time, counts, previous=None, now=None):
+    # records/sec over the time since the previous snapshot, or since the job was submitted for the first one
+    now = now or datetime.now()
+    input_count, output_count, error_count = counts
+    since, since_count = (previous.progress_time, previous.input_record_count) if previous else (submit_time, 0)
+    elapsed = (now - since).total_seconds()
+    records_per_sec = round(max(input_count - since_count, 0) / elapsed, 2) if elapsed > 0 else None
+    return JobProgress(job_id, job_name, user_id, input_count, output_count, error_count, records_per_sec,
+                       submit_time, now)
+
+
+# A viewer of the progress feed
+class ProgressSubscription:
+    def __init__(self, latest):
+        # latest undelivered snapshot per job, None once the job finished; a slow viewer skips intermediate snapshots
+        self.pending = dict(latest)
+
+
+# In-memory pub/sub of running job progress. The job monitor publishes every snapshot it captures, and while anyone
+# watches, one thread per process also picks up the snapshots that monitors of other processes saved on their pending
+# jobs. Viewers only ever read from here, so any number of them cost no ControlHub calls.
+class JobProgressHub:
+    def __init__(self, db_manager, max_subscribers=PROGRESS_SSE_MAX_CONNECTIONS,
+                 max_stream_secs=PROGRESS_SSE_MAX_SECS, sync_secs=PROGRESS_SYNC_SECS):
+        self.logger = Logger()
+        self.db_manager = db_manager
+        self.max_subscribers = max_subscribers
+        self.max_stream_secs = max_stream_secs
+        self.sync_secs = sync_secs
+        # latest snapshot per running job
+        self.latest = {}
+        self.subscriptions = set()
+        self._condition = Condition()
+        self._thread = None
+        _hubs.add(self)
+
+    def _after_fork(self):
+        self.latest = {}
+        self.subscriptions = set()
+        self._condition = Condition()
+        self._thread = None
+
+    def publish(self, progress):
+        with self._condition:
+            current = self.latest.get(progress.job_id)
+            if current is not None and current.progress_time >= progress.progress_time:
+                return
+            self.latest[progress.job_id] = progress
+            for subscription in self.subscriptions:
+                subscription.pending[progress.job_id] = progress
+            self._condition.notify_all()
+
+    def finish(self, job_id):
+        with self._condition:
+            if self.latest.pop(job_id, None) is None:
+                return
+            for subscription in self.subscriptions:
+                subscription.pending[job_id] = None
+            self._condition.notify_all()
+
+    def running(self):
+        with self._condition:
+            return list(self.latest.values())
+
+    def subscribe(self):
+        # None once PROGRESS_SSE_MAX_CONNECTIONS viewers are connected
+        with self._condition:
+            if len(self.subscriptions) >= self.max_subscribers:
+                return None
+            subscription = ProgressSubscription(self.latest)
+            self.subscriptions.add(subscription)
+            self._ensure_started()
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self._condition:
+            self.subscriptions.discard(subscription)
+
+    def subscriber_count(self):
+        return len(self.subscriptions)
+
+    def stream(self, subscription):
+        # Server-sent events for one viewer: a 'progress' event per new snapshot, a 'finished' event per finished job
+        ends_at = monotonic() + self.max_stream_secs
+        try:
+            while True:
+                remaining = ends_at - monotonic()
+                if remaining <= 0:
+                    return
+                with self._condition:
+                    if not subscription.pending:
+                        self._condition.wait(min(PROGRESS_SSE_KEEPALIVE_SECS, remaining))
+                    pending, subscription.pending = subscription.pending, {}
+                if not pending:
+                    yield ": keepalive\n\n"
+                    continue
+                yield ''.join(self._event(job_id, progress) for job_id, progress in pending.items())
+        finally:
+            self.unsubscribe(subscription)
+
+    @staticmethod
+    def retry_later():
+        # tells the browser's EventSource to reconnect after PROGRESS_SSE_RETRY_MS
+        yield f"retry: {PROGRESS_SSE_RETRY_MS}\n\n"
+
+    @staticmethod
+    def _event(job_id, progress):
+        if progress is None:
+            return f"event: finished\ndata: {json.dumps({'job_id': job_id})}\n\n"
+        data = {name: value.isoformat() if isinstance(value, datetime) else value
+                for name, value in progress._asdict().items()}
+        return f"event: progress\ndata: {json.dumps(data)}\n\n"
+
+    def _ensure_started(self):
+        # caller must hold self._condition
+        if self._thread is None:
+            self._thread = Thread(target=self._run, name='progress-sync', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        # Runs while anyone watches
+        while True:
+            with self._condition:
+                if not self.subscriptions:
+                    self._thread = None
+                    return
+            try:
+                self.sync()
+            except Exception as e:
+                self.logger.log_msg('error', f"Error while reading the progress of running jobs: {e}")
+            sleep(self.sync_secs)
+
+    def sync(self):
+        # One query for the progress saved on every pending job; jobs no longer pending have finished
+        with self.db_manager.app.app_context():
+            rows = self.db_manager.db.session.execute(
+                select(PendingJob.job_id, PendingJob.job_name, PendingJob.user_id, PendingJob.input_record_count,
+                       PendingJob.output_record_count, PendingJob.error_record_count, PendingJob.records_per_sec,
+                       PendingJob.submit_time, PendingJob.progress_time)).all()
+        for row in rows:
+            if row.progress_time is not None:
+                self.publish(JobProgress(*row))
+        pending = {row.job_id for row in rows}
+        for progress in self.running():
+            if progress.job_id not in pending:
+                self.finish(progress.job_id)
+
+
+# Progress hubs of this process. Held weakly, so a discarded hub (e.g. of an earlier create_app()) is collected.
+_hubs = weakref.WeakSet()
+
+
+def _after_fork_in_child():
+    # threads don't survive fork(), e.g. when gunicorn forks workers from a preloaded app
+    for hub in list(_hubs):
+        hub._after_fork()
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
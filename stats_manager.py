@@ -0,0 +1,221 @@
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, func, delete, insert, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from db_manager import JobInstance, JobStatsRollup
+from ingesthub_logger import Logger
+
+# upper bound in seconds of each duration bucket of the rollups and its column, the last bucket has no bound
+STATS_DURATION_BUCKETS = [
+    (30, 'runs_under_30s'), (60, 'runs_under_1m'), (120, 'runs_under_2m'), (300, 'runs_under_5m'),
+    (600, 'runs_under_10m'), (1800, 'runs_under_30m'), (3600, 'runs_under_1h'), (7200, 'runs_under_2h'),
+    (14400, 'runs_under_4h'), (28800, 'runs_under_8h'), (86400, 'runs_under_24h'), (None, 'runs_over_24h'),
+]
+# rollup dimensions and the JobInstance column they group by
+STATS_DIMENSIONS = {'job_template': 'job_template_id', 'user': 'user_id', 'engine': 'engine_id'}
+STATS_PERIODS = ('hour', 'day')
+# rollup columns that are summed up, both when job runs are added and when rollups are read
+STATS_COUNTERS = ['run_count', 'successful_run_count', 'input_record_count', 'output_record_count',
+                  'error_record_count', 'duration_secs'] + [column for _, column in STATS_DURATION_BUCKETS]
+# default time range of the stats page and API
+STATS_DEFAULT_DAYS = int(os.environ.get('STATS_DEFAULT_DAYS', 30))
+# ranges up to this long are read from the hourly rollups by default, longer ones from the daily rollups
+STATS_HOURLY_MAX_HOURS = 48
+# job instances read per query when the rollups are rebuilt from the job history
+STATS_REBUILD_CHUNK_SIZE = 5000
+
+
+def bucket_start(timestamp, period):
+    if period == 'hour':
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+# Per job template, user and engine totals of the job runs by hour and by day. The metrics writer adds every job run
+# to its rollups in the transaction that inserts its JobInstance row, so reading stats never touches the job history.
+class JobStats:
+    def __init__(self, db_manager):
+        self.logger = Logger()
+        self.db_manager = db_manager
+        self.db = db_manager.db
+        self._upserts = {}
+
+    @staticmethod
+    def deltas(job_instances):
+        # Rollup increments of the given job runs (JobInstance column values), keyed by rollup bucket. Runs of the same
+        # template, user and engine within the same hour are totalled first, then added to their 6 rollups.
+        runs = {}
+        for job_instance in job_instances:
+            start_time, finish_time = job_instance.get('start_time'), job_instance.get('finish_time')
+            if start_time is None:
+                continue
+            duration = max((finish_time - start_time).total_seconds(), 0) if finish_time else 0
+            key = (*(job_instance.get(column) for column in STATS_DIMENSIONS.values()), bucket_start(start_time, 'hour'))
+            totals = runs.get(key)
+            if totals is None:
+                totals = runs[key] = dict.fromkeys(STATS_COUNTERS, 0)
+            totals['run_count'] += 1
+            totals['successful_run_count'] += 1 if job_instance.get('successful_run') else 0
+            totals['input_record_count'] += job_instance.get('input_record_count') or 0
+            totals['output_record_count'] += job_instance.get('output_record_count') or 0
+            totals['error_record_count'] += job_instance.get('error_record_count') or 0
+            totals['duration_secs'] += duration
+            totals[next(column for bound, column in STATS_DURATION_BUCKETS if bound is None or duration <= bound)] += 1
+
+        deltas = {}
+        for (*dimension_values, hour), totals in runs.items():
+            buckets = [('hour', hour), ('day', bucket_start(hour, 'day'))]
+            for dimension, dimension_value in zip(STATS_DIMENSIONS, dimension_values):
+                if dimension_value is None:
+                    continue
+                for period, bucket in buckets:
+                    key = (dimension, str(dimension_value), period, bucket)
+                    delta = deltas.get(key)
+                    if delta is None:
+                        deltas[key] = dict(totals)
+                        continue
+                    for column, value in totals.items():
+                        delta[column] += value
+        return deltas
+
+    def apply(self, connection, job_instances):
+        # Add the job runs to their rollups within the caller's transaction, one statement for all of them
+        deltas = self.deltas(job_instances)
+        if not deltas:
+            return
+        rows = [{'dimension': dimension, 'dimension_value': dimension_value, 'period': period,
+                 'bucket_start': bucket} | delta for (dimension, dimension_value, period, bucket), delta in deltas.items()]
+        upsert = self._upsert(connection.dialect.name)
+        if upsert is not None:
+            connection.execute(upsert, rows)
+            return
+        table = JobStatsRollup.__table__
+        for row in rows:
+            if not connection.execute(
+                    update(table)
+                    .where(table.c.dimension == row['dimension'], table.c.dimension_value == row['dimension_value'],
+                           table.c.period == row['period'], table.c.bucket_start == row['bucket_start'])
+                    .values({column: table.c[column] + row[column] for column in STATS_COUNTERS})).rowcount:
+                connection.execute(insert(table), row)
+
+    def _upsert(self, dialect_name):
+        # INSERT .. ON CONFLICT DO UPDATE adding to the existing row, so concurrent writers (other workers, standalone
+        # monitors) don't lose increments. Built once per dialect, None for dialects without it.
+        if dialect_name not in self._upserts:
+            dialect = {'sqlite': sqlite, 'postgresql': postgresql}.get(dialect_name)
+            upsert = None
+            if dialect is not None:
+                table = JobStatsRollup.__table__
+                upsert = dialect.insert(table)
+                upsert = upsert.on_conflict_do_update(
+                    index_elements=['dimension', 'dimension_value', 'period', 'bucket_start'],
+                    set_={column: table.c[column] + upsert.excluded[column] for column in STATS_COUNTERS})
+            self._upserts[dialect_name] = upsert
+        return self._upserts[dialect_name]
+
+    def rebuild(self):
+        # Recompute every rollup from the job history, e.g. for job runs recorded before the rollups existed
+        columns = [JobInstance.job_instance_id, JobInstance.start_time, JobInstance.finish_time,
+                   JobInstance.successful_run, JobInstance.input_record_count, JobInstance.output_record_count,
+                   JobInstance.error_record_count, *(getattr(JobInstance, column) for column in STATS_DIMENSIONS.values())]
+        job_runs = 0
+        with self.db_manager.app.app_context():
+            session = self.db.session
+            try:
+                session.execute(delete(JobStatsRollup))
+                last_id = 0
+                while True:
+                    rows = session.execute(select(*columns).where(JobInstance.job_instance_id > last_id)
+                                           .order_by(JobInstance.job_instance_id)
+                                           .limit(STATS_REBUILD_CHUNK_SIZE)).mappings().all()
+                    if not rows:
+                        break
+                    self.apply(session.connection(), rows)
+                    last_id = rows[-1]['job_instance_id']
+                    job_runs += len(rows)
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+        self.logger.log_msg('info', f"Rebuilt the job stats rollups from {job_runs} job run(s)")
+        return job_runs
+
+    @staticmethod
+    def time_range(since=None, until=None, period=None):
+        # Defaults to the last STATS_DEFAULT_DAYS days, read from hourly rollups for short ranges and daily ones otherwise
+        until = until or datetime.now()
+        since = since or until - timedelta(days=STATS_DEFAULT_DAYS)
+        if since >= until:
+            raise ValueError("'since' must be before 'until'")
+        if period is None:
+            period = 'hour' if until - since <= timedelta(hours=STATS_HOURLY_MAX_HOURS) else 'day'
+        elif period not in STATS_PERIODS:
+            raise ValueError(f"Unsupported period '{period}', expected one of: {', '.join(STATS_PERIODS)}")
+        # rollups cover whole buckets, the range is widened to the start of its first bucket
+        return bucket_start(since, period), until, period
+
+    def summary(self, dimension, since=None, until=None, period=None, dimension_value=None):
+        # Totals per dimension value, busiest first
+        since, until, period = self.time_range(since, until, period)
+        rows = self._read(dimension, since, until, period, dimension_value, JobStatsRollup.dimension_value)
+        summary = [{'value': row['dimension_value']} | self.metrics(row) for row in rows]
+        return sorted(summary, key=lambda row: row['runs'], reverse=True), since, until, period
+
+    def series(self, dimension, dimension_value, since=None, until=None, period=None):
+        # One entry per bucket with job runs, oldest first
+        since, until, period = self.time_range(since, until, period)
+        rows = self._read(dimension, since, until, period, dimension_value, JobStatsRollup.bucket_start)
+        series = [{'bucket_start': row['bucket_start'].isoformat()} | self.metrics(row) for row in rows]
+        return sorted(series, key=lambda row: row['bucket_start']), since, until, period
+
+    def _read(self, dimension, since, until, period, dimension_value, group_by):
+        if dimension not in STATS_DIMENSIONS:
+            raise ValueError(f"Unsupported dimension '{dimension}', expected one of: {', '.join(STATS_DIMENSIONS)}")
+        criteria = [JobStatsRollup.dimension == dimension, JobStatsRollup.period == period,
+                    JobStatsRollup.bucket_start >= since, JobStatsRollup.bucket_start < until]
+        if dimension_value is not None:
+            criteria.append(JobStatsRollup.dimension_value == str(dimension_value))
+        with self.db_manager.app.app_context():
+            return self.db.session.execute(
+                select(group_by, *(func.sum(getattr(JobStatsRollup, column)).label(column) for column in STATS_COUNTERS))
+                .where(*criteria)
+                .group_by(group_by)).mappings().all()
+
+    @staticmethod
+    def metrics(totals):
+        runs = totals['run_count'] or 0
+        duration = totals['duration_secs'] or 0
+        histogram = [totals[column] or 0 for _, column in STATS_DURATION_BUCKETS]
+        return {
+            'runs': runs,
+            'successful_runs': totals['successful_run_count'] or 0,
+            'success_rate': round(totals['successful_run_count'] / runs, 4) if runs else None,
+            'input_records': totals['input_record_count'] or 0,
+            'output_records': totals['output_record_count'] or 0,
+            'error_records': totals['error_record_count'] or 0,
+            'input_records_per_sec': round(totals['input_record_count'] / duration, 2) if duration else None,
+            'output_records_per_sec': round(totals['output_record_count'] / duration, 2) if duration else None,
+            'avg_duration_secs': round(duration / runs, 1) if runs else None,
+            'p50_duration_secs': JobStats.percentile(histogram, 0.5),
+            'p90_duration_secs': JobStats.percentile(histogram, 0.9),
+            'p99_duration_secs': JobStats.percentile(histogram, 0.99),
+        }
+
+    @staticmethod
+    def percentile(histogram, quantile):
+        # Estimated from the duration buckets, interpolating within the bucket; beyond the last bound it's that bound
+        total = sum(histogram)
+        if not total:
+            return None
+        rank = quantile * total
+        lower, seen = 0, 0
+        for (bound, _), count in zip(STATS_DURATION_BUCKETS, histogram):
+            if count and seen + count >= rank:
+                if bound is None:
+                    return lower
+                return round(lower + (bound - lower) * (rank - seen) / count, 1)
+            seen += count
+            lower = bound if bound is not None else lower
+        return lower
@@ -1,32 +1,46 @@
 import configparser
 import os
 from datetime import datetime
-from time import time, sleep
-from threading import Thread
+from threading import Lock, BoundedSemaphore
+from time import perf_counter
 
-from streamsets.sdk import ControlHub
-from db_manager import JobInstance, JobTemplate
+from requests.adapters import HTTPAdapter
+from cache_manager import TTLCache
 from ingesthub_logger import Logger
+from job_monitor import JobMonitor
+from metrics_manager import JobMetricsWriter
+from profiling_manager import current_profile
+from progress_manager import JobProgressHub
+from telemetry_manager import telemetry
 
-# job status check frequency
-JOB_STATUS_CHECK_INTERVAL_SECS = 10
-# max wait time for job completion
-MAX_WAIT_TIME_FOR_JOB_SECS = 4 * 60 * 60  # 4 hours
 # ControlHub Credentials file
 CREDENTIALS_PROPERTIES = 'private/credentials.properties'
+# max concurrent ControlHub calls (and pooled HTTP connections) shared by all routes and monitor threads
+SCH_HTTP_POOL_SIZE = int(os.environ.get('SCH_HTTP_POOL_SIZE', 10))
+# HTTP status codes returned by ControlHub once the session token is no longer valid
+SCH_AUTH_ERROR_CODES = (401, 403)
+# how long ControlHub job template definitions are cached before being fetched again
+TEMPLATE_CACHE_TTL_SECS = int(os.environ.get('TEMPLATE_CACHE_TTL_SECS', 15 * 60))
+# max number of job template definitions kept in the cache
+TEMPLATE_CACHE_MAX_SIZE = int(os.environ.get('TEMPLATE_CACHE_MAX_SIZE', 256))
 
-class StreamSetsManager:
-    def __init__(self, db_manager):
+CONTROLHUB_CALL_SECONDS = telemetry.histogram('ingesthub_controlhub_call_duration_seconds',
+                                              'ControlHub SDK call latency, excluding the wait for a free connection',
+                                              ['call'])
+CONTROLHUB_CALL_ERRORS = telemetry.counter('ingesthub_controlhub_call_errors_total', 'Failed ControlHub SDK calls',
+                                           ['call'])
+
+
+# Process-wide ControlHub session, authenticated on first use and shared by every StreamSetsManager
+class ControlHubClient:
+    def __init__(self, pool_size=SCH_HTTP_POOL_SIZE):
         self.logger = Logger()
-        self.config = configparser.ConfigParser()
-        self.config.optionxform = lambda option: option
-        try:
-            self._load_credentials()
-            self.db_manager = db_manager
-            self.sch = ControlHub(credential_id=self.cred_id, token=self.cred_token)
-        except Exception as e:
-            self.logger.log_msg('error', f"Failed to initialize StreamSetsManager: {e}")
-            raise
+        self.pool_size = pool_size
+        self.cred_id = None
+        self.cred_token = None
+        self._sch = None
+        self._lock = Lock()
+        self._slots = BoundedSemaphore(pool_size)
 
     def _load_credentials(self):
         if CREDENTIALS_PROPERTIES:
@@ -61,10 +75,95 @@ class StreamSetsManager:
         else:
             raise ValueError("CREDENTIALS_PROPERTIES is not set or credential file is missing.")
 
+    def _connect(self):
+        # the SDK is slow to import, only processes that talk to ControlHub pay for it
+        from streamsets.sdk import ControlHub
+
+        self._load_credentials()
+        sch = ControlHub(credential_id=self.cred_id, token=self.cred_token)
+        # The SDK mounts a single-connection adapter; widen it so concurrent callers reuse pooled connections
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, pool_block=True)
+        sch.api_client.session.mount('http://', adapter)
+        sch.api_client.session.mount('https://', adapter)
+        return sch
+
+    @property
+    def sch(self):
+        if self._sch is None:
+            with self._lock:
+                if self._sch is None:
+                    try:
+                        self._sch = self._connect()
+                        self.logger.log_msg('info', "Authenticated with ControlHub")
+                    except Exception as e:
+                        self.logger.log_msg('error', f"Failed to authenticate with ControlHub: {e}")
+                        raise
+        return self._sch
+
+    def invalidate(self, stale_sch=None):
+        # Drop the session so the next call re-authenticates; ignore callers holding an already replaced session
+        with self._lock:
+            if stale_sch is None or self._sch is stale_sch:
+                self._sch = None
+
+    def call(self, fn, *args, operation='other', **kwargs):
+        # Run fn(sch, *args, **kwargs) within the pool limit, re-authenticating once if the session has expired.
+        # Timed per operation (e.g. 'jobs.get') for /metrics and the profile of the current request, if any.
+        for attempt in range(2):
+            sch = self.sch
+            with self._slots:
+                started = perf_counter()
+                try:
+                    return fn(sch, *args, **kwargs)
+                except Exception as e:
+                    CONTROLHUB_CALL_ERRORS.inc(operation)
+                    if attempt or not self._is_auth_error(e):
+                        raise
+                finally:
+                    elapsed = perf_counter() - started
+                    CONTROLHUB_CALL_SECONDS.observe(elapsed, operation)
+                    profile = current_profile.get()
+                    if profile is not None:
+                        profile.record_call(operation, elapsed)
+            self.logger.log_msg('warning', "ControlHub session expired, re-authenticating...")
+            self.invalidate(sch)
+
+    @staticmethod
+    def _is_auth_error(error):
+        from streamsets.sdk.exceptions import InvalidCredentialsError
+
+        if isinstance(error, InvalidCredentialsError):
+            return True
+        return getattr(getattr(error, 'response', None), 'status_code', None) in SCH_AUTH_ERROR_CODES
+
+
+# Shared by all routes and monitor threads in this process
+controlhub_client = ControlHubClient()
+
+
+class StreamSetsManager:
+    def __init__(self, db_manager, client=None):
+        self.logger = Logger()
+        self.db_manager = db_manager
+        self.client = client or controlhub_client
+        # ControlHub job template definitions keyed by sch_job_template_id
+        self.template_cache = TTLCache(maxsize=TEMPLATE_CACHE_MAX_SIZE, ttl=TEMPLATE_CACHE_TTL_SECS)
+        # called with the ID of an invalidated template (None for all), e.g. to drop the forms generated from it
+        self._template_listeners = []
+        # Batches the metrics of finished jobs into few database transactions
+        self.metrics_writer = JobMetricsWriter(db_manager)
+        # Latest progress of the running jobs, for the live view of the jobs page
+        self.progress_hub = JobProgressHub(db_manager)
+        # Polls every in-flight job started through this manager until it finishes
+        self.monitor = JobMonitor(self)
+
+    @property
+    def sch(self):
+        return self.client.sch
+
     def get_job_template_static_params(self, job_template_id):
         try:
-            job_template = self.sch.jobs.get(job_id=job_template_id)
-            return job_template.static_parameters
+            return self._get_cached_job_template(job_template_id).static_parameters
         except Exception as e:
             self.logger.log_msg('error',
                                 f"Error retrieving static parameters for job template ID '{job_template_id}': {e}")
@@ -72,85 +171,117 @@ class StreamSetsManager:
 
     def get_job_template(self, job_template_id):
         try:
-            return self.sch.jobs.get(job_id=job_template_id)
+            return self._get_cached_job_template(job_template_id)
         except Exception as e:
             self.logger.log_msg('error', f"Error retrieving job template with ID '{job_template_id}': {e}")
             return None
 
+    def get_job(self, job_id):
+        return self.client.call(lambda sch: sch.jobs.get(job_id=job_id), operation='jobs.get')
+
+    def _get_cached_job_template(self, job_template_id):
+        return self.template_cache.get_or_load(
+            job_template_id, lambda: self.client.call(lambda sch: sch.jobs.get(job_id=job_template_id),
+                                                      operation='jobs.get'))
+
+    def on_template_invalidated(self, listener):
+        self._template_listeners.append(listener)
+
+    def invalidate_job_template(self, job_template_id=None):
+        # Drop one (or every) cached template definition so the next lookup goes back to ControlHub
+        self.template_cache.invalidate(job_template_id)
+        for listener in self._template_listeners:
+            listener(job_template_id)
+        self.logger.log_msg('info', f"Invalidated cached job template(s): [{job_template_id or 'all'}]")
+
     def start_job_template(self, sch_job_template_id, runtime_parameters, instance_name_suffix, suffix_parameter_name):
         try:
             job_template = self.get_job_template(sch_job_template_id)
             if job_template is None:
                 raise ValueError("Job template not found")
             self.logger.log_msg('info', f"Using Job template '{job_template.job_name}'")
+            return self.start_job_instances(job_template, runtime_parameters, instance_name_suffix,
+                                            suffix_parameter_name)
+        except Exception as e:
+            self.logger.log_msg('error', f"Error starting job template with ID '{sch_job_template_id}': {e}")
+            # the cached definition may be stale, fetch it again on the next attempt
+            self.invalidate_job_template(sch_job_template_id)
+            return None
 
-            suffix_map = {
-                'Counter': 'COUNTER',
-                'Timestamp': 'TIMESTAMP'
-            }
-            suffix = suffix_map.get(instance_name_suffix, 'PARAM_VALUE')
-            return self.sch.start_job_template(
+    def start_job_instances(self, job_template, runtime_parameters, instance_name_suffix, suffix_parameter_name,
+                            wait=True):
+        # Start one job instance per runtime parameter set (a dict starts a single instance); raises on failure.
+        # With wait=False ControlHub doesn't wait for every instance to become ACTIVE, the job monitor tracks them.
+        suffix_map = {
+            'Counter': 'COUNTER',
+            'Timestamp': 'TIMESTAMP'
+        }
+        suffix = suffix_map.get(instance_name_suffix, 'PARAM_VALUE')
+        return self.client.call(
+            lambda sch: sch.start_job_template(
                 job_template,
                 runtime_parameters=runtime_parameters,
                 instance_name_suffix=suffix,
                 delete_after_completion=job_template.delete_after_completion,
-                parameter_name=suffix_parameter_name if suffix == 'PARAM_VALUE' else None
-            )
-        except Exception as e:
-            self.logger.log_msg('error', f"Error starting job template with ID '{sch_job_template_id}': {e}")
-            return None
+                parameter_name=suffix_parameter_name if suffix == 'PARAM_VALUE' else None,
+                wait=wait
+            ),
+            operation='start_job_template'
+        )
+
+    def refresh_job(self, job):
+        def _refresh(sch):
+            # re-bind the job to the current session in case it was created before a re-authentication
+            job._control_hub = sch
+            job.refresh()
+
+        self.client.call(_refresh, operation='job.refresh')
+
+    def get_job_progress(self, job):
+        # Input, output and error record counts of the job's current run
+        def _metrics(sch):
+            job._control_hub = sch
+            return job.metrics[0]
+
+        metrics = self.client.call(_metrics, operation='job.metrics')
+        return metrics.input_count, metrics.output_count, metrics.total_error_count
+
+    def get_jobs_status(self, job_ids):
+        # One bulk ControlHub request for the current status of all the given jobs
+        job_statuses = self.client.call(lambda sch: sch.api_client.get_jobs_status(job_ids).response.json(),
+                                        operation='jobs.status')
+        return {job_id: job_status.get('status') for job_id, job_status in job_statuses.items()}
 
     def get_metrics(self, user, job_template_instances, job_template):
         for job in job_template_instances:
-            thread = Thread(target=self.wait_for_job_completion_and_get_metrics, args=(user, job_template, job))
-            thread.start()
-
-    def wait_for_job_completion_and_get_metrics(self, user, job_template, job):
-        with self.db_manager.app.app_context():
-            start_seconds = time()
-            elapsed_seconds = 0
-            while elapsed_seconds < MAX_WAIT_TIME_FOR_JOB_SECS:
-                try:
-                    elapsed_seconds = time() - start_seconds
-                    job.refresh()
-                    if job.status.status in ['INACTIVE', 'INACTIVE_ERROR']:
-                        break
-                    sleep(JOB_STATUS_CHECK_INTERVAL_SECS)
-                    self.logger.log_msg('info', f"Waiting for job: [{job.job_name}] to finish")
-                except Exception as e:
-                    self.logger.log_msg('error',
-                                        f"Error while waiting for job completion for job '{job.job_name}': {e}")
-                    break
+            self.monitor.watch(user, job_template, job)
 
-            self.logger.log_msg('info', f"Job: [{job.job_name}] finished running. Collecting metrics...")
-            self.write_metrics_for_job(user, job_template, job)
-
-    def write_metrics_for_job(self, user, job_template, job):
+    def write_metrics_for_job(self, user, job_template, job, owner=None, on_written=None):
+        # Collect the job's metrics from ControlHub and queue them for the metrics writer; returns whether they were
+        # queued. The writer also completes the job's pending job row, if it is still leased to owner.
         try:
-            job_metric = JobInstance()
-            job.refresh()
-            metrics = job.metrics[0]
-            history = job.history[0]
-
-            job_template = self.db_manager.query_table(JobTemplate, sch_job_template_id=job_template.job_id).first()
-
-            job_metric.successful_run = (job.status.status == 'INACTIVE' and history.color == 'GRAY')
-            job_metric.error_message = history.error_message if history.error_message else ''
-
-            job_metric.user_id = user
-            job_metric.job_id = job.job_id
-            job_metric.job_template_id = job_template.job_template_id
-            job_metric.job_run_count = metrics.run_count
-            job_metric.engine_id = metrics.sdc_id
-            job_metric.pipeline_id = job.pipeline_id
-            job_metric.input_record_count = metrics.input_count
-            job_metric.output_record_count = metrics.output_count
-            job_metric.error_record_count = metrics.total_error_count
-            job_metric.start_time = datetime.fromtimestamp(history.start_time / 1000.0)
-            job_metric.finish_time = datetime.fromtimestamp(history.finish_time / 1000.0)
-
-            self.logger.log_msg('info', "Writing job metrics to the database...")
-            self.db_manager.write_to_table(job_metric)
-            self.logger.log_msg('info', "Done writing job metrics to the database")
+            self.refresh_job(job)
+            metrics = self.client.call(lambda sch: job.metrics[0], operation='job.metrics')
+            history = self.client.call(lambda sch: job.history[0], operation='job.history')
+
+            job_metric = {
+                'successful_run': (job.status.status == 'INACTIVE' and history.color == 'GRAY'),
+                'error_message': history.error_message if history.error_message else '',
+                'user_id': user,
+                'job_id': job.job_id,
+                'job_run_count': metrics.run_count,
+                'engine_id': metrics.sdc_id,
+                'pipeline_id': job.pipeline_id,
+                'input_record_count': metrics.input_count,
+                'output_record_count': metrics.output_count,
+                'error_record_count': metrics.total_error_count,
+                'start_time': datetime.fromtimestamp(history.start_time / 1000.0),
+                'finish_time': datetime.fromtimestamp(history.finish_time / 1000.0),
+            }
+
+            self.metrics_writer.add(job_metric, job_template.job_id, pending_job_id=job.job_id if owner else None,
+                                    pending_owner=owner, on_written=on_written)
+            return True
         except Exception as e:
-            self.logger.log_msg('error', f"Failed to write job metrics for job '{job.job_name}': {e}")
+            self.logger.log_msg('error', f"Failed to write job metrics for job: [{job.job_name}]: {e}")
+            return False
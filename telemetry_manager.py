@@ -0,0 +1,332 @@
+import fcntl
+import ipaddress
+import json
+import os
+import tempfile
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Thread, Event
+from uuid import uuid4
+
+from ingesthub_logger import Logger
+
+# directory where every process of a multi-process server saves its metrics, so whichever process serves /metrics
+# reports all of them (gunicorn.conf.py sets one up); unset, /metrics reports the serving process only
+METRICS_DIR = os.environ.get('METRICS_DIR')
+# how often a process saves its metrics to METRICS_DIR
+METRICS_SAVE_SECS = int(os.environ.get('METRICS_SAVE_SECS', 5))
+# clients allowed to read /metrics, which needs no login. Checked against the address of the connecting client: behind
+# a reverse proxy on the same host every client is 127.0.0.1, so narrow this (or block /metrics in the proxy) there
+METRICS_ALLOWED_NETWORKS = [ipaddress.ip_network(network.strip()) for network in
+                            os.environ.get('METRICS_ALLOWED_NETWORKS', '127.0.0.0/8,::1/128').split(',')
+                            if network.strip()]
+# file in METRICS_DIR holding the counters and histograms of exited processes
+METRICS_ARCHIVE_FILE = 'archive.json'
+# upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# A metric's values per combination of label values. Updates don't lock: a list element is updated in place, so
+# under heavy contention a few increments may be lost, never corrupted.
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.series = {}
+
+    def collect(self):
+        return dict(self.series)
+
+    def _values(self, label_values, size):
+        values = self.series.get(label_values)
+        if values is None:
+            values = self.series.setdefault(label_values, [0] * size)
+        return values
+
+    def _labels(self, label_values, extra=''):
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labels, label_values)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def samples(self, label_values, values):
+        yield f"{self.name}{self._labels(label_values)} {_format(values[0])}"
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        self._values(label_values, 1)[0] += amount
+
+
+# Pre-bucketed: an observation increments one bucket, buckets are only accumulated when rendered
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        # one count per bucket, one for values beyond the last bucket, and the sum
+        values = self._values(label_values, len(self.buckets) + 2)
+        values[bisect_left(self.buckets, value)] += 1
+        values[-1] += value
+
+    def samples(self, label_values, values):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), values[:-1]):
+            cumulative += count
+            le = 'le="{}"'.format(bound if bound == '+Inf' else _format(bound))
+            yield f"{self.name}_bucket{self._labels(label_values, le)} {_format(cumulative)}"
+        yield f"{self.name}_sum{self._labels(label_values)} {_format(values[-1])}"
+        yield f"{self.name}_count{self._labels(label_values)} {_format(cumulative)}"
+
+
+# Read from the running components when rendered, e.g. queue depths; collect() returns a number, or a number per
+# tuple of label values
+class Gauge(Metric):
+    type = 'gauge'
+
+    def __init__(self, name, documentation, collect, labels=(), metric_type='gauge'):
+        super().__init__(name, documentation, labels)
+        self._collect = collect
+        self.type = metric_type
+
+    def collect(self):
+        collected = self._collect()
+        if not isinstance(collected, dict):
+            collected = {(): collected}
+        return {label_values: [value] for label_values, value in collected.items()}
+
+
+# Process-wide metrics rendered in the Prometheus text format. With METRICS_DIR set, every process saves its metrics
+# there every METRICS_SAVE_SECS, in a file named after its PID and start time (so a new process reusing the PID of an
+# exited one doesn't overwrite its file), and /metrics adds up those of all processes. The counters and histograms of
+# exited processes are folded into METRICS_ARCHIVE_FILE (so totals never go down), their gauges are dropped.
+class MetricsRegistry:
+    def __init__(self, metrics_dir=METRICS_DIR, save_secs=METRICS_SAVE_SECS):
+        self.logger = Logger()
+        self.metrics_dir = metrics_dir
+        self.save_secs = save_secs
+        self.metrics = {}
+        self.process_key = self._process_key()
+        self._saver = None
+        self._stopped = Event()
+        # a forked process (e.g. a gunicorn worker of a preloaded app) starts from zero, its parent reports its own
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        for metric in self.metrics.values():
+            metric.series = {}
+        self.process_key = self._process_key()
+        self._saver = None
+        self._stopped = Event()
+
+    @classmethod
+    def _process_key(cls):
+        # '<pid>-<start time>'; a random ID stands in for the start time where /proc isn't available
+        pid = os.getpid()
+        return f"{pid}-{cls._process_start(pid) or uuid4().hex[:12]}"
+
+    @staticmethod
+    def _process_start(pid):
+        # start time of the process in clock ticks since boot (Linux), None where unavailable
+        try:
+            with open(f"/proc/{pid}/stat") as file:
+                return file.read().rsplit(')', 1)[1].split()[19]
+        except (OSError, IndexError):
+            return None
+
+    def counter(self, name, documentation, labels=()):
+        return self._register(Counter(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def gauge(self, name, documentation, collect, labels=(), metric_type='gauge'):
+        # re-registering a gauge (e.g. by another create_app()) replaces it
+        metric = Gauge(name, documentation, collect, labels, metric_type)
+        self.metrics[metric.name] = metric
+        return metric
+
+    def _register(self, metric):
+        return self.metrics.setdefault(metric.name, metric)
+
+    @staticmethod
+    def allows(address):
+        try:
+            address = ipaddress.ip_address(address)
+        except ValueError:
+            return False
+        return any(address in network for network in METRICS_ALLOWED_NETWORKS)
+
+    def snapshot(self):
+        snapshot = {}
+        for name, metric in list(self.metrics.items()):
+            try:
+                snapshot[name] = [[list(label_values), list(values)] for label_values, values in metric.collect().items()]
+            except Exception as e:
+                self.logger.log_msg('warning', f"Could not collect metric {name}: {e}")
+        return snapshot
+
+    def render(self):
+        merged = {name: {} for name in self.metrics}
+        with self._directory_lock(fcntl.LOCK_SH):
+            snapshots = [self.snapshot(), *self._other_processes()]
+        for snapshot in snapshots:
+            self._merge(merged, snapshot)
+        lines = []
+        for name, metric in list(self.metrics.items()):
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.type}")
+            for label_values, values in sorted(merged[name].items()):
+                lines.extend(metric.samples(label_values, values))
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _merge(merged, snapshot):
+        # adds a snapshot to merged ({name: {label values: values}}), only for the metrics in merged
+        for name, series in snapshot.items():
+            totals = merged.get(name)
+            if totals is None:
+                continue
+            for label_values, values in series:
+                label_values = tuple(label_values)
+                current = totals.get(label_values)
+                totals[label_values] = values if current is None else [a + b for a, b in zip(current, values)]
+
+    @contextmanager
+    def _directory_lock(self, operation):
+        # readers of METRICS_DIR share it, folding the files of exited processes into the archive takes it alone
+        if not self.metrics_dir:
+            yield
+            return
+        os.makedirs(self.metrics_dir, exist_ok=True)
+        with open(os.path.join(self.metrics_dir, 'metrics.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _process_files(self):
+        # (file name, whether its process exited) of the other processes' files
+        try:
+            file_names = os.listdir(self.metrics_dir)
+        except FileNotFoundError:
+            return []
+        files = []
+        for file_name in file_names:
+            process_key, _, extension = file_name.rpartition('.')
+            pid, _, started = process_key.partition('-')
+            if extension != 'json' or not pid.isdigit() or process_key == self.process_key:
+                continue
+            files.append((file_name, self._exited(int(pid), started)))
+        return files
+
+    def _exited(self, pid, started):
+        if not self._alive(pid):
+            return True
+        # the PID now belongs to another process
+        current = self._process_start(pid)
+        return current is not None and current != started
+
+    def _load(self, file_name):
+        try:
+            with open(os.path.join(self.metrics_dir, file_name)) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def _without_gauges(self, snapshot):
+        return {name: series for name, series in snapshot.items() if not isinstance(self.metrics.get(name), Gauge)}
+
+    def _other_processes(self):
+        if not self.metrics_dir:
+            return
+        archive = self._load(METRICS_ARCHIVE_FILE)
+        if archive:
+            yield archive
+        for file_name, exited in self._process_files():
+            snapshot = self._load(file_name)
+            if snapshot is not None:
+                yield self._without_gauges(snapshot) if exited else snapshot
+
+    @staticmethod
+    def _alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def save(self):
+        os.makedirs(self.metrics_dir, exist_ok=True)
+        self._write(f"{self.process_key}.json", self.snapshot())
+
+    def _write(self, file_name, snapshot):
+        descriptor, temp_file = tempfile.mkstemp(dir=self.metrics_dir, suffix='.tmp')
+        with os.fdopen(descriptor, 'w') as file:
+            json.dump(snapshot, file)
+        os.replace(temp_file, os.path.join(self.metrics_dir, file_name))
+
+    def fold_exited(self):
+        # Add the counters and histograms of exited processes to the archive and delete their files, so METRICS_DIR
+        # doesn't grow with every worker restart
+        with self._directory_lock(fcntl.LOCK_EX):
+            exited = [file_name for file_name, exited in self._process_files() if exited]
+            if not exited:
+                return
+            archive = {}
+            for snapshot in [self._load(METRICS_ARCHIVE_FILE), *map(self._load, exited)]:
+                if snapshot:
+                    for name, series in self._without_gauges(snapshot).items():
+                        archive.setdefault(name, {})
+                        self._merge(archive, {name: series})
+            self._write(METRICS_ARCHIVE_FILE, {name: [[list(label_values), values]
+                                                      for label_values, values in series.items()]
+                                               for name, series in archive.items()})
+            for file_name in exited:
+                os.remove(os.path.join(self.metrics_dir, file_name))
+
+    def start(self):
+        if self.metrics_dir and self._saver is None:
+            self._saver = Thread(target=self._run, name='metrics-saver', daemon=True)
+            self._saver.start()
+
+    def stop(self):
+        if self._saver is not None:
+            self._stopped.set()
+            self._saver.join(timeout=5)
+            self._saver = None
+            self._save()
+
+    def _run(self):
+        while not self._stopped.wait(self.save_secs):
+            self._save()
+
+    def _save(self):
+        try:
+            self.save()
+            self.fold_exited()
+        except Exception as e:
+            self.logger.log_msg('warning', f"Could not save metrics to {self.metrics_dir}: {e}")
+
+
+# Shared by every component of this process
+telemetry = MetricsRegistry()
@@ -0,0 +1,64 @@
+import os
+import sys
+import tempfile
+from datetime import datetime
+from types import SimpleNamespace
+from uuid import uuid4
+
+import pytest
+from sqlalchemy import delete
+
+# settings are read on import, point them at a throwaway database before any app module is imported
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+# for the fake ControlHub of the benchmarks
+sys.path.insert(0, os.path.join(REPO_DIR, 'benchmarks'))
+os.environ.setdefault('DB_URI', f"sqlite:///{tempfile.mkdtemp()}/tests.db")
+os.environ.setdefault('FLASK_KEY', 'tests')
+os.environ.setdefault('MONITOR_IN_PROCESS', 'false')
+os.environ.setdefault('CATALOG_SEED_FILE', os.path.join(REPO_DIR, 'sql', 'catalog.json'))
+
+from db_manager import DatabaseManager, JobTemplate, PendingJob  # noqa: E402
+from fake_controlhub import FakeControlHub, install  # noqa: E402
+from streamsets_manager import ControlHubClient, StreamSetsManager  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def db_manager():
+    db_manager = DatabaseManager()
+    db_manager.create_tables()
+    return db_manager
+
+
+@pytest.fixture(autouse=True)
+def no_pending_jobs(db_manager):
+    # jobs started or registered by a test aren't left for the monitors of the next one
+    yield
+    with db_manager.app.app_context():
+        db_manager.db.session.execute(delete(PendingJob))
+        db_manager.db.session.commit()
+
+
+@pytest.fixture
+def fake_sch():
+    # started jobs keep running for the whole test
+    return FakeControlHub(job_duration_secs=(3600, 3600), seed=1)
+
+
+@pytest.fixture
+def streamsets_manager(db_manager, fake_sch):
+    client = ControlHubClient()
+    install(fake_sch, client)
+    return StreamSetsManager(db_manager, client)
+
+
+@pytest.fixture
+def job_template(db_manager):
+    # a job template row of its own, for the metrics of the jobs a test starts
+    with db_manager.app.app_context():
+        row = JobTemplate(sch_job_template_id=f"template-{uuid4()}", delete_after_completion=False,
+                          source_runtime_parameters={}, destination_runtime_parameters={}, source_connection_info={},
+                          destination_connection_info={}, create_timestamp=datetime.now())
+        db_manager.db.session.add(row)
+        db_manager.db.session.commit()
+        return SimpleNamespace(job_template_id=row.job_template_id, sch_job_template_id=row.sch_job_template_id)
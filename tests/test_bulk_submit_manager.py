@@ -0,0 +1,90 @@
+from datetime import datetime
+from uuid import uuid4
+
+import pytest
+
+from bulk_submit_manager import BulkSubmitter
+from db_manager import JobTemplate
+from fake_controlhub import FakeControlHubError
+
+
+@pytest.fixture
+def sch_job_template_id(db_manager, fake_sch):
+    # Mode is static: rows may only repeat its default
+    fake_sch.static_parameters = ['Mode']
+    sch_job_template_id = f"template-{uuid4()}"
+    with db_manager.app.app_context():
+        db_manager.db.session.add(JobTemplate(
+            sch_job_template_id=sch_job_template_id, delete_after_completion=False,
+            source_runtime_parameters={'Dir': '/in', 'Mode': 'full'}, destination_runtime_parameters={'Table': ''},
+            source_connection_info={}, destination_connection_info={}, create_timestamp=datetime.now()))
+        db_manager.db.session.commit()
+    return sch_job_template_id
+
+
+@pytest.fixture
+def bulk_submitter(db_manager, streamsets_manager):
+    return BulkSubmitter(db_manager, streamsets_manager, chunk_size=2, max_workers=2)
+
+
+def test_parse_csv_and_json_lines(bulk_submitter):
+    assert bulk_submitter.parse(b'\xef\xbb\xbfTable,Dir\norders,\ncustomers,/other\n', 'csv') == \
+        [{'Table': 'orders'}, {'Table': 'customers', 'Dir': '/other'}]
+    assert bulk_submitter.parse('{"Table": "orders"}\n\n{"Table": "customers"}\n', 'jsonl') == \
+        [{'Table': 'orders'}, {'Table': 'customers'}]
+
+
+@pytest.mark.parametrize('content, file_format, error', [
+    ('{"Table": "orders"}\n{"Table": \n', 'jsonl', "Line 2 is not valid JSON"),
+    ('["orders"]\n', 'jsonl', "Line 1 is not a JSON object"),
+    ('Table\n', 'csv', "No runtime parameter sets found"),
+    ('Table\na\nb\nc\nd\n', 'csv', "4 runtime parameter sets exceed the limit of 3"),
+    ('Table: orders\n', 'yaml', "Unsupported file format 'yaml'"),
+])
+def test_parse_rejects_malformed_files(bulk_submitter, content, file_format, error):
+    bulk_submitter.max_rows = 3
+    with pytest.raises(ValueError, match=error):
+        bulk_submitter.parse(content, file_format)
+
+
+def test_every_row_is_validated_before_anything_starts(bulk_submitter, sch_job_template_id, fake_sch):
+    result = bulk_submitter.submit('user', sch_job_template_id, [
+        {'Table': 'orders'},
+        {'Table': 'customers', 'Region': 'eu'},
+        {'Table': 'invoices', 'Mode': 'incremental'},
+        {'Mode': 'full'},
+    ])
+
+    assert result['errors'] == [
+        "Row 2: unknown runtime parameter(s): Region",
+        "Row 3: static runtime parameter(s) can't be changed: Mode",
+        "Row 4: missing value(s) for: Table",
+    ]
+    assert result['started'] == []
+    assert fake_sch.calls['start_job_template'] == 0
+
+
+def test_unknown_templates_and_suffix_parameters(bulk_submitter, sch_job_template_id):
+    assert bulk_submitter.submit('user', 'no-such-template', [{'Table': 'orders'}])['errors'] == \
+        ["Unknown job template 'no-such-template'"]
+    assert bulk_submitter.submit('user', sch_job_template_id, [{'Table': 'orders'}], 'Parameter Value',
+                                 'Region')['errors'] == ["Unknown suffix parameter 'Region'"]
+
+
+def test_a_failed_chunk_does_not_stop_the_others(bulk_submitter, sch_job_template_id, fake_sch, monkeypatch):
+    start_job_template = fake_sch.start_job_template
+
+    def failing_start(job_template, runtime_parameters=None, **kwargs):
+        if any(parameters['Table'] == 'broken' for parameters in runtime_parameters):
+            raise FakeControlHubError("Simulated ControlHub failure of start_job_template")
+        return start_job_template(job_template, runtime_parameters, **kwargs)
+    monkeypatch.setattr(fake_sch, 'start_job_template', failing_start)
+
+    result = bulk_submitter.submit('user', sch_job_template_id,
+                                   [{'Table': table} for table in ('a', 'b', 'broken', 'c', 'd')])
+
+    assert result['errors'] == []
+    assert len(result['started']) == 3
+    assert result['failed'] == [{'rows': '3-4', 'error': "Simulated ControlHub failure of start_job_template"}]
+    # the started instances are handed to the job monitor
+    assert len(bulk_submitter.streamsets_manager.monitor.registry.claim('test', limit=10)) == 3
@@ -0,0 +1,125 @@
+import gc
+from datetime import datetime
+from uuid import uuid4
+
+import pytest
+from sqlalchemy import select
+
+import catalog_manager
+from catalog_manager import TemplateCatalog, CatalogImporter
+from db_manager import DatabaseManager, IngestionPattern, IngestionPatternJobTemplateRelationship, JobTemplate
+
+
+@pytest.fixture(scope='module')
+def db_manager():
+    db_manager = DatabaseManager()
+    db_manager.create_tables()
+    with db_manager.app.app_context():
+        session = db_manager.db.session
+        pattern = IngestionPattern(pattern_name='P', source='SRC', destination='DST', create_timestamp=datetime.now())
+        template = JobTemplate(sch_job_template_id='template-1', delete_after_completion=False,
+                               source_runtime_parameters={'Dir': '/old'}, destination_runtime_parameters={},
+                               source_connection_info={}, destination_connection_info={},
+                               create_timestamp=datetime.now())
+        session.add_all([pattern, template])
+        session.flush()
+        session.add(IngestionPatternJobTemplateRelationship(ingestion_pattern_id=pattern.ingestion_pattern_id,
+                                                            job_template_id=template.job_template_id))
+        session.commit()
+    return db_manager
+
+
+def test_discarded_catalogs_stop_receiving_changes(db_manager):
+    gc.collect()
+    before = len(catalog_manager._catalogs)
+    for _ in range(5):
+        TemplateCatalog(db_manager)
+    gc.collect()
+    assert len(catalog_manager._catalogs) == before
+
+
+def test_changes_are_applied_once_committed(db_manager):
+    catalog = TemplateCatalog(db_manager)
+    assert catalog.get('SRC', 'DST').source_runtime_parameters == {'Dir': '/old'}
+    with db_manager.app.app_context():
+        session = db_manager.db.session
+        template = session.query(JobTemplate).filter_by(sch_job_template_id='template-1').one()
+        template.source_runtime_parameters = {'Dir': '/new'}
+        session.flush()
+        # flushed but not committed: a lookup now still sees the committed rows, and mustn't consume the change
+        assert catalog.get('SRC', 'DST').source_runtime_parameters == {'Dir': '/old'}
+        session.commit()
+    assert catalog.get('SRC', 'DST').source_runtime_parameters == {'Dir': '/new'}
+
+
+def new_catalog():
+    suffix = uuid4().hex[:8]
+    pattern = {'pattern_name': f"P-{suffix}", 'source': f"SRC-{suffix}", 'destination': 'DST'}
+    return {
+        'patterns': [pattern],
+        'templates': [{'sch_job_template_id': f"template-{suffix}-{number}", 'delete_after_completion': False,
+                       'source_runtime_parameters': {'Dir': f"/in/{number}"}} for number in (1, 2)],
+        'relationships': [pattern | {'sch_job_template_id': f"template-{suffix}-1"}],
+    }
+
+
+def linked_templates(db_manager, pattern):
+    with db_manager.app.app_context():
+        return db_manager.db.session.execute(
+            select(JobTemplate.sch_job_template_id)
+            .join(IngestionPatternJobTemplateRelationship,
+                  IngestionPatternJobTemplateRelationship.job_template_id == JobTemplate.job_template_id)
+            .join(IngestionPattern, IngestionPattern.ingestion_pattern_id ==
+                  IngestionPatternJobTemplateRelationship.ingestion_pattern_id)
+            .where(IngestionPattern.pattern_name == pattern['pattern_name'])).scalars().all()
+
+
+def test_import_reports_validation_errors_without_writing(db_manager):
+    importer = CatalogImporter(db_manager)
+    catalog = new_catalog()
+    catalog['patterns'].append({'pattern_name': 'no source'})
+    catalog['templates'].append({'sch_job_template_id': 'bad', 'source_connection_info': 'not an object'})
+    catalog['relationships'].append({'pattern_name': 'X', 'source': 'S', 'destination': 'D',
+                                     'sch_job_template_id': 'bad'})
+
+    result = importer.import_catalog(catalog)
+
+    assert result['errors'] == [
+        "Pattern 2: pattern_name, source and destination are required",
+        "Template 3 (bad): source_connection_info must be an object",
+        "Relationship 2: pattern 'X' (S -> D) is not in the catalog",
+    ]
+    assert result['revision'] is None
+    assert linked_templates(db_manager, catalog['patterns'][0]) == []
+    with pytest.raises(ValueError):
+        importer.parse('{"patterns": {}}', 'json')
+
+
+def test_import_bumps_the_revision_only_when_something_changed(db_manager):
+    importer = CatalogImporter(db_manager)
+    catalog = new_catalog()
+
+    first = importer.import_catalog(catalog)
+    assert first['templates'] == {'inserted': 2, 'updated': 0, 'unchanged': 0}
+    assert linked_templates(db_manager, catalog['patterns'][0]) == [catalog['templates'][0]['sch_job_template_id']]
+
+    unchanged = importer.import_catalog(catalog)
+    assert unchanged['revision'] == first['revision']
+    assert unchanged['templates'] == {'inserted': 0, 'updated': 0, 'unchanged': 2}
+    assert unchanged['patterns'] == {'inserted': 0, 'relinked': 0, 'unchanged': 1}
+
+    catalog['templates'][1]['source_runtime_parameters'] = {'Dir': '/elsewhere'}
+    updated = importer.import_catalog(catalog)
+    assert updated['revision'] == first['revision'] + 1
+    assert updated['templates'] == {'inserted': 0, 'updated': 1, 'unchanged': 1}
+
+
+def test_import_keeps_the_relationships_of_patterns_listed_without_any(db_manager):
+    importer = CatalogImporter(db_manager)
+    catalog = new_catalog()
+    importer.import_catalog(catalog)
+
+    result = importer.import_catalog(catalog | {'relationships': []})
+
+    assert result['relationships'] == {'inserted': 0, 'deleted': 0}
+    assert linked_templates(db_manager, catalog['patterns'][0]) == [catalog['templates'][0]['sch_job_template_id']]
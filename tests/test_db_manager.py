@@ -0,0 +1,53 @@
+import gc
+from datetime import datetime
+
+from sqlalchemy import create_engine, inspect
+
+import db_manager
+from db_manager import DatabaseManager, JobTemplate, MIGRATIONS
+
+# job_instance as created before schema versions existed, with job_run_count stored as text
+JOB_INSTANCE_V0 = """CREATE TABLE job_instance (
+    job_instance_id INTEGER NOT NULL, job_id VARCHAR NOT NULL, job_run_count VARCHAR NOT NULL,
+    job_template_id INTEGER NOT NULL, user_id VARCHAR NOT NULL, engine_id VARCHAR NOT NULL,
+    pipeline_id VARCHAR NOT NULL, successful_run BOOLEAN NOT NULL, input_record_count INTEGER NOT NULL,
+    output_record_count INTEGER NOT NULL, error_record_count INTEGER NOT NULL, error_message VARCHAR NOT NULL,
+    start_time TIMESTAMP NOT NULL, finish_time TIMESTAMP NOT NULL, PRIMARY KEY (job_instance_id),
+    FOREIGN KEY(job_template_id) REFERENCES job_template (job_template_id))"""
+
+
+def test_upgrading_an_unversioned_database(tmp_path, monkeypatch):
+    database_uri = f"sqlite:///{tmp_path}/old.db"
+    engine = create_engine(database_uri)
+    JobTemplate.__table__.create(engine)
+    with engine.begin() as connection:
+        connection.exec_driver_sql(JOB_INSTANCE_V0)
+        connection.execute(JobTemplate.__table__.insert().values(
+            job_template_id=1, sch_job_template_id='template-id', delete_after_completion=False,
+            source_runtime_parameters={}, destination_runtime_parameters={}, source_connection_info={},
+            destination_connection_info={}, create_timestamp=datetime.now()))
+        connection.exec_driver_sql(
+            "INSERT INTO job_instance VALUES (1, 'job-id', '3', 1, 'user', 'engine', 'pipeline', 1, 10, 9, 1, '', "
+            "'2024-05-01 10:00:00', '2024-05-01 10:05:00')")
+    engine.dispose()
+    monkeypatch.setattr(db_manager.Config, 'SQLALCHEMY_DATABASE_URI', database_uri)
+
+    manager = DatabaseManager()
+    manager.upgrade_schema()
+
+    assert manager.schema_version() == MIGRATIONS[-1][0]
+    with manager.app.app_context():
+        connection = manager.db.session.connection()
+        assert connection.exec_driver_sql("SELECT job_run_count, typeof(job_run_count) FROM job_instance").all() == \
+            [(3, 'integer')]
+        indexes = {index['name'] for index in inspect(connection).get_indexes('job_instance')}
+    assert 'ix_job_instance_start_time_id' in indexes
+
+
+def test_discarded_engines_are_not_kept_for_the_fork_hook():
+    gc.collect()
+    before = len(db_manager._engines)
+    for _ in range(5):
+        DatabaseManager()
+    gc.collect()
+    assert len(db_manager._engines) == before
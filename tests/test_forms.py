@@ -0,0 +1,33 @@
+from forms import FormGenerator
+
+RUNTIME_PARAMETERS = {'SOURCE_TABLE': 'orders', 'TARGET_TABLE': 'orders_copy'}
+
+
+def disabled_fields(form_class):
+    return {name for name in RUNTIME_PARAMETERS if getattr(form_class, name).kwargs.get('render_kw')}
+
+
+def test_forms_follow_the_static_parameters_of_the_template(streamsets_manager, fake_sch):
+    form_generator = FormGenerator(streamsets_manager)
+    fake_sch.static_parameters = ['SOURCE_TABLE']
+    form = form_generator.generate_form(RUNTIME_PARAMETERS, 'template-id', 'Next')
+    assert form_generator.generate_form(RUNTIME_PARAMETERS, 'template-id', 'Next') is form
+    assert disabled_fields(form) == {'SOURCE_TABLE'}
+
+    fake_sch.static_parameters = ['SOURCE_TABLE', 'TARGET_TABLE']
+    streamsets_manager.invalidate_job_template('template-id')
+
+    assert form_generator.form_cache.stats()['size'] == 0
+    assert disabled_fields(form_generator.generate_form(RUNTIME_PARAMETERS, 'template-id', 'Next')) == \
+        {'SOURCE_TABLE', 'TARGET_TABLE'}
+
+
+def test_a_failed_start_drops_the_forms_of_the_template(streamsets_manager, fake_sch):
+    form_generator = FormGenerator(streamsets_manager)
+    form_generator.generate_form(RUNTIME_PARAMETERS, 'template-id', 'Next')
+    form_generator.generate_form(RUNTIME_PARAMETERS, 'other-template-id', 'Next')
+
+    fake_sch.failure_rate = 1
+    assert streamsets_manager.start_job_template('template-id', {}, 'Counter', None) is None
+
+    assert form_generator.form_cache.stats()['size'] == 1
@@ -0,0 +1,237 @@
+import gc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from time import time
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import select, func
+
+import job_monitor
+import progress_manager
+from db_manager import PendingJob, JobInstance
+from job_monitor import JobMonitor, MonitoredJob, PendingJobRegistry, DurationEstimate, DurationEstimator
+from progress_manager import JobProgressHub
+
+
+# Stands in for StreamSetsManager: collecting metrics fails as often as asked, like a ControlHub call failing
+class FlakyStreamSetsManager:
+    def __init__(self, db_manager, failures):
+        self.db_manager = db_manager
+        self.progress_hub = JobProgressHub(db_manager)
+        self.failures = failures
+        self.collected = []
+
+    def get_job(self, job_id):
+        return SimpleNamespace(job_id=job_id)
+
+    def get_job_template(self, sch_job_template_id):
+        return SimpleNamespace(job_id=sch_job_template_id)
+
+    def write_metrics_for_job(self, user, job_template, job, owner=None, on_written=None):
+        if self.failures:
+            self.failures -= 1
+            return False
+        self.collected.append(job.job_id)
+        return True
+
+
+def pending_job_count(db_manager):
+    with db_manager.app.app_context():
+        return db_manager.db.session.execute(select(func.count()).select_from(PendingJob)).scalar()
+
+
+def tracked_job(db_manager, failures):
+    streamsets_manager = FlakyStreamSetsManager(db_manager, failures)
+    monitor = JobMonitor(streamsets_manager, registry=PendingJobRegistry(db_manager), estimator=object(),
+                         in_process=True, capture_progress=False)
+    monitored = MonitoredJob('user', 'template-id', f"job-{time()}", 'job', time())
+    monitor.registry.register(monitored, owner=monitor.worker_id)
+    with monitor._condition:
+        monitor._track(monitored, time())
+        monitor._queue.clear()
+    return monitor, monitored, streamsets_manager
+
+
+def test_failed_collection_keeps_the_pending_job_and_retries(db_manager):
+    monitor, monitored, streamsets_manager = tracked_job(db_manager, failures=1)
+
+    started = time()
+    monitor._collect_metrics(monitored)
+
+    assert pending_job_count(db_manager) == 1
+    assert monitored.job_id in monitor._tracked
+    next_check, _, queued = monitor._queue[0]
+    assert queued is monitored and next_check >= started + monitor.min_interval
+
+    monitor._collect_metrics(monitored)
+    assert streamsets_manager.collected == [monitored.job_id]
+
+
+def test_collection_gives_up_after_max_attempts(db_manager, monkeypatch):
+    monkeypatch.setattr(job_monitor, 'MONITOR_COLLECT_MAX_ATTEMPTS', 3)
+    monitor, monitored, _ = tracked_job(db_manager, failures=3)
+
+    for _ in range(3):
+        monitor._collect_metrics(monitored)
+
+    assert pending_job_count(db_manager) == 0
+    assert monitored.job_id not in monitor._tracked
+
+
+@pytest.mark.parametrize('elapsed', [0, 1, 1000])
+def test_jittered_poll_intervals_stay_within_bounds(db_manager, elapsed):
+    estimator = SimpleNamespace(estimate=lambda sch_job_template_id: DurationEstimate([]))
+    monitor = JobMonitor(FlakyStreamSetsManager(db_manager, 0), registry=PendingJobRegistry(db_manager),
+                         estimator=estimator, min_interval=2, max_interval=10, in_process=True,
+                         capture_progress=False)
+    now = time()
+    monitored = MonitoredJob('user', 'template-id', 'job-id', 'job', now - elapsed)
+    for _ in range(200):
+        assert 2 <= monitor._next_check_time(monitored, now) - now <= 10
+
+
+def test_discarded_monitors_are_not_kept_for_the_fork_hook(db_manager):
+    gc.collect()
+    before = len(job_monitor._monitors), len(progress_manager._hubs)
+    for _ in range(5):
+        tracked_job(db_manager, failures=0)
+    gc.collect()
+    assert (len(job_monitor._monitors), len(progress_manager._hubs)) == before
+
+
+def running_jobs(streamsets_manager, fake_sch, count, sch_job_template_id='template-id'):
+    template = fake_sch.job(sch_job_template_id)
+    jobs = streamsets_manager.start_job_instances(template, [{}] * count, 'Counter', None)
+    return [MonitoredJob('user', template.job_id, job.job_id, job.job_name, time(), job, template) for job in jobs]
+
+
+def poll(monitor, batch):
+    monitor._workers = ThreadPoolExecutor(max_workers=2)
+    monitor._poll(batch)
+    monitor._workers.shutdown(wait=True)
+
+
+def test_progress_is_only_captured_while_someone_watches(streamsets_manager, fake_sch):
+    monitor = streamsets_manager.monitor
+    batch = running_jobs(streamsets_manager, fake_sch, 3)
+    for monitored in batch:
+        monitor._tracked.add(monitored.job_id)
+
+    poll(monitor, batch)
+    assert fake_sch.calls['jobs.status'] == 1
+    assert fake_sch.calls['job.metrics'] == 0
+
+    subscription = streamsets_manager.progress_hub.subscribe()
+    try:
+        poll(monitor, batch)
+    finally:
+        streamsets_manager.progress_hub.unsubscribe(subscription)
+    assert fake_sch.calls['job.metrics'] == 3
+
+
+def pending(job_id, submitted_at=None):
+    return MonitoredJob('user', 'template-id', job_id, job_id, submitted_at or time())
+
+
+def test_claim_takes_unowned_and_expired_jobs(db_manager):
+    registry = PendingJobRegistry(db_manager)
+    registry.register(pending('unowned'))
+    registry.register(pending('leased'), owner='other')
+    PendingJobRegistry(db_manager, lease_secs=-1).register(pending('expired'), owner='gone')
+
+    claimed = registry.claim('me', limit=10)
+
+    assert {monitored.job_id for monitored in claimed} == {'unowned', 'expired'}
+    assert registry.renew('other') == {'leased'}
+    assert registry.renew('gone') == set()
+    assert [monitored.job_id for monitored in registry.claim('me', limit=10, exclude={'unowned'})] == ['expired']
+
+
+def test_claim_takes_at_most_limit_jobs(db_manager):
+    registry = PendingJobRegistry(db_manager)
+    for number in range(3):
+        registry.register(pending(f"job-{number}"))
+
+    assert len(registry.claim('first', limit=2)) == 2
+    assert len(registry.claim('second', limit=2)) == 1
+
+
+def test_only_the_owner_completes_or_releases_a_job(db_manager):
+    registry = PendingJobRegistry(db_manager)
+    registry.register(pending('job'), owner='me')
+
+    registry.complete('job', 'other')
+    assert pending_job_count(db_manager) == 1
+    registry.release('other')
+    assert registry.claim('other', limit=10) == []
+
+    registry.release('me')
+    assert [monitored.job_id for monitored in registry.claim('other', limit=10)] == ['job']
+    registry.complete('job', 'other')
+    assert pending_job_count(db_manager) == 0
+
+
+def test_one_status_request_per_batch(streamsets_manager, fake_sch, job_template):
+    monitor = streamsets_manager.monitor
+    batch = running_jobs(streamsets_manager, fake_sch, 6, job_template.sch_job_template_id)
+    finished = batch[0]
+    finished.job.duration = 0
+    for monitored in batch:
+        monitor.registry.register(monitored, owner=monitor.worker_id)
+        monitor._tracked.add(monitored.job_id)
+
+    poll(monitor, batch)
+    streamsets_manager.metrics_writer.flush()
+
+    assert fake_sch.calls['jobs.status'] == 1
+    assert {entry[2].job_id for entry in monitor._queue} == {monitored.job_id for monitored in batch[1:]}
+    assert monitor._tracked == {monitored.job_id for monitored in batch[1:]}
+    assert pending_job_count(db_manager=streamsets_manager.db_manager) == 5
+    with streamsets_manager.db_manager.app.app_context():
+        session = streamsets_manager.db_manager.db.session
+        assert session.execute(select(JobInstance.job_id)
+                               .where(JobInstance.job_template_id == job_template.job_template_id)).scalars().all() \
+            == [finished.job_id]
+
+
+def test_a_batch_takes_at_most_batch_size_due_jobs(streamsets_manager):
+    monitor = streamsets_manager.monitor
+    monitor.batch_size = 2
+    monitor._running = True
+    monitor._next_lease_renewal = time() + 60
+    with monitor._condition:
+        for number in range(3):
+            monitor._track(pending(f"due-{number}"), time() - 1)
+        monitor._track(pending('later'), time() + 60)
+
+    assert len(monitor._next_batch()) == 2
+    assert [monitored.job_id for monitored in monitor._next_batch()] == ['due-2']
+
+
+def add_runs(db_manager, job_template_id, durations, successful=True):
+    started = datetime(2024, 5, 1, 10)
+    with db_manager.app.app_context():
+        for number, duration in enumerate(durations):
+            start_time = started + timedelta(hours=number)
+            db_manager.db.session.add(JobInstance(
+                job_id=f"job-{number}", job_run_count=1, job_template_id=job_template_id, user_id='user',
+                engine_id='engine', pipeline_id='pipeline', successful_run=successful, input_record_count=0,
+                output_record_count=0, error_record_count=0, error_message='', start_time=start_time,
+                finish_time=start_time + timedelta(seconds=duration)))
+        db_manager.db.session.commit()
+
+
+def test_durations_are_estimated_from_recent_successful_runs(db_manager, job_template):
+    add_runs(db_manager, job_template.job_template_id, [60, 180, 120])
+    add_runs(db_manager, job_template.job_template_id, [1000], successful=False)
+    estimator = DurationEstimator(db_manager, sample_size=10)
+
+    estimate = estimator.estimate(job_template.sch_job_template_id)
+    assert (estimate.samples, estimate.median) == (3, 120)
+    assert estimator.estimate('no-such-template').median is None
+
+    # reused until it expires
+    add_runs(db_manager, job_template.job_template_id, [300, 300])
+    assert estimator.estimate(job_template.sch_job_template_id) is estimate
+    assert DurationEstimator(db_manager, sample_size=4).estimate(job_template.sch_job_template_id).samples == 4
@@ -0,0 +1,66 @@
+import os
+
+from log_manager import LogIndex, LogTailer
+
+
+def write_lines(path, lines, mode='a'):
+    with open(path, mode) as log:
+        for hour, job, message in lines:
+            log.write(f"2024-05-01 {hour:02d}:00:00,000 - INFO - Job: [{job}] {message}\n")
+
+
+def log_index(tmp_path):
+    log_file = str(tmp_path / 'ingesthub.log')
+    # small blocks, so a search only reads some of them
+    return log_file, LogIndex(log_file, f"{log_file}.index", block_bytes=128, backup_count=2)
+
+
+def messages(lines):
+    return [line.rsplit('] ', 1)[1] for line in lines]
+
+
+def test_search_across_a_rotation(tmp_path):
+    log_file, index = log_index(tmp_path)
+    write_lines(log_file, [(hour, 'job-a' if hour % 2 else 'job-b', f"line {hour}") for hour in range(10)])
+    assert messages(index.search('job-a')) == ['line 1', 'line 3', 'line 5', 'line 7', 'line 9']
+    indexed = index.stats()['indexed_bytes']
+
+    os.rename(log_file, f"{log_file}.1")
+    write_lines(log_file, [(10, 'job-a', 'line 10'), (11, 'job-b', 'line 11')])
+
+    assert messages(index.search('job-a', since='2024-05-01T07:00')) == ['line 7', 'line 9', 'line 10']
+    # the rotated file keeps its index entries, only the new file is indexed
+    assert index.stats()['indexed_bytes'] == indexed + os.path.getsize(log_file)
+    # a new LogIndex reads the saved index
+    assert messages(log_index(tmp_path)[1].search('job-b', until='2024-05-01T02:00')) == ['line 0', 'line 2']
+
+
+def test_search_after_the_log_file_was_truncated(tmp_path):
+    log_file, index = log_index(tmp_path)
+    write_lines(log_file, [(hour, 'job-a', f"old {hour}") for hour in range(6)])
+    assert len(index.search('job-a')) == 6
+
+    write_lines(log_file, [(12, 'job-a', 'new 12')], mode='w')
+    assert messages(index.search('job-a')) == ['new 12']
+
+    # growing past the old size with different content, e.g. a new file reusing the inode
+    write_lines(log_file, [(hour, 'job-c', f"new {hour}") for hour in range(13, 23)], mode='w')
+    assert index.search('job-a') == []
+    assert len(index.search('job-c')) == 10
+
+
+def test_a_stopped_tailer_ends_its_feeds_and_restarts_on_subscribe(tmp_path):
+    log_file = str(tmp_path / 'ingesthub.log')
+    write_lines(log_file, [(0, 'job-a', 'line 0')])
+    tailer = LogTailer(log_file)
+    subscription = tailer.subscribe()
+    thread = tailer._thread
+
+    tailer.stop()
+
+    assert not thread.is_alive()
+    assert subscription.closed and tailer.subscriber_count() == 0
+    assert tailer._thread is None and tailer._file is None
+    tailer.subscribe()
+    assert tailer._thread.is_alive()
+    tailer.stop()
@@ -0,0 +1,52 @@
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from sqlalchemy import event, select, update
+
+from db_manager import JobInstance, PendingJob
+from job_monitor import MonitoredJob, PendingJobRegistry
+from metrics_manager import JobMetricsWriter
+
+
+def job_run(job_id):
+    start_time = datetime(2024, 5, 1, 10)
+    return {'job_id': job_id, 'job_run_count': 1, 'user_id': 'user', 'engine_id': 'engine', 'pipeline_id': 'pipeline',
+            'successful_run': True, 'input_record_count': 0, 'output_record_count': 0, 'error_record_count': 0,
+            'error_message': '', 'start_time': start_time, 'finish_time': start_time + timedelta(seconds=60)}
+
+
+def written_job_ids(db_manager, job_ids):
+    with db_manager.app.app_context():
+        return set(db_manager.db.session.execute(
+            select(JobInstance.job_id).where(JobInstance.job_id.in_(job_ids))).scalars())
+
+
+def test_a_job_taken_over_before_its_pending_job_is_deleted_is_left_to_its_new_owner(db_manager, job_template):
+    kept, taken_over = f"job-{uuid4()}", f"job-{uuid4()}"
+    registry = PendingJobRegistry(db_manager)
+    for job_id in (kept, taken_over):
+        registry.register(MonitoredJob('user', job_template.sch_job_template_id, job_id, job_id, 0), owner='me')
+    writer = JobMetricsWriter(db_manager)
+    results = {}
+    for job_id in (kept, taken_over):
+        writer.add(job_run(job_id), job_template.sch_job_template_id, job_id, 'me',
+                   on_written=lambda written, job_id=job_id: results.setdefault(job_id, written))
+
+    def take_over(execute_state):
+        # another monitor reclaims the job between the owner check and the delete
+        if execute_state.is_delete and not results.get('taken over'):
+            results['taken over'] = True
+            with db_manager.db.engine.begin() as connection:
+                connection.execute(update(PendingJob).where(PendingJob.job_id == taken_over).values(lease_owner='other'))
+
+    with db_manager.app.app_context():
+        event.listen(db_manager.db.session, 'do_orm_execute', take_over)
+        try:
+            writer.flush()
+        finally:
+            event.remove(db_manager.db.session, 'do_orm_execute', take_over)
+    writer.stop()
+
+    assert (results[kept], results[taken_over]) == (True, False)
+    assert written_job_ids(db_manager, [kept, taken_over]) == {kept}
+    assert registry.renew('other') == {taken_over}
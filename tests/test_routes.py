@@ -0,0 +1,87 @@
+from itertools import count
+
+import pytest
+from sqlalchemy import select
+
+import ingest_hub
+from db_manager import User
+from fake_controlhub import FakeControlHub
+
+_users = count(1)
+
+
+@pytest.fixture(scope='module')
+def app():
+    app = ingest_hub.create_app()
+    app.config['WTF_CSRF_ENABLED'] = False
+    return app
+
+
+@pytest.fixture
+def client(app):
+    # registering logs the new user in
+    client = app.test_client()
+    user = next(_users)
+    client.post('/register', data={'name': f"user{user}", 'email': f"user{user}@example.com", 'password': 'secret'})
+    with app.app_context():
+        client.user_id = app.extensions['ingest_hub'].db_manager.db.session.execute(
+            select(User.id).where(User.email == f"user{user}@example.com")).scalar()
+    return client
+
+
+@pytest.mark.parametrize('token', [None, 'wrong'])
+def test_template_cache_needs_the_admin_token(client, monkeypatch, token):
+    monkeypatch.setattr(ingest_hub, 'ADMIN_TOKEN', 'admin-secret')
+    headers = {ingest_hub.ADMIN_TOKEN_HEADER: token} if token else {}
+    assert client.post('/admin/template-cache', headers=headers).status_code == 403
+
+
+def test_template_cache_is_disabled_without_an_admin_token(client, monkeypatch):
+    monkeypatch.setattr(ingest_hub, 'ADMIN_TOKEN', None)
+    assert client.get('/admin/template-cache', headers={ingest_hub.ADMIN_TOKEN_HEADER: 'anything'}).status_code == 403
+
+
+def test_template_cache_with_the_admin_token(client, monkeypatch):
+    monkeypatch.setattr(ingest_hub, 'ADMIN_TOKEN', 'admin-secret')
+    response = client.post('/admin/template-cache', headers={ingest_hub.ADMIN_TOKEN_HEADER: 'admin-secret'})
+    assert response.status_code == 200
+    assert set(response.get_json()) == {'templates', 'forms'}
+
+
+@pytest.mark.parametrize('query', ['after=garbage', 'before=2024-13-01T00:00:00,1', 'after=,x', 'page=5'])
+def test_jobs_shows_the_first_page_without_a_valid_cursor(client, query):
+    response = client.get(f"/jobs?{query}")
+    assert response.status_code == 200
+    assert 'page 1 of' in response.get_data(as_text=True)
+
+
+def test_log_search_rejects_invalid_timestamps(client):
+    response = client.get('/logs/search?since=yesterday')
+    assert response.status_code == 400
+    assert 'Invalid timestamp' in response.get_json()['error']
+
+
+def test_log_search_reports_other_errors_as_server_errors(app, client, monkeypatch):
+    def search(*args):
+        raise ValueError("corrupt index")
+    monkeypatch.setattr(app.extensions['ingest_hub'].log_index, 'search', search)
+    assert client.get('/logs/search?since=2024-05-01T10:00').status_code == 500
+
+
+def test_a_failed_submit_keeps_the_wizard(app, client, monkeypatch):
+    components = app.extensions['ingest_hub']
+    fake_sch = FakeControlHub(failure_rate=1)
+    monkeypatch.setattr(components.streamsets_manager.client, '_sch', fake_sch)
+    wizard = components.wizard_store.create(client.user_id, source='SRC', sch_job_template_id='template-id',
+                                            source_configs={'Dir': '/in'}, target_configs={'Table': 'out'},
+                                            instance_name_suffix='Counter')
+
+    response = client.get(f"/submit-job?wizard={wizard}")
+    assert '/job-suffix' in response.headers['Location']
+    assert components.wizard_store.get(wizard, client.user_id).submitted is False
+
+    fake_sch.failure_rate = 0
+    response = client.get(f"/submit-job?wizard={wizard}")
+    assert '/jobs' in response.headers['Location']
+    assert fake_sch.calls['start_job_template'] == 1
+    assert components.wizard_store.get(wizard, client.user_id) is None
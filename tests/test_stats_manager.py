@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+import pytest
+from sqlalchemy import select
+
+from db_manager import JobStatsRollup
+from metrics_manager import JobMetricsWriter
+from stats_manager import JobStats, STATS_COUNTERS, STATS_DURATION_BUCKETS, bucket_start
+
+
+def job_run(user_id, engine_id, start_time, duration_secs, successful=True):
+    return {'job_id': f"job-{uuid4()}", 'job_run_count': 1, 'user_id': user_id, 'engine_id': engine_id,
+            'pipeline_id': 'pipeline', 'successful_run': successful, 'input_record_count': 100,
+            'output_record_count': 90, 'error_record_count': 10, 'error_message': '', 'start_time': start_time,
+            'finish_time': start_time + timedelta(seconds=duration_secs)}
+
+
+def rollups(db_manager, user_id):
+    with db_manager.app.app_context():
+        rows = db_manager.db.session.execute(
+            select(JobStatsRollup).where(JobStatsRollup.dimension == 'user',
+                                         JobStatsRollup.dimension_value == user_id)).scalars().all()
+        return {(row.period, row.bucket_start): {column: getattr(row, column) for column in STATS_COUNTERS}
+                for row in rows}
+
+
+def test_bucket_start():
+    timestamp = datetime(2024, 5, 1, 10, 42, 7, 123)
+    assert bucket_start(timestamp, 'hour') == datetime(2024, 5, 1, 10)
+    assert bucket_start(timestamp, 'day') == datetime(2024, 5, 1)
+
+
+def test_runs_are_totalled_per_hour_and_day():
+    started = datetime(2024, 5, 1, 10, 5)
+    deltas = JobStats.deltas([job_run('alice', 'engine-1', started, 20),
+                              job_run('alice', 'engine-1', started + timedelta(minutes=30), 50, successful=False),
+                              job_run('alice', 'engine-2', started + timedelta(hours=1), 7200)])
+
+    hour = deltas[('user', 'alice', 'hour', datetime(2024, 5, 1, 10))]
+    assert (hour['run_count'], hour['successful_run_count'], hour['duration_secs']) == (2, 1, 70)
+    assert (hour['runs_under_30s'], hour['runs_under_1m']) == (1, 1)
+    day = deltas[('user', 'alice', 'day', datetime(2024, 5, 1))]
+    assert (day['run_count'], day['input_record_count'], day['runs_under_2h']) == (3, 300, 1)
+    assert deltas[('engine', 'engine-2', 'hour', datetime(2024, 5, 1, 11))]['run_count'] == 1
+
+
+def test_percentiles_interpolate_within_duration_buckets():
+    histogram = [2, 2] + [0] * (len(STATS_DURATION_BUCKETS) - 2)
+    assert JobStats.percentile(histogram, 0.5) == 30
+    assert JobStats.percentile(histogram, 0.9) == 54
+    assert JobStats.percentile([0] * (len(STATS_DURATION_BUCKETS) - 1) + [3], 0.99) == 86400
+    assert JobStats.percentile([0] * len(STATS_DURATION_BUCKETS), 0.5) is None
+
+
+@pytest.mark.parametrize('upsert', [True, False])
+def test_rollups_written_with_the_metrics_match_a_rebuild(db_manager, job_template, monkeypatch, upsert):
+    user_id = f"user-{uuid4()}"
+    started = datetime(2024, 5, 1, 22, 30)
+    writer = JobMetricsWriter(db_manager, flush_records=2)
+    if not upsert:
+        # the update-then-insert path of databases without INSERT .. ON CONFLICT
+        monkeypatch.setattr(writer.job_stats, '_upsert', lambda dialect_name: None)
+    for number, duration in enumerate([10, 45, 400, 5000, 90000]):
+        writer.add(job_run(user_id, 'engine-1', started + timedelta(hours=number), duration, successful=number != 2),
+                   job_template.sch_job_template_id)
+        # several flushes, so later runs are added to existing rollups
+        writer.flush()
+    writer.stop()
+    written = rollups(db_manager, user_id)
+
+    JobStats(db_manager).rebuild()
+
+    assert rollups(db_manager, user_id) == written
+    assert written[('day', datetime(2024, 5, 1))]['run_count'] == 2
+    assert written[('day', datetime(2024, 5, 2))]['run_count'] == 3
+    summary, *_ = JobStats(db_manager).summary('user', datetime(2024, 5, 1), datetime(2024, 5, 3),
+                                               dimension_value=user_id)
+    assert (summary[0]['runs'], summary[0]['successful_runs'], summary[0]['input_records']) == (5, 4, 500)
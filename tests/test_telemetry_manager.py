@@ -0,0 +1,50 @@
+import json
+import os
+import subprocess
+import sys
+
+from telemetry_manager import MetricsRegistry, METRICS_ARCHIVE_FILE
+
+
+def registry_with_metrics(metrics_dir):
+    registry = MetricsRegistry(metrics_dir=str(metrics_dir))
+    requests = registry.counter('test_requests_total', 'Requests', labels=('route',))
+    registry.gauge('test_queue_depth', 'Queue depth', lambda: 7)
+    return registry, requests
+
+
+def write_process_file(metrics_dir, process_key, requests, queue_depth):
+    with open(metrics_dir / f"{process_key}.json", 'w') as file:
+        json.dump({'test_requests_total': [[['jobs'], [requests]]], 'test_queue_depth': [[[], [queue_depth]]]}, file)
+
+
+def exited_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def test_exited_processes_are_folded_into_the_archive(tmp_path):
+    registry, requests = registry_with_metrics(tmp_path)
+    requests.inc('jobs', amount=2)
+    write_process_file(tmp_path, f"{exited_pid()}-1", requests=5, queue_depth=3)
+    # a live PID whose start time doesn't match was reused by another process
+    write_process_file(tmp_path, f"{os.getppid()}-1", requests=11, queue_depth=4)
+    before = registry.render()
+
+    registry.fold_exited()
+
+    assert sorted(os.listdir(tmp_path)) == [METRICS_ARCHIVE_FILE, 'metrics.lock']
+    assert registry.render() == before
+    assert 'test_requests_total{route="jobs"} 18' in before
+    assert 'test_queue_depth 7' in before
+
+
+def test_a_new_process_with_a_reused_pid_keeps_the_totals(tmp_path):
+    registry, requests = registry_with_metrics(tmp_path)
+    write_process_file(tmp_path, f"{os.getpid()}-1", requests=5, queue_depth=3)
+    requests.inc('jobs')
+    registry.save()
+    registry.fold_exited()
+
+    assert 'test_requests_total{route="jobs"} 6' in registry.render()
@@ -0,0 +1,18 @@
+import pytest
+
+from wizard_manager import WizardStore
+
+
+@pytest.mark.parametrize('store', ['memory', 'database'])
+def test_a_wizard_is_marked_submitted_once(db_manager, store):
+    wizard_store = WizardStore(db_manager, store=store)
+    wizard = wizard_store.create(7, source='SRC', sch_job_template_id='template-id')
+
+    assert wizard_store.mark_submitted(wizard, 8) is None
+    assert wizard_store.mark_submitted(wizard, 7).submitted is True
+    assert wizard_store.mark_submitted(wizard, 7) is None
+
+    wizard_store.update(wizard, 7, submitted=False)
+    assert wizard_store.mark_submitted(wizard, 7) is not None
+    wizard_store.delete(wizard)
+    assert wizard_store.mark_submitted(wizard, 7) is None
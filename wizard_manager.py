@@ -0,0 +1,131 @@
+import os
+import secrets
+from collections import namedtuple
+from datetime import datetime, timedelta
+from threading import Lock
+from time import monotonic
+
+from sqlalchemy import select, update, delete
+
+from cache_manager import TTLCache
+from db_manager import WizardSession
+from ingesthub_logger import Logger
+
+# how long an unfinished job submission is kept, renewed by every step
+WIZARD_STATE_TTL_SECS = int(os.environ.get('WIZARD_STATE_TTL_SECS', 60 * 60))
+# max number of unfinished job submissions kept in memory, the least recently used ones are dropped first
+WIZARD_STATE_MAX_ENTRIES = int(os.environ.get('WIZARD_STATE_MAX_ENTRIES', 10000))
+# 'memory' (single process) or 'database', shared by every worker process (gunicorn.conf.py defaults to it)
+WIZARD_STATE_STORE = os.environ.get('WIZARD_STATE_STORE', 'memory')
+# how often expired job submissions are deleted from the database
+WIZARD_STATE_PURGE_SECS = 5 * 60
+
+# The choices made so far in the job submission wizard (templates -> source -> target -> job suffix -> submit);
+# submitted while its jobs are being started
+WizardState = namedtuple('WizardState', [
+    'user_id', 'source', 'destination', 'sch_job_template_id', 'source_configs', 'target_configs',
+    'instance_name_suffix', 'suffix_parameter_name', 'submitted'], defaults=[None] * 6 + [False])
+
+
+# Server-side state of the job submission wizard, keyed by a short random token carried from step to step.
+# A state is only returned to the user who started it.
+class WizardStore:
+    def __init__(self, db_manager=None, store=WIZARD_STATE_STORE, ttl=WIZARD_STATE_TTL_SECS,
+                 max_entries=WIZARD_STATE_MAX_ENTRIES):
+        self.logger = Logger()
+        self.db_manager = db_manager
+        self.store = store
+        self.ttl = ttl
+        if store not in ('memory', 'database'):
+            raise ValueError(f"Unsupported wizard state store '{store}', expected 'memory' or 'database'")
+        self.states = TTLCache(maxsize=max_entries, ttl=ttl) if store == 'memory' else None
+        self._purged_at = monotonic()
+        self._submit_lock = Lock()
+
+    def create(self, user_id, **values):
+        token = secrets.token_urlsafe(16)
+        self._put(token, WizardState(user_id, **values))
+        return token
+
+    def get(self, token, user_id):
+        if not token:
+            return None
+        state = self.states.get(token) if self.states is not None else self._load(token)
+        if state is None or state.user_id != user_id:
+            return None
+        return state
+
+    def update(self, token, user_id, **values):
+        # Returns the updated state, or None if it expired (or belongs to another user)
+        state = self.get(token, user_id)
+        if state is None:
+            return None
+        state = state._replace(**values)
+        self._put(token, state)
+        return state
+
+    def mark_submitted(self, token, user_id):
+        # Returns the state if this call marked it submitted, None if it expired or was already submitted, so that
+        # concurrent submits of the same wizard (e.g. a double click) start its jobs once
+        if self.states is not None:
+            with self._submit_lock:
+                state = self.get(token, user_id)
+                if state is None or state.submitted:
+                    return None
+                state = state._replace(submitted=True)
+                self.states.put(token, state)
+                return state
+        with self.db_manager.app.app_context():
+            session = self.db_manager.db.session
+            try:
+                row = session.execute(
+                    select(WizardSession.state, WizardSession.expires_at)
+                    .where(WizardSession.token == token, WizardSession.expires_at >= datetime.now())).first()
+                state = WizardState(**row.state) if row else None
+                if state is None or state.user_id != user_id or state.submitted:
+                    return None
+                state = state._replace(submitted=True)
+                # only if no other process updated the state since it was read, every update renews expires_at
+                marked = session.execute(
+                    update(WizardSession)
+                    .where(WizardSession.token == token, WizardSession.expires_at == row.expires_at)
+                    .values(state=state._asdict())).rowcount
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+        return state if marked else None
+
+    def delete(self, token):
+        if self.states is not None:
+            self.states.invalidate(token)
+        else:
+            with self.db_manager.app.app_context():
+                session = self.db_manager.db.session
+                session.execute(delete(WizardSession).where(WizardSession.token == token))
+                session.commit()
+
+    def _put(self, token, state):
+        if self.states is not None:
+            self.states.put(token, state)
+            return
+        now = datetime.now()
+        with self.db_manager.app.app_context():
+            session = self.db_manager.db.session
+            try:
+                session.merge(WizardSession(token=token, user_id=str(state.user_id), state=state._asdict(),
+                                            expires_at=now + timedelta(seconds=self.ttl)))
+                if monotonic() - self._purged_at > WIZARD_STATE_PURGE_SECS:
+                    self._purged_at = monotonic()
+                    session.execute(delete(WizardSession).where(WizardSession.expires_at < now))
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+
+    def _load(self, token):
+        with self.db_manager.app.app_context():
+            row = self.db_manager.db.session.execute(
+                select(WizardSession.state).where(WizardSession.token == token,
+                                                  WizardSession.expires_at >= datetime.now())).first()
+        return WizardState(**row.state) if row else None